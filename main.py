@@ -1,3 +1,4 @@
+import signal
 import logging
 import threading
 from contextlib import asynccontextmanager
@@ -6,37 +7,54 @@ from fastapi import FastAPI, status
 from fastapi.responses import ORJSONResponse
 from pydantic import ValidationError
 
-from router.route import module_router, sms_router, schedule_router
+from router.route import module_router, sms_router, notification_router, schedule_router, metrics_router, \
+    health_router
 from services import scheduler
+from services.owner import modem_owner
+from services.sms_stream import sms_stream
 from schemas.schemas import ErrorModel, ErrorDetail
-from services.initialize import sms_listener, initialize_module
+from services.utils.config_parser import config
+from services.utils.ipc import IPCError
+from services.utils.modem_session import ModemBusy, DeadlineExceeded, UnknownModem, ModemNotReady
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 logger = logging.getLogger("PyAirLink")
 
 
+def _close_streams_on_exit():
+    """
+    uvicorn 收到退出信号后等待所有连接结束才执行 lifespan 的退出部分，
+    在它的信号处理函数之前先结束 /api/v1/sms/stream 的推送连接，否则退出会一直等待
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        handler = signal.getsignal(sig)
+        if callable(handler):
+            signal.signal(sig, lambda signum, frame, handler=handler: (sms_stream.close(), handler(signum, frame)))
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    scheduler.start()
-    initialize_module()
-    stop_event = threading.Event()
-    sms_thread = threading.Thread(target=sms_listener, args=(stop_event,), daemon=True)
-    sms_thread.start()
-    logger.info("sms_listener started")
+    _close_streams_on_exit()
+    # 调度器先以暂停状态启动，只有持有模块的 owner 进程执行定时任务，worker 进程只读写任务存储
+    scheduler.start(paused=True)
+    modem_owner.start()
     try:
         yield
     finally:
         if scheduler.running:
             scheduler.shutdown()
-        stop_event.set()
-        sms_thread.join()
-        logger.info("sms_listener stopped")
+        modem_owner.stop()
 
 
 app = FastAPI(lifespan=lifespan, title='PyAirLink API', version='0.0.1')
 app.include_router(module_router)
 app.include_router(sms_router)
+app.include_router(notification_router)
 app.include_router(schedule_router)
+app.include_router(metrics_router)
+app.include_router(health_router)
 
 
 @app.exception_handler(ValidationError)
@@ -48,6 +66,50 @@ async def validation_exception_handler(exc: ValidationError):
     )
 
 
+@app.exception_handler(ModemBusy)
+async def modem_busy_exception_handler(request, exc: ModemBusy):
+    return ORJSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"status": "error", "message": str(exc)},
+        headers={"Retry-After": "1"}
+    )
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_exception_handler(request, exc: DeadlineExceeded):
+    return ORJSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content={"status": "error", "message": str(exc)}
+    )
+
+
+@app.exception_handler(ModemNotReady)
+async def modem_not_ready_exception_handler(request, exc: ModemNotReady):
+    return ORJSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "error", "message": str(exc)},
+        headers={"Retry-After": "5"}
+    )
+
+
+@app.exception_handler(UnknownModem)
+async def unknown_modem_exception_handler(request, exc: UnknownModem):
+    return ORJSONResponse(
+        status_code=status.HTTP_404_NOT_FOUND,
+        content={"status": "error", "message": exc.args[0]}
+    )
+
+
+@app.exception_handler(IPCError)
+async def ipc_error_exception_handler(request, exc: IPCError):
+    # owner 进程重启或切换期间，稍后重试即可
+    return ORJSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "error", "message": str(exc)},
+        headers={"Retry-After": "1"}
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=10103, reload=False)
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=10103, reload=False, workers=config.server().get('workers'))
\ No newline at end of file
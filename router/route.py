@@ -1,12 +1,26 @@
-from typing import List, Annotated
+import uuid
+import asyncio
+from datetime import datetime
+from typing import List, Annotated, Optional
 
-from fastapi import APIRouter, Depends, Query
-from fastapi.responses import ORJSONResponse
+import orjson
+from fastapi import APIRouter, Depends, Query, Request, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 
 from services import scheduler
 from schemas import schemas
-from services.initialize import send_sms, web_send_at_command, web_restart
+from services.initialize import send_sms, web_restart, async_send_sms, async_web_send_at_command, async_web_restart
 from services.utils.commands import at_commands
+from services.inbox import inbox
+from services.outbox import outbox
+from services.sms_outbox import sms_outbox
+from services.delivery import delivery_tracker
+from services.modem_status import modem_status
+from services.owner import modem_owner
+from services.sms_stream import sms_stream, STREAM_TOPICS, SlowConsumer
+from services.utils.events import SMS_RECEIVED, DELIVERY_REPORT
+from services.utils.modem_session import get_modem, modems, ModemState, UnknownModem
+from services.utils.metrics import registry
 
 module_router = APIRouter(
     prefix="/api/v1/module",
@@ -20,12 +34,40 @@ sms_router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+notification_router = APIRouter(
+    prefix="/api/v1/notification",
+    tags=["notification"],
+    responses={404: {"description": "Not found"}},
+)
+
 schedule_router = APIRouter(
     prefix="/api/v1/schedule",
     tags=["schedule"],
     responses={404: {"description": "Not found"}},
 )
 
+metrics_router = APIRouter(
+    tags=["metrics"],
+)
+
+health_router = APIRouter(
+    tags=["health"],
+)
+
+
+async def until_disconnected(request: Request, coro):
+    """
+    等待指令完成，HTTP客户端提前断开时取消等待，尚未执行的指令会被跳过
+    """
+    task = asyncio.ensure_future(coro)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=0.5)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            return ORJSONResponse(status_code=499, content={"status": "error", "message": "client disconnected"})
+
 
 @module_router.post("/command/base", response_model=schemas.CommandResponse, summary='执行任意AT命令',
                    description=
@@ -33,33 +75,291 @@ schedule_router = APIRouter(
 需要自己拼接所有参数
 """
                    )
-async def command_base(params: Annotated[schemas.CommandBaseRequest, Query()]):
-    response = web_send_at_command(at_commands.base(params.command), keywords=params.keyword, timeout=params.timeout)
+async def command_base(request: Request, params: Annotated[schemas.CommandBaseRequest, Query()]):
+    response = await until_disconnected(request, async_web_send_at_command(
+        at_commands.base(params.command), keywords=params.keyword, timeout=params.timeout, deadline=params.deadline,
+        modem_id=params.modem))
+    if isinstance(response, ORJSONResponse):
+        return response
     return {'status': 'success' if response else 'failure', 'content': response}
 
 
 @module_router.post("/command/restart", response_model=schemas.CommandResponse, summary='重启模块',
                    description=
 """
+重启后由后台重新初始化模块，等待至多 ATTACH_TIMEOUT 秒直到模块重新附着网络
 """
                    )
-async def command_reset():
-    response = web_restart()
+async def command_reset(modem: Optional[str] = Query(default=None, description="模块id，不传则使用默认模块")):
+    response = await async_web_restart(modem_id=modem)
     return {'status': 'success' if response else 'failure', 'content': ''}
 
 
+@module_router.get("/queue", response_model=schemas.QueueStatus, summary='查看指令队列',
+                   description=
+"""
+查看模块指令队列的积压情况，saturated 为 true 时新的指令会返回429
+"""
+                   )
+async def queue_status(modem: Optional[str] = Query(default=None, description="模块id，不传则使用默认模块")):
+    return await get_modem(modem).async_queue_stats()
+
+
+@module_router.get("/status", response_model=schemas.ModemStatus, summary='查看模块状态',
+                   description=
+"""
+信号、网络注册、运营商、GPRS附着、ICCID/IMSI 和短信存储占用，由后台每 REFRESH_INTERVAL 秒查询一次，
+这里直接返回缓存，不占用串口。
+响应带 ETag，请求头 If-None-Match 与之相同时返回304；stale 为 true 表示数据已过期(模块可能无响应)
+"""
+                   )
+async def module_status(request: Request,
+                        modem: Optional[str] = Query(default=None, description="模块id，不传则使用默认模块")):
+    status, etag = modem_status.get(modem)
+    if status is None:
+        return ORJSONResponse(status_code=503, content={"status": "error", "message": "Modem status not collected yet"},
+                              headers={"Retry-After": "5"})
+    headers = {'ETag': etag, 'Cache-Control': f'max-age={max(0, int(modem_status.interval - status["age"]))}'}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(content=status, headers=headers)
+
+
+@module_router.get("/list", response_model=List[schemas.ModemInfo], summary='查看所有模块',
+                   description=
+"""
+配置中的所有模块及其连接、初始化状态
+"""
+                   )
+async def list_modems():
+    stats = await asyncio.gather(*(modem.async_queue_stats() for modem in modems.values()))
+    return [{'id': modem_id, 'port': modem.port, 'connected': modem.connected,
+             'queue_depth': queue['depth'], 'state': modem.state.value}
+            for (modem_id, modem), queue in zip(modems.items(), stats)]
+
+
 @sms_router.post("/sms/send", response_model=schemas.CommandResponse, summary='发送短信',
                    description=
 """
-尚未支持长短信，不要大于70个字符
+内容全部在 GSM 7-bit 字母表中时单条最多160个字符(扩展字符 []{}€ 等占两个)，含中文等其他字符时单条最多70个字符。
+超出时按长短信分段发送(每段153/67个字符)，最多255段
 """
                    )
-async def immediately_send_sms(params: Annotated[schemas.SendSMSRequest, Query()]):
-    response = send_sms(f'+{params.country}{params.number}', text=params.message)
+async def immediately_send_sms(request: Request, params: Annotated[schemas.SendSMSRequest, Query()]):
+    response = await until_disconnected(request, async_send_sms(f'+{params.country}{params.number}', text=params.message,
+                                                                modem_id=params.modem))
+    if isinstance(response, ORJSONResponse):
+        return response
     return {'status': 'success' if response else 'failure',
             'content': f'to:+{params.country}{params.number}, message:{params.message}'}
 
 
+@sms_router.post("/bulk", response_model=schemas.BulkSendResponse, summary='批量发送短信',
+                   description=
+"""
+写入持久化的发送队列后立即返回批次id，由后台按 [BULK] 的速率限制逐条发送，失败的会自动重试。
+每个收件人可以单独指定内容，发送状态通过 /bulk/{batch_id} 查询
+"""
+                   )
+# 读写数据库的接口声明为普通函数，由 FastAPI 在线程池中执行，等待数据库锁时不阻塞事件循环
+def bulk_send_sms(params: schemas.BulkSendRequest):
+    modem = get_modem(params.modem)
+    batch_id = uuid.uuid4().hex
+    items = [(f'+{recipient.country}{recipient.number}', recipient.message or params.message)
+             for recipient in params.recipients]
+    return {'batch_id': batch_id, 'accepted': sms_outbox.add(batch_id, modem.modem_id, items)}
+
+
+@sms_router.get("/bulk/{batch_id}", response_model=schemas.BulkStatus, summary='查看批量发送状态',
+                   description=
+"""
+返回各状态的条数和每个收件人的发送状态，按写入顺序分页，翻页时把上一页返回的 next_after 作为 after 参数
+"""
+                   )
+def get_bulk_status(batch_id: str,
+                    status: Optional[str] = Query(default=None, pattern='^(pending|sending|sent|failed)$'),
+                    recipient: Optional[str] = Query(default=None, description="收件人，如 +8613800138000"),
+                    after: Optional[int] = Query(default=None, description="只返回id大于该值的记录"),
+                    limit: int = Query(default=100, ge=1, le=1000)):
+    counts = sms_outbox.counts(batch_id)
+    if not counts:
+        return ORJSONResponse(status_code=404, content={"status": "fail", "message": f"batch {batch_id} not found"})
+    items = sms_outbox.items(batch_id, status=status, recipient=recipient, after=after, limit=limit)
+    deliveries = delivery_tracker.for_outbox([item['id'] for item in items])
+    for item in items:
+        item['delivery'], item['reported_at'] = deliveries.get(item['id'], (None, None))
+    return {'batch_id': batch_id, 'counts': counts, 'items': items,
+            'next_after': items[-1]['id'] if len(items) == limit else None}
+
+
+@sms_router.get("/deliveries", response_model=List[schemas.DeliveryItem], summary='查看送达状态',
+                   description=
+"""
+需要在配置中开启 [SMS] DELIVERY_REPORT。长短信每段一条记录，按发送时间倒序。
+送达所用时间的分布见 /metrics 中的 pyairlink_sms_delivery_seconds
+"""
+                   )
+def list_deliveries(modem: Optional[str] = Query(default=None, description="模块id，不传则查询所有模块"),
+                    recipient: Optional[str] = Query(default=None, description="收件人，如 +8613800138000"),
+                    limit: int = Query(default=100, ge=1, le=1000)):
+    return delivery_tracker.list(modem_id=modem, recipient=recipient, limit=limit)
+
+
+def _stream_topics(events):
+    topics = [topic.strip() for topic in events.split(',') if topic.strip()]
+    unknown = set(topics) - set(STREAM_TOPICS)
+    if unknown or not topics:
+        raise ValueError(f"Unknown events: {', '.join(sorted(unknown)) or events}, "
+                         f"expected some of {', '.join(STREAM_TOPICS)}")
+    return topics
+
+
+def _stream_message(topic, data):
+    """
+    与 /inbox、/deliveries 的返回格式一致，短信带上 id 用于续传
+    """
+    if topic == SMS_RECEIVED:
+        return data['id'], schemas.InboxMessage(**data).model_dump(mode='json')
+    if topic == DELIVERY_REPORT:
+        return None, schemas.DeliveryItem(**data).model_dump(mode='json')
+    return None, data
+
+
+@sms_router.get("/stream", summary='实时推送收到的短信(SSE)', response_class=StreamingResponse,
+                   description=
+"""
+以 Server-Sent Events 实时推送写入收件箱的短信，格式与 /inbox 一致，事件的 id 即短信 id。
+events 可选 sms(短信)、delivery(状态报告)、modem_state(模块状态变化)，逗号分隔。
+断线重连时浏览器 EventSource 会带上 Last-Event-ID，也可以通过 after 参数指定，先补发之后的短信再推送新短信。
+客户端读取过慢积压超过 [STREAM] BUFFER 条时，推送 overflow 事件后断开，重连后按最后的 id 续传。
+同一路径也接受 WebSocket 连接，每条消息为 {"event", "id", "data"} 的JSON
+"""
+                   )
+async def sms_stream_sse(events: str = Query(default=SMS_RECEIVED, description="订阅的事件，逗号分隔"),
+                         modem: Optional[str] = Query(default=None, description="模块id，不传则推送所有模块"),
+                         after: Optional[int] = Query(default=None, description="续传，先补发id大于该值的短信"),
+                         last_event_id: Optional[int] = Header(default=None)):
+    try:
+        topics = _stream_topics(events)
+        if modem:
+            get_modem(modem)
+    except ValueError as e:
+        return ORJSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+    after = after if after is not None else last_event_id
+
+    async def generate():
+        async with sms_stream.subscribe(topics, modem, after) as subscription:
+            yield 'retry: 3000\n\n'
+            try:
+                async for item in subscription.stream():
+                    if item is None:
+                        yield ': ping\n\n'
+                        continue
+                    event_id, data = _stream_message(*item)
+                    yield (f'id: {event_id}\n' if event_id is not None else '') + \
+                        f'event: {item[0]}\ndata: {orjson.dumps(data).decode()}\n\n'
+            except SlowConsumer as e:
+                yield f'event: overflow\ndata: {orjson.dumps({"message": str(e)}).decode()}\n\n'
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@sms_router.websocket("/stream")
+async def sms_stream_websocket(websocket: WebSocket,
+                               events: str = Query(default=SMS_RECEIVED),
+                               modem: Optional[str] = Query(default=None),
+                               after: Optional[int] = Query(default=None)):
+    try:
+        topics = _stream_topics(events)
+        if modem:
+            get_modem(modem)
+    except (ValueError, UnknownModem) as e:
+        await websocket.close(code=1008, reason=e.args[0])
+        return
+
+    async def forward(subscription):
+        try:
+            async for item in subscription.stream():
+                if item is None:
+                    await websocket.send_text('{"event":"ping"}')
+                    continue
+                event_id, data = _stream_message(*item)
+                await websocket.send_text(orjson.dumps({'event': item[0], 'id': event_id, 'data': data}).decode())
+        except SlowConsumer as e:
+            # 1013 Try Again Later
+            await websocket.close(code=1013, reason=str(e))
+        except WebSocketDisconnect:
+            pass
+
+    async def receive():
+        # 客户端不需要发送消息，读取只用于及时发现连接断开并取消订阅
+        while (await websocket.receive())['type'] != 'websocket.disconnect':
+            pass
+
+    await websocket.accept()
+    async with sms_stream.subscribe(topics, modem, after) as subscription:
+        tasks = {asyncio.create_task(forward(subscription)), asyncio.create_task(receive())}
+        _, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+
+
+@sms_router.get("/inbox", response_model=schemas.InboxPage, summary='查看收到的短信',
+                   description=
+"""
+按接收顺序倒序分页，不传 modem 时汇总所有模块。
+翻页时把上一页返回的 next_before 作为 before 参数
+"""
+                   )
+def list_inbox(modem: Optional[str] = Query(default=None, description="模块id，不传则查询所有模块"),
+               sender: Optional[str] = Query(default=None, description="发送方号码"),
+               since: Optional[datetime] = Query(default=None, description="短信中心时间戳不早于"),
+               until: Optional[datetime] = Query(default=None, description="短信中心时间戳早于"),
+               q: Optional[str] = Query(default=None, description="全文检索短信内容"),
+               before: Optional[int] = Query(default=None, description="只返回id小于该值的短信"),
+               limit: int = Query(default=50, ge=1, le=500)):
+    items, next_before = inbox.list(modem_id=modem, sender=sender, since=since, until=until, search=q,
+                                    before=before, limit=limit)
+    return {'items': items, 'next_before': next_before}
+
+
+@sms_router.get("/inbox/{message_id}", response_model=schemas.InboxMessageDetail, summary='查看单条短信',
+                   description=
+"""
+包含原始PDU
+"""
+                   )
+def get_inbox_message(message_id: int):
+    message = inbox.get(message_id)
+    if message is None:
+        return ORJSONResponse(status_code=404, content={"status": "fail", "message": f"message {message_id} not found"})
+    return message
+
+
+@notification_router.get("/outbox", response_model=List[schemas.OutboxItem], summary='查看推送记录',
+                   description=
+"""
+status: pending 等待推送或重试，sent 推送成功，failed 超过最大尝试次数
+"""
+                   )
+def list_outbox(status: Optional[str] = Query(default=None, pattern='^(pending|sent|failed)$'),
+                limit: int = Query(default=100, ge=1, le=1000)):
+    return outbox.list(status=status, limit=limit)
+
+
+@notification_router.post("/replay", response_model=schemas.CommandResponse, summary='重放推送',
+                   description=
+"""
+把推送重新放回待推送状态，不传参数时重放所有失败的推送
+"""
+                   )
+def replay_notification(id: Optional[int] = Query(default=None, description="推送记录id"),
+                        message_id: Optional[str] = Query(default=None, description="短信的message_id")):
+    count = outbox.replay(row_id=id, message_id=message_id)
+    return {'status': 'success' if count else 'failure', 'content': str(count)}
+
+
 @schedule_router.get("/schedule/list", response_model=List[schemas.ListScheduleJob], summary='查看定时任务',
                    description=
 """
@@ -83,6 +383,7 @@ async def del_schedule(job_id: str = Query()):
     job = scheduler.get_job(job_id=job_id)
     if job:
         scheduler.remove_job(job_id=job_id)
+        await modem_owner.scheduler_changed()
         return {'status': 'success', 'content': job_id}
     return 404
 
@@ -94,8 +395,10 @@ async def del_schedule(job_id: str = Query()):
                    )
 async def add_sms_schedule(params: Annotated[schemas.ScheduleSendSMSRequest, Query()]):
     try:
+        get_modem(params.modem)
         job = scheduler.add_job(func=send_sms, args=(f'+{params.country}{params.number}', params.message,),
-                                id=params.id, trigger='interval', seconds=params.seconds, jobstore='default')
+                                kwargs={'modem_id': params.modem}, id=params.id, trigger='interval', seconds=params.seconds, jobstore='default')
+        await modem_owner.scheduler_changed()
         return {'status': 'success', 'content': job.id}
     except Exception as e:
         return ORJSONResponse(status_code=400, content={"status": "error", "message": f"An error occurred: {str(e)}"})
@@ -108,7 +411,49 @@ async def add_sms_schedule(params: Annotated[schemas.ScheduleSendSMSRequest, Que
                    )
 async def add_restart_schedule(params: Annotated[schemas.ScheduleRestartRequest, Query()]):
     try:
-        job = scheduler.add_job(func=web_restart, trigger='interval', seconds=params.seconds, jobstore='default')
+        get_modem(params.modem)
+        job = scheduler.add_job(func=web_restart, kwargs={'modem_id': params.modem}, trigger='interval', seconds=params.seconds, jobstore='default')
+        await modem_owner.scheduler_changed()
         return {'status': 'success', 'content': job.id}
     except Exception as e:
         return ORJSONResponse(status_code=400, content={"status": "error", "message": f"An error occurred: {str(e)}"})
+
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse, summary='Prometheus 指标',
+                    description=
+"""
+AT指令延迟、指令队列、串口读写、收发短信、推送和定时任务的指标，Prometheus 文本格式
+
+多进程部署时指标由持有模块的 owner 进程统一提供
+"""
+                    )
+async def prometheus_metrics():
+    exposition = registry.exposition() if modem_owner.is_owner else await modem_owner.client.async_call('metrics')
+    return PlainTextResponse(exposition, media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _health():
+    return [{'id': modem_id, **modem.state_info()} for modem_id, modem in modems.items()]
+
+
+@health_router.get("/healthz", response_model=schemas.HealthStatus, summary='存活检查',
+                   description=
+"""
+服务进程正常即返回200，同时给出每个模块的初始化状态
+"""
+                   )
+async def healthz():
+    return {'status': 'ok', 'modems': _health()}
+
+
+@health_router.get("/readyz", response_model=schemas.HealthStatus, summary='就绪检查',
+                   description=
+"""
+所有模块都已附着网络时返回200，否则返回503，可作为负载均衡或容器编排的就绪探针
+"""
+                   )
+async def readyz():
+    health = _health()
+    if all(item['state'] == ModemState.ATTACHED.value for item in health):
+        return {'status': 'ready', 'modems': health}
+    return ORJSONResponse(status_code=503, content={'status': 'not ready', 'modems': health})
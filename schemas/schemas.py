@@ -1,7 +1,10 @@
 from datetime import datetime
 from typing import List, Union, Optional, Any, Dict
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+from services.utils.config_parser import config
+from services.utils.sms import check_message_length
 
 
 class ErrorDetail(BaseModel):
@@ -21,14 +24,16 @@ class ResponseDetail(BaseModel):
 
 
 class Command(BaseModel):
-    keyword: Optional[str] = Field(default=None, description="AT命令返回的关键字, 一般是'OK'或者 'ERROR'，不传则两个都检测")
+    keyword: Optional[str] = Field(default=None, description="AT命令返回的关键字，不传则以最终结果码(OK、ERROR、+CME ERROR、+CMS ERROR)判断结束")
     timeout: int = Field(default=3, description="等待AT命令回应的超时时间")
+    deadline: Optional[int] = Field(default=None, description="指令排队等待的最长秒数，不传则使用配置的 QUEUE_DEADLINE")
+    modem: Optional[str] = Field(default=None, description="模块id，不传则使用默认模块")
 
     @field_validator('keyword', mode='after', check_fields=False)
     @classmethod
     def check_message(cls, v: str) -> list[str]:
         if v is None:
-            return ['OK', 'ERROR']
+            return None
         return [v]
 
 
@@ -44,19 +49,198 @@ class CommandResponse(BaseModel):
     status: str
     content: str
 
+
+class QueueStatus(BaseModel):
+    depth: int
+    limit: int
+    saturated: bool
+    by_priority: Dict[str, int]
+    rejected: int
+    expired: int
+
+
+class ModemInfo(BaseModel):
+    id: str
+    port: str
+    connected: bool
+    queue_depth: int
+    state: str
+
+
+class ModemHealth(BaseModel):
+    id: str
+    state: str = Field(description="probing/sim_ready/configured/attached/degraded")
+    reason: Optional[str] = Field(default=None, description="进入该状态的原因，如初始化失败的原因")
+    since: float = Field(description="进入该状态的时间戳")
+    connected: bool
+
+
+class HealthStatus(BaseModel):
+    status: str
+    modems: List[ModemHealth]
+
+
+class SignalQuality(BaseModel):
+    rssi: int = Field(description="AT+CSQ 的 <rssi>，0-31，99 表示未知")
+    ber: Optional[int] = Field(default=None, description="误码率等级 0-7")
+    dbm: Optional[int] = Field(default=None, description="信号强度(dBm)")
+
+
+class Registration(BaseModel):
+    stat: int
+    status: str = Field(description="not_registered/home/searching/denied/unknown/roaming")
+    area: Optional[str] = Field(default=None, description="LAC 或 TAC，十六进制")
+    cell: Optional[str] = Field(default=None, description="小区id，十六进制")
+
+
+class NetworkRegistration(BaseModel):
+    cs: Optional[Registration] = Field(default=None, description="AT+CREG，2G/3G")
+    eps: Optional[Registration] = Field(default=None, description="AT+CEREG，4G")
+
+
+class Operator(BaseModel):
+    name: Optional[str] = None
+    act: Optional[str] = Field(default=None, description="接入技术，如 E-UTRAN")
+
+
+class Storage(BaseModel):
+    used: int
+    total: int
+
+
+class ModemStatus(BaseModel):
+    modem: str
+    state: str
+    signal: Optional[SignalQuality] = None
+    registration: NetworkRegistration
+    operator: Optional[Operator] = None
+    attached: Optional[bool] = None
+    iccid: Optional[str] = None
+    imsi: Optional[str] = None
+    storage: Optional[Storage] = None
+    updated_at: float = Field(description="上次刷新的时间戳")
+    age: float = Field(description="距上次刷新的秒数")
+    stale: bool = Field(description="超过两个刷新周期没有刷新成功")
+
+
 class SendSMSRequest(BaseModel):
     country: int
     number: int
     message: str
+    modem: Optional[str] = Field(default=None, description="模块id，不传则使用默认模块")
 
     @field_validator('message')
     @classmethod
     def check_message(cls, v: str) -> str:
-        if len(v) > 70:
-            raise ValueError(f"Do not support long sms yet, makesure less than 71 characters.")
+        check_message_length(v, config.sms().get('concat_reference'))
         return v
 
 
+class BulkRecipient(BaseModel):
+    country: int
+    number: int
+    message: Optional[str] = Field(default=None, description="发给该收件人的内容，不传则使用请求中的 message")
+
+    @field_validator('message')
+    @classmethod
+    def check_message(cls, v: Optional[str]) -> Optional[str]:
+        if v is not None:
+            check_message_length(v, config.sms().get('concat_reference'))
+        return v
+
+
+class BulkSendRequest(BaseModel):
+    recipients: List[BulkRecipient] = Field(..., min_length=1, max_length=10000)
+    message: Optional[str] = Field(default=None, description="默认短信内容")
+    modem: Optional[str] = Field(default=None, description="模块id，不传则使用默认模块")
+
+    @field_validator('message')
+    @classmethod
+    def check_message(cls, v: Optional[str]) -> Optional[str]:
+        if v is not None:
+            check_message_length(v, config.sms().get('concat_reference'))
+        return v
+
+    @model_validator(mode='after')
+    def check_recipients(self):
+        if self.message is None and any(recipient.message is None for recipient in self.recipients):
+            raise ValueError("message is required unless every recipient has its own message")
+        return self
+
+
+class BulkSendResponse(BaseModel):
+    batch_id: str
+    accepted: int
+
+
+class BulkItem(BaseModel):
+    id: int
+    recipient: str
+    message: str
+    status: str
+    attempts: int
+    last_error: Optional[str]
+    updated_at: datetime
+    delivery: Optional[str] = Field(default=None, description="状态报告：delivered、pending、failed，开启 DELIVERY_REPORT 后才有")
+    reported_at: Optional[datetime] = Field(default=None, description="收到状态报告的时间")
+
+
+class BulkStatus(BaseModel):
+    batch_id: str
+    counts: Dict[str, int] = Field(description="各状态的条数：pending、sending、sent、failed")
+    items: List[BulkItem]
+    next_after: Optional[int] = Field(default=None, description="下一页的 after 参数，为空表示没有更多")
+
+
+class DeliveryItem(BaseModel):
+    id: int
+    modem: str
+    message_ref: int
+    recipient: str
+    outbox_id: Optional[int] = Field(description="批量发送记录的id")
+    part: int
+    parts: int
+    submitted_at: datetime
+    status: Optional[int] = Field(description="状态报告中的 TP-ST")
+    state: Optional[str] = Field(description="delivered 已送达，pending 服务中心仍在重试，failed 失败，为空表示尚未收到状态报告")
+    sc_time: Optional[datetime] = Field(description="服务中心收到短信的时间")
+    discharge_time: Optional[datetime] = Field(description="送达(或最终失败)的时间")
+    reported_at: Optional[datetime] = Field(description="收到状态报告的时间")
+
+
+class InboxMessage(BaseModel):
+    id: int
+    message_id: str
+    modem: Optional[str]
+    sender: str
+    content: str
+    receive_time: datetime
+    received_at: datetime
+
+
+class InboxMessageDetail(InboxMessage):
+    pdu: Optional[str]
+
+
+class InboxPage(BaseModel):
+    items: List[InboxMessage]
+    next_before: Optional[int] = Field(default=None, description="下一页的 before 参数，为空表示没有更多")
+
+
+class OutboxItem(BaseModel):
+    id: int
+    message_id: str
+    channel: str
+    title: str
+    content: str
+    status: str
+    attempts: int
+    next_attempt: datetime
+    last_error: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+
+
 class ListScheduleJob(BaseModel):
     id: str
     next_run_time: datetime
@@ -68,6 +252,7 @@ class ScheduleRestartRequest(BaseModel):
     seconds: int = Field(..., description="任务间隔秒数")
     next_run_time: Optional[datetime] = Field(default=None, examples=[datetime.now()], description="下次执行的时间")
     id: Optional[str] = Field(default=None, description="可以自己起名job_id")
+    modem: Optional[str] = Field(default=None, description="模块id，不传则使用默认模块")
 
 
 class ScheduleSendSMSRequest(ScheduleRestartRequest, SendSMSRequest):
@@ -1,4 +1,3 @@
-import threading
 from zoneinfo import ZoneInfo
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -9,6 +8,4 @@ jobstores = {
     'default': SQLAlchemyJobStore(url=config.sqlite_url())
 }
 
-scheduler = AsyncIOScheduler(timezone=ZoneInfo("Asia/Shanghai"), jobstores=jobstores)
-
-serial_lock = threading.Lock()
\ No newline at end of file
+scheduler = AsyncIOScheduler(timezone=ZoneInfo("Asia/Shanghai"), jobstores=jobstores)
\ No newline at end of file
@@ -0,0 +1,196 @@
+import re
+import time
+import logging
+
+from services.utils.config_parser import config
+from services.utils.database import database
+from services.utils.events import events, DELIVERY_REPORT
+from services.utils import metrics
+
+logger = logging.getLogger("PyAirLink")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sms_deliveries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    modem TEXT NOT NULL,
+    message_ref INTEGER NOT NULL,
+    recipient TEXT NOT NULL,
+    outbox_id INTEGER,
+    part INTEGER NOT NULL DEFAULT 1,
+    parts INTEGER NOT NULL DEFAULT 1,
+    submitted_at REAL NOT NULL,
+    status INTEGER,
+    sc_time REAL,
+    discharge_time REAL,
+    reported_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_sms_deliveries_ref ON sms_deliveries (modem, message_ref, id);
+CREATE INDEX IF NOT EXISTS idx_sms_deliveries_outbox ON sms_deliveries (outbox_id);
+CREATE INDEX IF NOT EXISTS idx_sms_deliveries_submitted ON sms_deliveries (submitted_at);
+CREATE TABLE IF NOT EXISTS sms_message_refs (
+    modem TEXT PRIMARY KEY,
+    next_ref INTEGER NOT NULL
+);
+"""
+
+# +CMGS: <mr>
+CMGS_REFERENCE = re.compile(r'\+CMGS:\s*(\d+)')
+
+
+def delivery_state(status):
+    """
+    TP-ST(3GPP TS 23.040 9.2.3.15)
+    :return: delivered 已送达，pending 服务中心仍在重试，failed 最终失败，None 表示还没有收到状态报告
+    """
+    if status is None:
+        return None
+    if status < 0x20:
+        return 'delivered'
+    if status < 0x40:
+        return 'pending'
+    return 'failed'
+
+
+class DeliveryTracker:
+    """
+    记录请求了状态报告的短信，用 +CMGS 返回的 TP-MR 与之后 +CDS 上报的状态报告关联，
+    得到送达状态和从提交到收到报告的时间。长短信每段一行。
+    TP-MR 按模块持久化递增，重启后不会与尚未收到报告的短信重复。
+    """
+
+    def __init__(self, db=database):
+        self._db = db
+        self.retention = config.sms().get('delivery_retention') * 86400
+        self._pruned = 0
+        self._ready = False
+
+    def _ensure_schema(self):
+        if not self._ready:
+            self._db.executescript(SCHEMA)
+            self._ready = True
+
+    def next_reference(self, modem_id):
+        """
+        下一个 TP-MR(0-255)，在数据库中原子递增，多个 worker 进程同时发送也不会重复
+        """
+        self._ensure_schema()
+        # 不使用 RETURNING(需要 SQLite 3.35+，Debian bullseye 只有 3.34)，
+        # BEGIN IMMEDIATE 先取得写锁，其它进程无法在递增和读取之间插入
+        with self._db.lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute('INSERT INTO sms_message_refs (modem, next_ref) VALUES (?, 1) '
+                                 'ON CONFLICT (modem) DO UPDATE SET next_ref = (next_ref + 1) % 256', (modem_id,))
+                rows = self._db.query('SELECT next_ref FROM sms_message_refs WHERE modem = ?', (modem_id,))
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return (rows[0]['next_ref'] - 1) % 256
+
+    def references(self, modem_id):
+        """
+        依次分配 TP-MR 的迭代器，供长短信的各段使用
+        """
+        while True:
+            yield self.next_reference(modem_id)
+
+    def submitted(self, modem_id, recipient, responses, outbox_id=None):
+        """
+        记录发送成功的短信
+        :param responses: 每一段 PDU 的回应，从 +CMGS: <mr> 中取得模块实际使用的 TP-MR
+        """
+        self._ensure_schema()
+        now = time.time()
+        refs = [CMGS_REFERENCE.search(response) for response in responses]
+        rows = [(modem_id, int(match.group(1)), recipient, outbox_id, part, len(refs), now)
+                for part, match in enumerate(refs, 1) if match]
+        with self._db.lock:
+            self._db.execute('BEGIN')
+            try:
+                self._db.conn.executemany(
+                    'INSERT INTO sms_deliveries (modem, message_ref, recipient, outbox_id, part, parts, submitted_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        self._prune(now)
+
+    def report(self, modem_id, report):
+        """
+        处理状态报告，按 (模块, TP-MR) 找到最近一条尚未最终确定的发送记录，
+        TP-MR 只有一个字节会循环使用，多条候选时优先取收件人号码一致的
+        :return: 是否找到对应的发送记录
+        """
+        self._ensure_schema()
+        now = time.time()
+        number = report['recipient']['number'] or ''
+        status = report['status']
+        with self._db.lock:
+            candidates = self._db.query(
+                'SELECT * FROM sms_deliveries WHERE modem = ? AND message_ref = ? '
+                'AND (status IS NULL OR (status >= 32 AND status < 64)) ORDER BY id DESC LIMIT 10',
+                (modem_id, report['message-ref']))
+            if not candidates:
+                logger.info(f"Status report on {modem_id} for unknown message reference {report['message-ref']}")
+                return False
+            row = next((row for row in candidates if row['recipient'].lstrip('+').endswith(number[-8:])),
+                       candidates[0])
+            self._db.execute(
+                'UPDATE sms_deliveries SET status = ?, sc_time = ?, discharge_time = ?, reported_at = ? WHERE id = ?',
+                (status, report['scts'].timestamp(), report['discharge_time'].timestamp(), now, row['id']))
+        state = delivery_state(status)
+        logger.info(f"SMS to {row['recipient']} on {modem_id} {state} (TP-ST {status:#04x}), "
+                    f"{now - row['submitted_at']:.1f}s after submission")
+        if state != 'pending':
+            metrics.sms_delivery_duration.labels(modem_id, state).observe(now - row['submitted_at'])
+        events.publish(DELIVERY_REPORT, dict(row, status=status, sc_time=report['scts'].timestamp(),
+                                             discharge_time=report['discharge_time'].timestamp(), reported_at=now,
+                                             state=state))
+        return True
+
+    def list(self, modem_id=None, recipient=None, outbox_ids=None, limit=100):
+        self._ensure_schema()
+        sql = 'SELECT * FROM sms_deliveries WHERE 1 = 1'
+        params = []
+        if modem_id:
+            sql += ' AND modem = ?'
+            params.append(modem_id)
+        if recipient:
+            sql += ' AND recipient = ?'
+            params.append(recipient)
+        if outbox_ids is not None:
+            sql += f" AND outbox_id IN ({','.join('?' * len(outbox_ids))})"
+            params.extend(outbox_ids)
+        sql += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+        return [dict(row, state=delivery_state(row['status'])) for row in self._db.query(sql, params)]
+
+    def for_outbox(self, outbox_ids):
+        """
+        批量发送记录的送达状态，长短信所有分段都送达才算送达
+        :return: {outbox_id: (状态, 最后一段的报告时间)}
+        """
+        if not outbox_ids:
+            return {}
+        result = {}
+        for row in sorted(self.list(outbox_ids=list(outbox_ids), limit=len(outbox_ids) * 255),
+                          key=lambda row: row['id']):
+            state, reported_at = result.get(row['outbox_id'], ('delivered', None))
+            if row['state'] != 'delivered' and state != 'failed':
+                state = row['state'] or 'pending'
+            if row['reported_at'] and (reported_at is None or row['reported_at'] > reported_at):
+                reported_at = row['reported_at']
+            result[row['outbox_id']] = (state, reported_at)
+        return result
+
+    def _prune(self, now):
+        # 最多每小时清理一次过期的记录
+        if now - self._pruned < 3600:
+            return
+        self._pruned = now
+        self._db.execute('DELETE FROM sms_deliveries WHERE submitted_at < ?', (now - self.retention,))
+
+
+delivery_tracker = DeliveryTracker()
@@ -0,0 +1,238 @@
+import time
+import uuid
+import queue
+import logging
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from services.notification import channels, webhooks, smtp_connection
+from services.outbox import outbox
+from services.utils.config_parser import config
+from services.utils import metrics
+
+logger = logging.getLogger("PyAirLink")
+
+
+class WebhookBatcher:
+    """
+    把 batch_window 秒内到达同一 webhook 的通知合并为一次请求，每次最多 batch_size 条。
+    窗口从一批中第一条通知到达时开始计算；推送结果逐条记入 outbox，失败的由重试线程按退避时间重新放入队列。
+    """
+
+    def __init__(self, channel, webhook, timeout):
+        self.channel = channel
+        self.webhook = webhook
+        self.timeout = timeout
+        self._items = []
+        # 等待合并或正在推送的 outbox 记录，租约过期后重试线程重复放入时忽略
+        self._pending = set()
+        self._changed = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name=f'batcher-{self.channel}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        推送完剩余的通知后返回
+        """
+        with self._changed:
+            self._stopping = True
+            self._changed.notify()
+        self._thread.join()
+
+    def add(self, row_id, title, content, message_id=None):
+        with self._changed:
+            if row_id in self._pending:
+                return
+            self._pending.add(row_id)
+            self._items.append((row_id, self.webhook.render(title, content, message_id)))
+            self._changed.notify()
+
+    def _take(self):
+        with self._changed:
+            while not self._items and not self._stopping:
+                self._changed.wait()
+            if not self._items:
+                return None
+            deadline = time.monotonic() + self.webhook.batch_window
+            while len(self._items) < self.webhook.batch_size and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            batch = self._items[:self.webhook.batch_size]
+            self._items = self._items[self.webhook.batch_size:]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if batch is None:
+                return
+            try:
+                with metrics.notification_duration.labels(self.channel).time():
+                    success = self.webhook.post([item for _, item in batch], timeout=self.timeout)
+                for row_id, _ in batch:
+                    outbox.mark(row_id, success, None if success else 'push failed')
+                metrics.notification_results.labels(self.channel, 'success' if success else 'failure').inc(len(batch))
+            except Exception as e:
+                logger.error(f"Webhook {self.channel} batch error: {e}")
+            finally:
+                with self._changed:
+                    self._pending.difference_update(row_id for row_id, _ in batch)
+
+
+class NotificationDispatcher:
+    """
+    后台推送通知。
+    收短信的线程只负责把通知写入持久化的 outbox 并放入有界队列，由工作线程并发推送到各个渠道，
+    单个渠道变慢或超时不会影响读取模块。
+    推送失败的渠道由重试线程按 outbox 中的退避时间重新放入队列，进程重启后也会继续。
+    """
+
+    def __init__(self):
+        settings = config.dispatcher()
+        self.timeout = settings.get('timeout')
+        self._queue = queue.Queue(maxsize=settings.get('queue_size'))
+        self._workers = settings.get('workers')
+        self._executor = None
+        self._threads = []
+        self._stop = threading.Event()
+        self._batchers = {channel: WebhookBatcher(channel, webhook, self.timeout)
+                          for channel, webhook in webhooks.items() if webhook.batch_window}
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self._workers * max(len(channels), 1),
+                                            thread_name_prefix='notification')
+        self._threads = [threading.Thread(target=self._worker, name=f'dispatcher-{i}', daemon=True)
+                         for i in range(self._workers)]
+        self._threads.append(threading.Thread(target=self._retry_loop, name='dispatcher-retry', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        for batcher in self._batchers.values():
+            batcher.start()
+        logger.info("Notification dispatcher started")
+
+    def stop(self):
+        # 先把队列中剩余的通知推送完
+        self._queue.join()
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for batcher in self._batchers.values():
+            batcher.stop()
+        self._executor.shutdown(wait=True)
+        smtp_connection.close()
+        logger.info("Notification dispatcher stopped")
+
+    @property
+    def lease(self):
+        """
+        放入队列的通知在这段时间内不会被重试线程重复放入
+        """
+        return self.timeout * 3
+
+    def submit(self, title, content, message_id=None, use_channels=None):
+        """
+        写入 outbox 后放入推送队列，队列已满时留给重试线程稍后推送
+        :param message_id: 用于去重，同一 message_id 只推送一次
+        :return: 是否已持久化
+        """
+        use_channels = config.notification() if use_channels is None else use_channels
+        if not use_channels:
+            return True
+        message_id = message_id or uuid.uuid4().hex
+        rows = outbox.add(message_id, title, content, use_channels, lease=self.lease)
+        if rows:
+            self._enqueue(message_id, title, content, rows)
+        return True
+
+    def _enqueue(self, message_id, title, content, rows):
+        try:
+            self._queue.put_nowait((message_id, title, content, rows))
+            return True
+        except queue.Full:
+            logger.warning(f"Notification queue is full, will retry later: {title}")
+            return False
+
+    def _retry_loop(self):
+        while not self._stop.wait(2):
+            try:
+                messages = {}
+                for row in outbox.due():
+                    title, content, rows = messages.setdefault(row['message_id'], (row['title'], row['content'], {}))
+                    rows[row['channel']] = row['id']
+                for message_id, (title, content, rows) in messages.items():
+                    outbox.lease(rows.values(), self.lease)
+                    if not self._enqueue(message_id, title, content, rows):
+                        break
+            except Exception as e:
+                logger.error(f"Notification retry error: {e}")
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                item = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            message_id, title, content, rows = item
+            try:
+                # 合并推送的 webhook 交给各自的 batcher，由 batcher 记录结果
+                for channel in [channel for channel in rows if channel in self._batchers]:
+                    self._batchers[channel].add(rows.pop(channel), title, content, message_id)
+                results = self.dispatch(title, content, list(rows), message_id) if rows else {}
+                for channel, row_id in rows.items():
+                    error = results.get(channel)
+                    outbox.mark(row_id, error is None, error)
+            except Exception as e:
+                logger.error(f"Notification dispatch error: {e}")
+            finally:
+                self._queue.task_done()
+
+    def dispatch(self, title, content, use_channels, message_id=None):
+        """
+        并发推送到所有渠道并等待结果
+        :return: {channel: 错误信息}，推送成功的渠道错误信息为None
+        """
+        futures = {}
+        results = {}
+        for channel in use_channels:
+            func = channels.get(channel)
+            if func is None:
+                logger.error(f'SMS push error, unknown channel type: {channel}')
+                results[channel] = 'unknown channel'
+                continue
+            if channel in webhooks:
+                func = partial(func, message_id=message_id)
+            futures[self._executor.submit(self._push, channel, func, title, content)] = channel
+        # 各渠道自身带有超时，这里多留一点余量
+        done, not_done = wait(futures, timeout=self.timeout * 2)
+        for future in done:
+            channel = futures[future]
+            try:
+                results[channel] = None if future.result() else 'push failed'
+            except Exception as e:
+                logger.error(f'SMS push error, channel type: {channel}, error: {e}')
+                results[channel] = str(e)
+        for future in not_done:
+            logger.error(f'SMS push timed out, channel type: {futures[future]}')
+            results[futures[future]] = 'timeout'
+        for channel, error in results.items():
+            metrics.notification_results.labels(channel, 'success' if error is None else 'failure').inc()
+        return results
+
+    def _push(self, channel, func, title, content):
+        with metrics.notification_duration.labels(channel).time():
+            return func(title, content, timeout=self.timeout)
+
+
+dispatcher = NotificationDispatcher()
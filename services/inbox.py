@@ -0,0 +1,275 @@
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+from services.utils.database import database
+from services.utils.events import events, SMS_RECEIVED
+
+logger = logging.getLogger("PyAirLink")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sms_inbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT NOT NULL UNIQUE,
+    modem TEXT,
+    sender TEXT NOT NULL,
+    scts REAL NOT NULL,
+    content TEXT NOT NULL,
+    pdu TEXT,
+    received_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sms_inbox_modem ON sms_inbox (modem, id);
+CREATE INDEX IF NOT EXISTS idx_sms_inbox_sender ON sms_inbox (sender, id);
+CREATE INDEX IF NOT EXISTS idx_sms_inbox_scts ON sms_inbox (scts);
+-- 已写入收件箱、尚未从模块存储中删除的短信，删除前再次读到同一索引上的同一 PDU 时沿用原来的 message_id
+CREATE TABLE IF NOT EXISTS sms_inbox_sim (
+    modem TEXT NOT NULL,
+    sim_index INTEGER NOT NULL,
+    pdu TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    PRIMARY KEY (modem, sim_index)
+);
+-- 无法解析的 PDU，保存后从模块中删除，不会在每次同步时重复解析
+CREATE TABLE IF NOT EXISTS sms_inbox_undecodable (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    modem TEXT,
+    pdu TEXT NOT NULL,
+    received_at REAL NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS sms_inbox_fts_insert AFTER INSERT ON sms_inbox BEGIN
+    INSERT INTO sms_inbox_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS sms_inbox_fts_delete AFTER DELETE ON sms_inbox BEGIN
+    INSERT INTO sms_inbox_fts (sms_inbox_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+# trigram 分词支持中文的子串检索，需要 SQLite 3.34+，否则退回 unicode61
+FTS_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS sms_inbox_fts USING fts5(content, content='sms_inbox', " \
+             "content_rowid='id', tokenize='{tokenize}')"
+
+
+class Inbox:
+    """
+    收到的短信，所有模块共用一张表，供 /api/v1/sms/inbox 查询。
+    写入由后台线程批量提交，按 id 倒序做 keyset 分页，content 建有全文索引。
+    调用方等待提交完成后才删除模块中的短信，写入失败的短信留在模块中下次同步时再写入。
+    新短信提交后以 SMS_RECEIVED 事件发布，事件中的 id 即表中的 id，订阅方断开后可据此续传。
+    """
+
+    def __init__(self, db=database, batch_size=200, flush_interval=0, retries=3):
+        self._db = db
+        self._retries = retries
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._ready = False
+
+    def _ensure_schema(self):
+        if self._ready:
+            return
+        with self._db.lock:
+            try:
+                self._db.execute(FTS_SCHEMA.format(tokenize='trigram'))
+            except sqlite3.OperationalError:
+                self._db.execute(FTS_SCHEMA.format(tokenize='unicode61'))
+            self._db.executescript(SCHEMA)
+        self._ready = True
+
+    def start(self):
+        if self._thread:
+            return
+        self._ensure_schema()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._writer, name='inbox-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self._flush(self._drain())
+
+    def add(self, message_id, modem_id, sender, content, receive_time, pdu=None, sim=None):
+        """
+        放入写入队列，由后台线程批量写入；同一 message_id 只保存一次
+        :param sim: 短信在模块存储中的 [(索引, PDU), ...]，长短信为各分段，与短信在同一事务中记录
+        :return: concurrent.futures.Future，提交成功后完成，多次重试仍写入失败时为异常。
+                 调用方应等待它完成后再删除模块中的短信
+        """
+        future = Future()
+        item = ((message_id, modem_id, sender, receive_time.timestamp(), content, pdu, time.time()), sim, future)
+        if self._thread is None:
+            # 写入线程未运行(尚未启动或已退出)时直接写入
+            self._flush([item])
+        else:
+            self._queue.put(item)
+        return future
+
+    def _drain(self, limit=None):
+        items = []
+        while limit is None or len(items) < limit:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _writer(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            # 不额外等待，新短信尽快写入并推送给订阅者；写入期间到达的短信在下一轮合并到一个事务中
+            if self._flush_interval:
+                self._stop.wait(self._flush_interval)
+            self._flush([first] + self._drain(self._batch_size - 1))
+
+    def _flush(self, items):
+        """
+        在一个事务中写入，失败(如 database is locked)时整批重试，仍失败时通知各条短信的调用方，
+        模块中的短信不会被删除，下次同步时再次写入
+        """
+        if not items:
+            return
+        for attempt in range(1, self._retries + 1):
+            try:
+                inserted = self._insert([(row, sim) for row, sim, _ in items])
+                break
+            except Exception as e:
+                logger.error(f"Unable to save {len(items)} messages to inbox (attempt {attempt}/{self._retries}): {e}")
+                if attempt == self._retries:
+                    for _, _, future in items:
+                        future.set_exception(e)
+                    return
+                time.sleep(0.5 * attempt)
+        for _, _, future in items:
+            future.set_result(True)
+        for row_id, (message_id, modem_id, sender, scts, content, _, received_at) in inserted:
+            events.publish(SMS_RECEIVED, self._to_message({
+                'id': row_id, 'message_id': message_id, 'modem': modem_id, 'sender': sender, 'scts': scts,
+                'content': content, 'received_at': received_at}))
+
+    def _insert(self, rows):
+        self._ensure_schema()
+        inserted = []
+        with self._db.lock:
+            self._db.execute('BEGIN')
+            try:
+                for row, sim in rows:
+                    cursor = self._db.conn.execute(
+                        'INSERT OR IGNORE INTO sms_inbox (message_id, modem, sender, scts, content, pdu, received_at) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)', row)
+                    # 重复的短信被忽略，不再发布
+                    if cursor.rowcount:
+                        inserted.append((cursor.lastrowid, row))
+                    self._db.conn.executemany(
+                        'INSERT OR REPLACE INTO sms_inbox_sim (modem, sim_index, pdu, message_id) VALUES (?, ?, ?, ?)',
+                        [(row[1], index, pdu, row[0]) for index, pdu in sim or ()])
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return inserted
+
+    def add_undecodable(self, modem_id, pdu):
+        """
+        直接写入无法解析的 PDU，写入失败时抛出异常
+        """
+        self._ensure_schema()
+        self._db.execute('INSERT INTO sms_inbox_undecodable (modem, pdu, received_at) VALUES (?, ?, ?)',
+                         (modem_id, pdu, time.time()))
+
+    def stored_id(self, modem_id, sim):
+        """
+        模块中的短信是否已经保存过(保存后、删除前进程退出，或删除失败后再次读到)
+        :param sim: [(索引, PDU), ...]
+        :return: 保存时的 message_id，没有保存过时返回None
+        """
+        self._ensure_schema()
+        found = set()
+        for index, pdu in sim:
+            rows = self._db.query('SELECT pdu, message_id FROM sms_inbox_sim WHERE modem = ? AND sim_index = ?',
+                                  (modem_id, index))
+            if not rows or rows[0]['pdu'] != pdu:
+                return None
+            found.add(rows[0]['message_id'])
+        return found.pop() if len(found) == 1 else None
+
+    def release(self, modem_id, index):
+        """
+        短信已从模块中删除，该索引上之后的短信(即使 PDU 相同)都是新短信
+        """
+        self._ensure_schema()
+        self._db.execute('DELETE FROM sms_inbox_sim WHERE modem = ? AND sim_index = ?', (modem_id, index))
+
+    def list(self, modem_id=None, sender=None, since=None, until=None, search=None, before=None, limit=50):
+        """
+        按 id 倒序分页查询
+        :param before: 上一页最后一条的 id，只返回比它更早的短信
+        :param search: 全文检索内容
+        :return: (短信列表, 下一页的 before 参数，没有更多时为None)
+        """
+        self._ensure_schema()
+        conditions, params = [], []
+        source, order_key = 'sms_inbox', 'sms_inbox.id'
+        if search and len(search) >= 3 and sender is None:
+            # 以全文索引驱动查询，按 rowid 倒序流式返回，不需要先取出所有匹配再排序
+            source = 'sms_inbox_fts JOIN sms_inbox ON sms_inbox.id = sms_inbox_fts.rowid'
+            order_key = 'sms_inbox_fts.rowid'
+            conditions.append('sms_inbox_fts MATCH ?')
+            params.append('"' + search.replace('"', '""') + '"')
+        elif search:
+            # 指定号码时该号码的短信不多，直接逐条匹配更快；trigram 索引也无法匹配少于三个字符的关键字
+            conditions.append("sms_inbox.content LIKE ? ESCAPE '\\'")
+            params.append('%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        for condition, value in (('modem = ?', modem_id), ('sender = ?', sender), (f'{order_key} < ?', before),
+                                 ('scts >= ?', since.timestamp() if since else None),
+                                 ('scts < ?', until.timestamp() if until else None)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = self._db.query(
+            f'SELECT sms_inbox.id, message_id, modem, sender, scts, sms_inbox.content, received_at FROM {source} '
+            f'{where} ORDER BY {order_key} DESC LIMIT ?', (*params, limit + 1))
+        messages = [self._to_message(row) for row in rows[:limit]]
+        next_before = messages[-1]['id'] if len(rows) > limit else None
+        return messages, next_before
+
+    def list_after(self, after, modem_id=None, limit=500):
+        """
+        按 id 正序返回 id 大于 after 的短信，用于实时推送断线后的续传
+        """
+        self._ensure_schema()
+        sql = 'SELECT id, message_id, modem, sender, scts, content, received_at FROM sms_inbox WHERE id > ?'
+        params = [after]
+        if modem_id:
+            sql += ' AND modem = ?'
+            params.append(modem_id)
+        sql += ' ORDER BY id LIMIT ?'
+        params.append(limit)
+        return [self._to_message(row) for row in self._db.query(sql, params)]
+
+    def get(self, message_id):
+        self._ensure_schema()
+        rows = self._db.query('SELECT * FROM sms_inbox WHERE id = ?', (message_id,))
+        return self._to_message(rows[0]) if rows else None
+
+    @staticmethod
+    def _to_message(row):
+        message = dict(row)
+        message['receive_time'] = datetime.fromtimestamp(message.pop('scts'), tz=timezone.utc)
+        message['received_at'] = datetime.fromtimestamp(message['received_at'], tz=timezone.utc)
+        return message
+
+
+inbox = Inbox()
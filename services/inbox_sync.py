@@ -0,0 +1,219 @@
+import re
+import logging
+
+from services.utils.commands import at_commands
+from services.utils.modem_session import Priority
+from services.utils.sms import parse_pdu, parse_pdus
+
+logger = logging.getLogger("PyAirLink")
+
+# +CMGL: <index>,<stat>,[<alpha>],<length>
+CMGL_HEADER = re.compile(r'\+CMGL:\s*(\d+)\s*,\s*(\d+)')
+# +CMGR: <stat>,[<alpha>],<length>
+CMGR_HEADER = re.compile(r'\+CMGR:\s*(\d+)')
+# +CPMS: <mem1>,<used1>,<total1>,...
+CPMS_STATUS = re.compile(r'\+CPMS:\s*"?\w+"?\s*,\s*(\d+)\s*,\s*(\d+)')
+
+# <stat>: 0 已接收未读 1 已接收已读 2 已存储未发送 3 已存储已发送
+RECEIVED_STATS = (0, 1)
+
+
+def parse_stored_list(response, header=CMGL_HEADER):
+    """
+    解析 +CMGL/+CMGR 的返回，每个头部行的下一行为 PDU 数据
+    :return: [(头部正则匹配结果, PDU字符串), ...]
+    """
+    lines = response.strip().splitlines()
+    entries = []
+    i = 0
+    while i < len(lines):
+        match = header.match(lines[i].strip())
+        if not match:
+            i += 1
+            continue
+        if i + 1 < len(lines):
+            entries.append((match, lines[i + 1].strip()))
+            i += 2  # 跳过 PDU 数据行，继续处理下一条短信
+        else:
+            logger.warning(f"At line {i}, PDU data is missing after {lines[i].strip()}")
+            i += 1
+    return entries
+
+
+def decode_message(pdu):
+    """
+    解析单条 SMS-DELIVER 或 SMS-STATUS-REPORT，失败时返回None
+    """
+    try:
+        message = parse_pdu(pdu)
+    except Exception as e:
+        logger.error(f"Parsing PDU: {pdu}\nerror: {e}")
+        return None
+    return _checked(pdu, message)
+
+
+def decode_messages(pdus):
+    """
+    批量解析 AT+CMGL 列出的多条短信
+    :return: 与输入一一对应，解析失败的为None
+    """
+    return [_checked(pdu, message) for pdu, message in zip(pdus, parse_pdus(pdus))]
+
+
+def _checked(pdu, message):
+    if isinstance(message, Exception):
+        logger.error(f"Parsing PDU: {pdu}\nerror: {message}")
+        return None
+    if message['header']['mti'] not in ('deliver', 'status-report'):
+        logger.warning(f"Incorrect parsing of PDU, not an SMS-DELIVER or SMS-STATUS-REPORT: {pdu}")
+        return None
+    message['pdu'] = pdu
+    return message
+
+
+class InboxSync:
+    """
+    按索引同步模块存储中的短信。
+    每条短信交给 handler 处理(入库、写入推送队列)后，再按索引单独删除(AT+CMGD=<index>,0)，
+    不会误删列表之后才到达的短信。已交出但删除失败的索引会被记住，下次同步时只重试删除，不会重复处理。
+    handler 返回 True 表示短信暂时保留在模块中(如尚未收齐的长短信分段)，之后由 release 删除。
+    无法解析的短信交给 quarantine 保存原始 PDU 后同样删除。
+    同步时顺带查询 AT+CPMS? 的占用，超过阈值时清理模块中存储的已发送/未发送短信。
+    """
+
+    def __init__(self, modem, handler, threshold=80, on_delete=None, quarantine=None):
+        """
+        :param handler: handler(modem, message)，抛出异常表示处理失败，短信会留在模块中下次再试，
+                        返回 True 表示暂不删除。message['sim'] 为 [(索引, PDU)]，直接上报的短信没有该字段
+        :param threshold: 存储占用百分比阈值
+        :param on_delete: on_delete(index)，索引上的短信删除后调用
+        :param quarantine: quarantine(modem, pdu)，保存无法解析的短信，之后从模块中删除；
+                           为None时无法解析的短信留在模块中
+        """
+        self.modem = modem
+        self._handler = handler
+        self._threshold = threshold
+        self._on_delete = on_delete
+        self._quarantine = quarantine
+        # index -> PDU，用PDU确认索引上仍是同一条短信
+        self._handed_off = {}
+        # index -> PDU，handler 要求暂时保留在模块中的短信
+        self._held = {}
+        self.used = None
+        self.total = None
+
+    def _command(self, command):
+        return self.modem.send_at_command(command, priority=Priority.HOUSEKEEPING)
+
+    def _hand_off(self, index, pdu, message):
+        if message is None:
+            if self._quarantine is None:
+                return False
+            self._quarantine(self.modem, pdu)
+            logger.warning(f"Undecodable SMS at index {index} on {self.modem.modem_id} quarantined")
+        else:
+            message['sim'] = [(index, pdu)]
+            if self._handler(self.modem, message):
+                self._held[index] = pdu
+                return False
+        self._handed_off[index] = pdu
+        return True
+
+    def release(self, indexes):
+        """
+        删除之前暂时保留在模块中的短信
+        """
+        for index in indexes:
+            pdu = self._held.pop(index, None)
+            if pdu is not None:
+                self._handed_off[index] = pdu
+                self._delete(index)
+
+    def _delete(self, index):
+        response = self._command(at_commands.cmgd(index=index, delflag=0))
+        if response and response.ok:
+            self._handed_off.pop(index, None)
+            if self._on_delete:
+                self._on_delete(index)
+            return True
+        logger.warning(f"Unable to delete SMS at index {index} on {self.modem.modem_id}, response: {response}")
+        return False
+
+    def fetch(self, index):
+        """
+        读取 +CMTI 上报的单条短信，处理后按索引删除
+        """
+        response = self._command(at_commands.cmgr(index))
+        entries = parse_stored_list(response, header=CMGR_HEADER) if response and response.ok else []
+        if not entries:
+            logger.warning(f"Unable to read SMS at index {index}, response: {response}")
+            return
+        match, pdu = entries[0]
+        if int(match.group(1)) not in RECEIVED_STATS or self._held.get(index) == pdu:
+            return
+        if self._handed_off.get(index) == pdu or self._hand_off(index, pdu, decode_message(pdu)):
+            self._delete(index)
+        if self.total and index + 1 >= self.total * self._threshold / 100:
+            # 上报的索引已经接近存储上限，立即全量同步一次
+            self.sync()
+
+    def handle_deliver(self, pdu):
+        """
+        处理 +CMT/+CDS 直接上报的短信或状态报告，模块不存储，无需删除
+        """
+        message = decode_message(pdu)
+        if message is not None:
+            self._handler(self.modem, message)
+        elif self._quarantine is not None:
+            self._quarantine(self.modem, pdu)
+
+    def sync(self, purge=False):
+        """
+        列出模块中所有短信，处理新的已接收短信并逐条删除
+        :param purge: 是否同时删除模块中存储的已发送/未发送短信
+        """
+        response = self._command(at_commands.cmgl(stat=4))
+        if not response or not response.ok:
+            logger.warning(f"Unable to list SMS on {self.modem.modem_id}, response: {response}")
+            return
+        entries = parse_stored_list(response)
+        # 新短信一次性批量解析
+        new = {int(match.group(1)): pdu for match, pdu in entries
+               if int(match.group(2)) in RECEIVED_STATS and self._handed_off.get(int(match.group(1))) != pdu
+               and self._held.get(int(match.group(1))) != pdu}
+        messages = dict(zip(new, decode_messages(list(new.values()))))
+        for match, pdu in entries:
+            index, stat = int(match.group(1)), int(match.group(2))
+            if stat not in RECEIVED_STATS:
+                if purge:
+                    self._delete(index)
+                continue
+            if self._held.get(index) == pdu:
+                continue
+            if index not in new or self._hand_off(index, pdu, messages[index]):
+                self._delete(index)
+        # 列表中已不存在的索引说明已被删除
+        listed = {int(match.group(1)) for match, _ in entries}
+        for index in list(self._held):
+            if index not in listed:
+                self._held.pop(index, None)
+        for index in list(self._handed_off):
+            if index not in listed:
+                self._handed_off.pop(index, None)
+                if self._on_delete:
+                    self._on_delete(index)
+        if not purge and self.check_storage():
+            logger.warning(f"SIM storage on {self.modem.modem_id} is {self.used}/{self.total}, purging")
+            self.sync(purge=True)
+
+    def check_storage(self):
+        """
+        查询存储占用
+        :return: 是否超过阈值
+        """
+        response = self._command(at_commands.cpms_status())
+        match = CPMS_STATUS.search(response) if response else None
+        if not match:
+            return False
+        self.used, self.total = int(match.group(1)), int(match.group(2))
+        return bool(self.total) and self.used * 100 >= self.total * self._threshold
@@ -1,198 +1,503 @@
-from io import StringIO
 import time
+import uuid
+import queue
+import asyncio
+import functools
 import logging
 from zoneinfo import ZoneInfo
 
-from services.notification import serverchan, send_email, bark
+from services.dispatcher import dispatcher
 from services.utils.config_parser import config
-from services.utils.serial_manager import SerialManager
-from .utils.sms import parse_pdu, encode_pdu
+from services.utils.modem_session import get_modem, Priority, ModemBusy, DeadlineExceeded, LinkDown, ModemNotReady, \
+    ModemState, CONFIGURED_STATES, RemoteModemSession
+from services.utils.rate_limit import TokenBucket
+from services.inbox import inbox
+from services.inbox_sync import InboxSync
+from services.sms_outbox import sms_outbox
+from services.delivery import delivery_tracker
+from services.reassembly import Reassembler
+from .utils.sms import encode_pdus
 from .utils.commands import at_commands
+from .utils import metrics
 
 logger = logging.getLogger("PyAirLink")
 
+# 等待收件箱提交的最长秒数
+INBOX_TIMEOUT = 30
 
-def web_send_at_command(command, keywords=None, timeout=3):
-    with SerialManager() as serial_manager:
-        response = serial_manager.send_at_command(command, keywords=keywords, timeout=timeout)
-        return response
 
+def web_send_at_command(command, keywords=None, timeout=3, modem_id=None):
+    return get_modem(modem_id).send_at_command(command, keywords=keywords, timeout=timeout)
 
-def initialize_module():
+
+async def async_web_send_at_command(command, keywords=None, timeout=3, deadline=None, modem_id=None):
+    modem = get_modem(modem_id)
+    return await modem.async_send_at_command(command, keywords=keywords, timeout=timeout,
+                                             deadline=deadline or modem.default_deadline)
+
+
+def initialize_module(modem_id=None, stop_event=None):
     """
-    初始化模块
+    初始化模块，依次推进模块状态 PROBING -> SIM_READY -> CONFIGURED -> ATTACHED，
+    任一步失败或超过 ATTACH_TIMEOUT 仍未附着网络时置为 DEGRADED
+    :param stop_event: 等待附着网络时检查，设置后立即返回
+    :return: 是否已附着网络
     """
-    logger.info("Initializing modules...")
+    modem = get_modem(modem_id)
+    logger.info(f"Initializing module {modem.modem_id}...")
+    modem.set_state(ModemState.PROBING)
 
     # 发送基本AT指令
-    with SerialManager() as serial_manager:
-        response = serial_manager.send_at_command(at_commands.at(), keywords="OK")
-        if not response:
-            logger.error("Unable to communicate with module")
-            return False
+    response = modem.send_at_command(at_commands.at(), priority=Priority.HOUSEKEEPING)
+    if not response:
+        return _degraded(modem, "Unable to communicate with module")
 
-        response = serial_manager.send_at_command(at_commands.cpin(), keywords="OK")
-        if "READY" not in response:
-            logger.error("SIM card not detected, please check and restart the module")
-            return False
-        logger.info("SIM card ready")
+    response = modem.send_at_command(at_commands.cpin(), priority=Priority.HOUSEKEEPING)
+    if not response or "READY" not in response:
+        return _degraded(modem, "SIM card not detected, please check and restart the module")
+    logger.info("SIM card ready")
+    modem.set_state(ModemState.SIM_READY)
 
-        response = serial_manager.send_at_command(at_commands.cmgf(), keywords="OK")
-        if not response:
-            logger.error("Unable to set SMS format to PDU")
-            return False
-        logger.info("SMS format is set to PDU")
+    response = modem.send_at_command(at_commands.cmgf(), priority=Priority.HOUSEKEEPING)
+    if not response or not response.ok:
+        return _degraded(modem, "Unable to set SMS format to PDU")
+    logger.info("SMS format is set to PDU")
 
-        response = serial_manager.send_at_command(at_commands.cscs(), keywords="OK")
-        if not response:
-            logger.error("Unable to set character set to UCS2")
-            return False
-        logger.info("Character set is set to UCS2")
+    response = modem.send_at_command(at_commands.cscs(), priority=Priority.HOUSEKEEPING)
+    if not response or not response.ok:
+        return _degraded(modem, "Unable to set character set to UCS2")
+    logger.info("Character set is set to UCS2")
 
-        response = serial_manager.send_at_command(at_commands.cpms(), keywords="OK")
-        if not response:
-            logger.error("Unable to configure new SMS buffer")
-            return False
-        logger.info("New SMS buffer configuration completed")
+    response = modem.send_at_command(at_commands.cpms(), priority=Priority.HOUSEKEEPING)
+    if not response or not response.ok:
+        return _degraded(modem, "Unable to configure new SMS buffer")
+    logger.info("New SMS buffer configuration completed")
+
+    sms_config = config.sms()
+    if sms_config.get('mode') == 'poll':
+        # 状态报告存储到模块中，由 AT+CMGL 一并读出
+        cnmi = at_commands.cnmi(ds=2 if sms_config.get('delivery_report') else 0)
+    else:
+        # 新短信存储后以 +CMTI: <mem>,<index> 上报，状态报告直接以 +CDS 上报
+        cnmi = at_commands.cnmi(mode=2, mt=1, ds=1 if sms_config.get('delivery_report') else 0)
+    response = modem.send_at_command(cnmi, priority=Priority.HOUSEKEEPING)
+    if not response or not response.ok:
+        return _degraded(modem, "Unable to configure new SMS notifications")
+    logger.info("New SMS notification configuration completed")
+    modem.set_state(ModemState.CONFIGURED)
 
-        response = serial_manager.send_at_command(at_commands.cnmi(), keywords="OK")
-        if not response:
-            logger.error("Unable to configure new SMS notifications")
+    # 检查 GPRS 附着状态
+    deadline = time.monotonic() + modem.attach_timeout
+    while True:
+        response = modem.send_at_command(at_commands.cgatt(), priority=Priority.HOUSEKEEPING)
+        if response and "+CGATT: 1" in response:
+            logger.info("GPRS Attached")
+            break
+        if time.monotonic() >= deadline:
+            return _degraded(modem, f"GPRS not attached within {modem.attach_timeout} seconds")
+        logger.warning("GPRS not attached, retrying in 5 seconds...")
+        if stop_event is None:
+            time.sleep(5)
+        elif stop_event.wait(5):
             return False
-        logger.info("New SMS notification configuration completed")
 
-        # 检查 GPRS 附着状态
-        while True:
-            response = serial_manager.send_at_command(at_commands.cgatt(), keywords="+CGATT: 1")
-            if response:
-                logger.info("GPRS Attached")
+    modem.set_state(ModemState.ATTACHED)
+    logger.info(f"Module {modem.modem_id} initialization completed")
+    return True
+
+
+def _degraded(modem, reason):
+    logger.error(reason)
+    modem.set_state(ModemState.DEGRADED, reason)
+    return False
+
+
+def modem_supervisor(stop_event, modem_id=None):
+    """
+    模块初始化线程，每个模块一个，HTTP服务启动时不必等待模块就绪
+    初始化失败(DEGRADED)时按指数退避重试；模块被重启、串口重连等原因回到 PROBING 时重新初始化
+    """
+    modem = get_modem(modem_id)
+    backoff = 5
+    while not stop_event.is_set():
+        if not modem.connected:
+            # 串口断开期间不初始化，重连后由读线程把状态置为 PROBING
+            backoff = 5
+            modem.wait_connected(timeout=1)
+            continue
+        if modem.state == ModemState.ATTACHED:
+            backoff = 5
+            modem.wait_changed(timeout=1)
+            continue
+        if modem.state == ModemState.DEGRADED:
+            # 分段等待，以便及时响应退出和手动重启
+            for _ in range(backoff):
+                if stop_event.is_set() or modem.wait_changed(timeout=1):
+                    break
+            backoff = min(backoff * 2, 60)
+            if stop_event.is_set():
                 break
-            else:
-                logger.warning("GPRS not attached, retrying in 5 seconds...")
-                time.sleep(5)
+        try:
+            initialize_module(modem.modem_id, stop_event=stop_event)
+        except Exception as e:
+            _degraded(modem, f"Module initialization error: {e}")
 
-        response = serial_manager.send_at_command(at_commands.cmgd(index=1, delflag=2), keywords=['OK'])
-        if not response:
-            logger.error("Unable to delete read messages, and unable to receive new messages if the storage area is full")
-        logger.info("All read messages have been deleted")
 
-    logger.info("Module initialization completed")
-    return True
+@metrics.timed_job
+def web_restart(modem_id=None):
+    return restart_module(modem_id, priority=Priority.SCHEDULED)
 
 
-def web_restart():
-    with SerialManager() as serial_manager:
-        resp = serial_manager.send_at_command(at_commands.reset())
-        if not resp:
-            logger.warning("Module restart failed")
-        else:
-            logger.info("Module restart successful")
+def restart_module(modem_id=None, priority=Priority.INTERACTIVE, deadline=None):
+    """
+    重启模块并等待 modem_supervisor 重新初始化完成，只能在 owner 进程中调用
+    :return: 是否重新就绪
+    """
+    modem = get_modem(modem_id)
+    _log_restart(modem.send_at_command(at_commands.reset(), priority=priority, deadline=deadline))
     time.sleep(3)
-    return initialize_module()
+    # 由 modem_supervisor 重新初始化
+    modem.set_state(ModemState.PROBING, 'restarted')
+    return modem.wait_state((ModemState.ATTACHED,), modem.attach_timeout + modem.default_deadline)
+
+
+async def async_web_restart(deadline=None, modem_id=None):
+    modem = get_modem(modem_id)
+    if isinstance(modem, RemoteModemSession):
+        # worker 中的状态由 owner 推送的事件异步更新，在本地等待可能仍看到重启前的 ATTACHED
+        return await modem.async_restart(deadline or modem.default_deadline)
+    _log_restart(await modem.async_send_at_command(at_commands.reset(), deadline=deadline or modem.default_deadline))
+    await asyncio.sleep(3)
+    await modem.async_set_state(ModemState.PROBING, 'restarted')
+    return await asyncio.to_thread(modem.wait_state, (ModemState.ATTACHED,),
+                                   modem.attach_timeout + modem.default_deadline)
 
 
-def handle_sms(phone_number, sms_content, receive_time, tz="Asia/Shanghai"):
+def _log_restart(resp):
+    if not resp:
+        logger.warning("Module restart failed")
+    else:
+        logger.info("Module restart successful")
+
+
+def handle_sms(phone_number, sms_content, receive_time, tz="Asia/Shanghai", modem_id=None, pdu=None, sim=None):
     """
     处理接收到的短信
+    :param sim: 短信在模块存储中的 [(索引, PDU), ...]，+CMT 直接上报的短信为None
     """
-    logger.info(f"Received SMS from {phone_number} at {receive_time}, content: {sms_content}")
-    channels = {'serverchan': serverchan, 'mail': send_email, 'bark': bark}
-    use_channels = config.notification()
-    if use_channels:
-        title = f'new sms from {phone_number}'
-        content = f'{sms_content},\nreceive time: {receive_time.astimezone(ZoneInfo(tz))}'
-        for channel in use_channels:
-            func = channels[channel]
-            try:
-                func(title, content)
-            except Exception as e:
-                logger.error(f'SMS push error, channel type: {channel}, error: {e}')
-    return True
+    logger.info(f"Received SMS on {modem_id} from {phone_number} at {receive_time}, content: {sms_content}")
+    # 删除前再次读到的同一条短信只保存、推送一次。
+    # 不按内容去重：SCTS 只精确到秒，同一号码同一秒内内容相同的短信也是不同的短信
+    message_id = (inbox.stored_id(modem_id, sim) if sim else None) or uuid.uuid4().hex
+    # 提交后才返回，写入失败时抛出异常，模块中的短信不会被删除
+    inbox.add(message_id, modem_id, phone_number, sms_content, receive_time, pdu=pdu,
+              sim=sim).result(timeout=INBOX_TIMEOUT)
+    metrics.sms_received.labels(modem_id).inc()
+    title = f'new sms from {phone_number}'
+    if len(config.modems()) > 1:
+        title += f' to {modem_id}'
+    content = f'{sms_content},\nreceive time: {receive_time.astimezone(ZoneInfo(tz))}'
+    # 写入 outbox 后由后台线程推送，不阻塞读取模块
+    return dispatcher.submit(title, content, message_id=message_id)
 
 
-def send_sms(to, text):
+def _send_sms_steps(to, text, modem_id, pdu_mode=True):
     """
-    使用AT指令在PDU模式下发送SMS。
-    ser是已打开的pyserial串口对象。
+    使用AT指令在PDU模式下发送SMS所需的指令序列。
     to为目标号码字符串（如"+8613800138000"），text为短信内容（UTF-8字符串）。
+    长短信的各段在同一个事务中依次发送，中间不会插入其他指令。
+    开启 DELIVERY_REPORT 时请求状态报告，TP-MR 由 delivery_tracker 按模块分配。
+    :param pdu_mode: 是否先设置PDU模式，批量发送在会话开始时已设置过
     """
+    sms_config = config.sms()
+    report = sms_config.get('delivery_report')
+    pdus = encode_pdus(to, text, reference_bits=sms_config.get('concat_reference'), srr=report,
+                       message_refs=delivery_tracker.references(modem_id) if report else None)
+    if not pdus:
+        return None
+    # 设置CMGF=0进入PDU模式（如果之前没设置过）
+    steps = [(at_commands.cmgf(), None, 3)] if pdu_mode else []
+    for pdu, length in pdus:
+        # 发送AT+CMGS指令
+        steps.append((at_commands.cmgs(length), None, 3))
+        # 发送PDU数据和Ctrl+Z结束符(0x1A)，等待 +CMGS: <mr> 之后的最终结果码
+        steps.append((pdu.encode('utf-8') + b'\x1A', None, 5))
+    return steps
+
+
+def _check_send_sms(responses, steps, modem_id, to, pdu_mode=True):
+    return _send_sms_error(responses, steps, modem_id, to, pdu_mode) is None
+
+
+def _send_sms_error(responses, steps, modem_id, to, pdu_mode=True, outbox_id=None):
+    """
+    发送成功且请求了状态报告时，记录每段 +CMGS 返回的 TP-MR 以便关联之后的状态报告
+    :return: 发送失败的原因，成功时返回None
+    """
+    error = _check_send_sms_responses(responses, (len(steps) - pdu_mode) // 2, pdu_mode)
+    metrics.sms_sent.labels(modem_id, 'success' if error is None else 'failure').inc()
+    if error is None and config.sms().get('delivery_report'):
+        try:
+            delivery_tracker.submitted(modem_id, to, responses[pdu_mode + 1::2], outbox_id=outbox_id)
+        except Exception as e:
+            logger.error(f"Unable to record SMS submission to {to}: {e}")
+    return error
+
+
+def _check_send_sms_responses(responses, parts, pdu_mode=True):
     logging_tag = "send_sms"
-    pdu, length = encode_pdu(to, text)
-    if not pdu or not length:
-        logger.error("%s: SMS encoding failed", logging_tag)
+    # 事务在出错的指令处停止，之后的回应为None
+    responses = list(responses) + [None] * (pdu_mode + 2 * parts - len(responses))
+    if pdu_mode:
+        if not responses[0] or not responses[0].ok:
+            logger.error("%s: Unable to enter PDU mode", logging_tag)
+            return "Unable to enter PDU mode"
+        responses = responses[1:]
+    for part in range(parts):
+        prompt, result = responses[2 * part], responses[2 * part + 1]
+        if not prompt or not prompt.ok:
+            logger.error("%s: Receive SMS message sending prompt '>' timeout (part %d/%d)",
+                         logging_tag, part + 1, parts)
+            return f"No sending prompt (part {part + 1}/{parts}){_result_detail(prompt)}"
+        if not result or not result.ok or '+CMGS:' not in result:
+            logger.error("%s: No confirmation message of '+CMGS' was received, sending failed (part %d/%d)",
+                         logging_tag, part + 1, parts)
+            return f"No +CMGS confirmation (part {part + 1}/{parts}){_result_detail(result)}"
+    logger.info("%s: SMS sent successfully", logging_tag)
+    return None
+
+
+def _result_detail(response):
+    if response is None or response.timed_out:
+        return ', timed out'
+    return f', {response.result} {response.error}' if response.error is not None else f', {response.result}'
+
+
+@metrics.timed_job
+def send_sms(to, text, priority=Priority.SCHEDULED, modem_id=None):
+    """
+    使用AT指令在PDU模式下发送SMS，整个发送过程独占会话。
+    供定时任务等同步代码调用。
+    """
+    modem = get_modem(modem_id)
+    modem.check_ready(modem.default_deadline)
+    steps = _send_sms_steps(to, text, modem.modem_id)
+    if not steps:
+        logger.error("send_sms: SMS encoding failed")
         return False
+    return _check_send_sms(modem.transaction(steps, priority=priority), steps, modem.modem_id, to)
 
-    # 设置CMGF=0进入PDU模式（如果之前没设置过）
-    with SerialManager() as serial_manager:
-        resp = serial_manager.send_at_command(at_commands.cmgf())
-        if not resp:
-            logger.error("%s: Unable to enter PDU mode", logging_tag)
-            return False
 
-        # 发送AT+CMGS指令
-        resp = serial_manager.send_at_command(at_commands.cmgs(length), keywords='>', timeout=3)
-        if not resp:
-            logger.error("%s: Receive SMS message sending prompt '>' timeout", logging_tag)
-            return False
+async def async_send_sms(to, text, priority=Priority.OUTBOUND_SMS, deadline=None, modem_id=None):
+    """
+    send_sms 的 asyncio 版本
+    """
+    modem = get_modem(modem_id)
+    await modem.async_check_ready(deadline or modem.default_deadline)
+    # 分配 TP-MR 要在数据库中取得写锁，其它进程持有写锁时会等待，不能阻塞事件循环
+    steps = await asyncio.to_thread(_send_sms_steps, to, text, modem.modem_id)
+    if not steps:
+        logger.error("send_sms: SMS encoding failed")
+        return False
+    responses = await modem.async_transaction(steps, priority=priority, deadline=deadline or modem.default_deadline)
+    return _check_send_sms(responses, steps, modem.modem_id, to)
 
-        # 发送PDU数据和Ctrl+Z结束符(0x1A)
-        resp = serial_manager.send_at_command(pdu.encode('utf-8') + b'\x1A', keywords='+CMGS:', timeout=5)
-        logger.debug("%s: PDU data has been sent, waiting for URC to be sent successfully", logging_tag)
-        if resp:
-            logger.info("%s: SMS sent successfully", logging_tag)
-            return True
-        else:
-            logger.error("%s: No confirmation message of '+CMGS' was received, sending failed", logging_tag)
-            return False
 
+def _handle_message(modem, massage):
+    phone_number = massage.get('sender').get('number')
+    receive_time = massage.get('scts')
+    sms_content = massage.get('user_data').get('data')
+    handle_sms(phone_number, sms_content, receive_time, modem_id=modem.modem_id, pdu=massage.get('pdu'),
+               sim=massage.get('sim'))
 
-def sms_listener(stop_event):
+
+def _route_message(reassembler, modem, message):
+    """
+    状态报告交给 delivery_tracker 关联发送记录，其余短信经过长短信合并后入库、推送
+    :return: 是否暂不删除模块中的短信(尚未收齐的长短信分段)
+    """
+    if message['header']['mti'] == 'status-report':
+        delivery_tracker.report(modem.modem_id, message)
+        return False
+    return reassembler.add(modem, message)
+
+
+def _handle_urc(inbox_sync, line, pdu):
     """
-    定期查询是否有新短信的监听器
+    处理模块主动上报的新短信提示
+    +CMTI: <mem>,<index>      短信已存储，需要 AT+CMGR 读取
+    +CMT: [<alpha>],<length>  下一行直接是 PDU 数据
+    +CDS: <length>            下一行直接是状态报告的 PDU 数据
     """
-    with SerialManager() as serial_manager:
+    if line.startswith('+CMTI:'):
+        try:
+            index = int(line.rsplit(',', 1)[-1])
+        except ValueError:
+            logger.warning(f"Unrecognized +CMTI indication: {line}")
+            return
+        logger.debug(f"New SMS stored at index {index}")
+        inbox_sync.fetch(index)
+    elif line.startswith(('+CMT:', '+CDS:')):
+        inbox_sync.handle_deliver(pdu)
+
+
+def _poll_listener(stop_event, modem, inbox_sync, reassembler):
+    while not stop_event.is_set():
+        # 模块设置好短信参数之前不读取短信
+        if not modem.wait_state(CONFIGURED_STATES, timeout=1):
+            continue
+        try:
+            inbox_sync.sync()
+            reassembler.expire()
+            # 短暂休眠，避免占用过多资源
+            time.sleep(1)
+        except Exception as e:
+            logger.error(f"sms_listener {modem.modem_id} error: {e}")
+            time.sleep(1)
+
+
+def _event_listener(stop_event, modem, inbox_sync, reassembler, sweep_interval):
+    # URC 由会话读线程投递，在本线程中处理，避免阻塞读线程
+    urc_queue = queue.Queue()
+    callback = lambda line, pdu: urc_queue.put((line, pdu))
+    modem.subscribe(('+CMTI:', '+CMT:', '+CDS:'), callback)
+    next_sweep = 0
+    try:
         while not stop_event.is_set():
+            if modem.state not in CONFIGURED_STATES:
+                # 模块设置好短信参数之前不读取短信，重新初始化后立即兜底同步一次
+                modem.wait_state(CONFIGURED_STATES, timeout=1)
+                next_sweep = 0
+                continue
             try:
-                # 发送AT+CMGL命令查询未读短信
-                response = serial_manager.send_at_command(at_commands.cmgl(stat=0), keywords=['OK'])
-                # logger.warning(f"本次查询短信收到回复: {response}")
-                if response and '+CMGL:' in response:
-                    lines = response.strip().splitlines()
-                    i = 0
-                    massages = []
-                    while i < len(lines):
-                        line = lines[i].strip()
-                        if line.startswith('+CMGL:'):
-                            # 当前行为短信头，下一行应为 PDU 数据
-                            if i + 1 < len(lines):
-                                pdu_line = lines[i + 1].strip()
-                                # 解析短信通知
-                                try:
-                                    match = parse_pdu(StringIO(pdu_line))
-                                    if isinstance(match, dict):
-                                        massages.append(match)
-                                    else:
-                                        logger.warning(f"Incorrect parsing of PDU: {pdu_line}")
-                                except Exception as e:
-                                    logger.error(f"Parsing PDU: {pdu_line}\nerror: {e}\nresponse: {response}")
-                                i += 2  # 跳过 PDU 数据行，继续处理下一条短信
-                            else:
-                                # 错误处理：+CMGL 行后没有 PDU 数据
-                                logger.warning(f"At index {i}, PDU data is missing after +CMGL line")
-                                i += 1
-                        else:
-                            i += 1
-                    for massage in massages:
-                        phone_number = massage.get('sender').get('number')
-                        receive_time = massage.get('scts')
-                        sms_content = massage.get('user_data').get('data')
-                        handle_sms(phone_number, sms_content, receive_time)
-                    serial_manager.send_at_command(at_commands.cmgd(), keywords=['OK'])
-                # 短暂休眠，避免占用过多资源
-                time.sleep(1)
+                # 低频 CMGL 兜底，防止漏掉上报期间丢失的短信
+                if time.monotonic() >= next_sweep:
+                    inbox_sync.sync()
+                    next_sweep = time.monotonic() + sweep_interval
+                reassembler.expire()
+                try:
+                    line, pdu = urc_queue.get(timeout=min(1, max(0, next_sweep - time.monotonic())))
+                except queue.Empty:
+                    continue
+                _handle_urc(inbox_sync, line, pdu)
             except Exception as e:
-                logger.error(f"sms_listener error: {e}")
+                logger.error(f"sms_listener {modem.modem_id} error: {e}")
                 time.sleep(1)
+    finally:
+        modem.unsubscribe(callback)
+
+
+def sms_listener(stop_event, modem_id=None):
+    """
+    新短信监听器，每个模块一个
+    event 模式下等待 +CMTI/+CMT 上报后按索引读取，并定期 AT+CMGL 兜底同步；
+    poll 模式下每秒 AT+CMGL 同步一次
+    模块中已读短信的清理由 InboxSync 按索引完成，长短信的分段由 Reassembler 合并后再处理
+    """
+    modem = get_modem(modem_id)
+    sms_config = config.sms()
+    reassembler = Reassembler(_handle_message, timeout=sms_config.get('concat_timeout'),
+                              capacity=sms_config.get('concat_buffer'),
+                              release=lambda indexes: inbox_sync.release(indexes))
+    inbox_sync = InboxSync(modem, functools.partial(_route_message, reassembler),
+                           threshold=sms_config.get('storage_threshold'),
+                           on_delete=lambda index: inbox.release(modem.modem_id, index),
+                           quarantine=lambda modem, pdu: inbox.add_undecodable(modem.modem_id, pdu))
+    try:
+        if sms_config.get('mode') == 'poll':
+            _poll_listener(stop_event, modem, inbox_sync, reassembler)
+        else:
+            _event_listener(stop_event, modem, inbox_sync, reassembler, sms_config.get('sweep_interval'))
+    finally:
+        # 退出前把模块中没有存储的未收齐长短信按已收到的部分保存，其余分段留在模块中下次启动时再合并
+        reassembler.flush()
+
+
+def _bulk_session(modem, enable):
+    """
+    开始批量发送会话时设置PDU模式并用 AT+CMMS=2 保持链路，结束时 AT+CMMS=0
+    :return: 会话是否已开始
+    """
+    if not enable:
+        modem.send_at_command(at_commands.cmms(0), priority=Priority.BULK_SMS)
+        return False
+    response = modem.send_at_command(at_commands.cmgf(), priority=Priority.BULK_SMS)
+    if not response or not response.ok:
+        logger.error(f"bulk_sender {modem.modem_id}: Unable to enter PDU mode")
+        return False
+    response = modem.send_at_command(at_commands.cmms(2), priority=Priority.BULK_SMS)
+    if not response or not response.ok:
+        # 不支持 AT+CMMS 的模块每条短信单独建立链路，不影响发送
+        logger.warning(f"bulk_sender {modem.modem_id}: AT+CMMS not supported, response: {response}")
+    return True
+
+
+def _send_bulk_item(stop_event, modem, bucket, row, in_session):
+    """
+    发送一条批量短信并记录结果
+    :return: 发送后是否仍在会话中，stop_event 被设置时返回None
+    """
+    try:
+        steps = _send_sms_steps(row['recipient'], row['message'], modem.modem_id, pdu_mode=False)
+    except ValueError as e:
+        sms_outbox.mark(row['id'], False, str(e), retry=False)
+        return in_session
+    if not bucket.acquire(len(steps) // 2, stop_event):
+        return None
+    if not in_session and not _bulk_session(modem, True):
+        sms_outbox.mark(row['id'], False, 'Unable to enter PDU mode')
+        return False
+    try:
+        responses = modem.transaction(steps, priority=Priority.BULK_SMS)
+    except (ModemBusy, DeadlineExceeded, LinkDown, ModemNotReady) as e:
+        # 暂时性的失败，按失败记录后稍后重试；链路断开时由 bulk_sender 等待重新就绪后再进入会话
+        sms_outbox.mark(row['id'], False, str(e))
+        return True
+    error = _send_sms_error(responses, steps, modem.modem_id, row['recipient'], pdu_mode=False,
+                            outbox_id=row['id'])
+    sms_outbox.mark(row['id'], error is None, error)
+    # 出错后模块状态未知，下一条重新设置PDU模式
+    return error is None
+
+
+def bulk_sender(stop_event, modem_id=None):
+    """
+    批量短信发送线程，每个模块一个
+    从 sms_outbox 领取该模块待发送的短信，按令牌桶限速(每个SIM卡单独计算)逐条发送。
+    有待发送短信时进入发送会话，只设置一次PDU模式并保持链路，队列清空后结束会话。
+    """
+    modem = get_modem(modem_id)
+    settings = config.bulk()
+    bucket = TokenBucket(settings.get('rate') / 60, settings.get('burst'))
+    sms_outbox.recover(modem.modem_id)
+    in_session = False
+    while not stop_event.is_set():
+        if modem.state != ModemState.ATTACHED:
+            # 模块重新初始化后需要重新进入发送会话
+            in_session = False
+            modem.wait_state((ModemState.ATTACHED,), timeout=1)
+            continue
+        rows = []
+        try:
+            rows = sms_outbox.claim(modem.modem_id)
+            if not rows:
+                if in_session:
+                    in_session = _bulk_session(modem, False)
+                stop_event.wait(1)
+                continue
+            while rows and modem.state == ModemState.ATTACHED:
+                result = _send_bulk_item(stop_event, modem, bucket, rows[0], in_session)
+                if result is None:
+                    break
+                in_session = result
+                rows.pop(0)
+        except Exception as e:
+            logger.error(f"bulk_sender {modem.modem_id} error: {e}")
+            stop_event.wait(1)
+        finally:
+            sms_outbox.release([row['id'] for row in rows])
+    if in_session:
+        _bulk_session(modem, False)
 
 
 if __name__ == "__main__":
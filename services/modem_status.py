@@ -0,0 +1,181 @@
+import re
+import time
+import logging
+
+from services.inbox_sync import CPMS_STATUS
+from services.utils.commands import at_commands
+from services.utils.config_parser import config
+from services.utils.events import events, MODEM_STATUS
+from services.utils.modem_session import get_modem, Priority, ModemState, ModemBusy, DeadlineExceeded, LinkDown
+from services.utils import metrics
+
+logger = logging.getLogger("PyAirLink")
+
+# +CSQ: <rssi>,<ber>
+CSQ = re.compile(r'\+CSQ:\s*(\d+)\s*,\s*(\d+)')
+# +CREG: <n>,<stat>[,<lac>,<ci>[,<act>]]，+CEREG 中为 <tac>,<ci>
+REGISTRATION = re.compile(r'\+CE?REG:\s*\d+\s*,\s*(\d+)(?:\s*,\s*"?([0-9A-Fa-f]+)"?\s*,\s*"?([0-9A-Fa-f]+)"?)?')
+# +COPS: <mode>[,<format>,<oper>[,<act>]]
+COPS = re.compile(r'\+COPS:\s*\d+(?:\s*,\s*\d+\s*,\s*"([^"]*)"(?:\s*,\s*(\d+))?)?')
+# +CCID: <iccid>，部分模块只返回号码本身，ICCID 末位可能是校验位 F
+ICCID = re.compile(r'^(?:\+I?CCID:\s*)?"?(\d{18,21}[Ff]?)"?\r?$', re.MULTILINE)
+IMSI = re.compile(r'^(\d{14,15})\r?$', re.MULTILINE)
+
+# <stat>(3GPP TS 27.007 7.2)
+REGISTRATION_STATUS = {0: 'not_registered', 1: 'home', 2: 'searching', 3: 'denied', 4: 'unknown', 5: 'roaming'}
+# <AcT>(3GPP TS 27.007 7.3)
+ACCESS_TECHNOLOGY = {0: 'GSM', 2: 'UTRAN', 3: 'GSM/EGPRS', 4: 'UTRAN/HSDPA', 5: 'UTRAN/HSUPA', 6: 'UTRAN/HSPA',
+                     7: 'E-UTRAN', 9: 'E-UTRAN/NB-IoT'}
+
+
+def parse_csq(response):
+    """
+    :return: {'rssi', 'ber', 'dbm'}，未知时 dbm 为None
+    """
+    match = CSQ.search(response) if response else None
+    if not match:
+        return None
+    rssi, ber = int(match.group(1)), int(match.group(2))
+    return {'rssi': rssi, 'ber': None if ber == 99 else ber, 'dbm': -113 + 2 * rssi if rssi <= 31 else None}
+
+
+def parse_registration(response):
+    """
+    :return: {'stat', 'status', 'area', 'cell'}，area/cell 为十六进制的 LAC(TAC)/CI，未上报时为None
+    """
+    match = REGISTRATION.search(response) if response else None
+    if not match:
+        return None
+    stat = int(match.group(1))
+    return {'stat': stat, 'status': REGISTRATION_STATUS.get(stat, 'unknown'),
+            'area': match.group(2), 'cell': match.group(3)}
+
+
+def parse_cops(response):
+    """
+    :return: {'name', 'act'}，未选择运营商时 name 为None
+    """
+    match = COPS.search(response) if response else None
+    if not match:
+        return None
+    act = match.group(2)
+    return {'name': match.group(1) or None, 'act': ACCESS_TECHNOLOGY.get(int(act)) if act else None}
+
+
+def _search(pattern, response):
+    match = pattern.search(response) if response else None
+    return match.group(1).upper() if match else None
+
+
+class ModemStatusCache:
+    """
+    各模块状态的内存快照，由 status_refresher 每 REFRESH_INTERVAL 秒刷新一次，
+    查询接口只读取快照，不占用串口，客户端再多模块也只收到一轮查询。
+    ICCID/IMSI 只在模块(重新)初始化后查询一次。
+    """
+
+    def __init__(self):
+        self.interval = config.status().get('refresh_interval')
+        self._snapshots = {}
+        self._versions = {}
+        self._identity = {}
+
+    def _query(self, modem, command):
+        try:
+            response = modem.send_at_command(command, priority=Priority.SCHEDULED, deadline=self.interval)
+        except (ModemBusy, DeadlineExceeded, LinkDown) as e:
+            logger.warning(f"Status query {command.decode().strip()} on {modem.modem_id} skipped: {e}")
+            return None
+        return response if response and response.ok else None
+
+    def refresh(self, modem_id=None):
+        modem = get_modem(modem_id)
+        state = modem.state_info()
+        identity = self._identity.get(modem.modem_id)
+        if identity is None or identity[0] != state['since'] or None in identity[1:]:
+            identity = (state['since'], _search(ICCID, self._query(modem, at_commands.ccid())),
+                        _search(IMSI, self._query(modem, at_commands.cimi())))
+            self._identity[modem.modem_id] = identity
+        csq = self._query(modem, at_commands.csq())
+        cgatt = self._query(modem, at_commands.cgatt())
+        if csq is None and cgatt is None:
+            # 模块无响应时保留上一次的快照，由 stale 反映数据已过期
+            logger.warning(f"Status of {modem.modem_id} not refreshed, modem not responding")
+            return None
+        storage = CPMS_STATUS.search(self._query(modem, at_commands.cpms_status()) or '')
+        data = {
+            'modem': modem.modem_id,
+            'state': state['state'],
+            'signal': parse_csq(csq),
+            'registration': {
+                'cs': parse_registration(self._query(modem, at_commands.creg())),
+                'eps': parse_registration(self._query(modem, at_commands.cereg())),
+            },
+            'operator': parse_cops(self._query(modem, at_commands.cops())),
+            'attached': '+CGATT: 1' in cgatt if cgatt else None,
+            'iccid': identity[1],
+            'imsi': identity[2],
+            'storage': {'used': int(storage.group(1)), 'total': int(storage.group(2))} if storage else None,
+        }
+        previous = self._snapshots.get(modem.modem_id)
+        version = self._versions.get(modem.modem_id, 0)
+        # 内容没有变化时版本号(ETag)不变，客户端可以继续使用缓存
+        if previous is None or previous['data'] != data:
+            version += 1
+            self._versions[modem.modem_id] = version
+        self._snapshots[modem.modem_id] = {'data': data, 'version': version, 'updated_at': time.time()}
+        events.publish(MODEM_STATUS, {'modem': modem.modem_id, 'snapshot': self._snapshots[modem.modem_id]})
+        return data
+
+    def snapshots(self):
+        return dict(self._snapshots)
+
+    def apply(self, modem_id, snapshot):
+        """
+        worker 进程中更新 owner 推送的快照，ETag 与 owner 一致
+        """
+        self._snapshots[modem_id] = snapshot
+
+    def get(self, modem_id=None):
+        """
+        :return: (状态, ETag)，尚未查询过时返回 (None, None)
+        状态中 age 为距上次刷新的秒数，超过两个刷新周期没有刷新成功时 stale 为 true
+        """
+        modem_id = get_modem(modem_id).modem_id
+        snapshot = self._snapshots.get(modem_id)
+        if snapshot is None:
+            return None, None
+        age = time.time() - snapshot['updated_at']
+        stale = age > self.interval * 2
+        status = {**snapshot['data'], 'updated_at': snapshot['updated_at'], 'age': round(age, 3), 'stale': stale}
+        return status, f'W/"{modem_id}-{snapshot["version"]}{"-stale" if stale else ""}"'
+
+    def signal(self):
+        return {modem_id: snapshot['data']['signal'] for modem_id, snapshot in self._snapshots.items()}
+
+
+modem_status = ModemStatusCache()
+
+metrics.registry.gauge('pyairlink_modem_signal_dbm', 'Received signal strength of the modem (from AT+CSQ)', ('modem',),
+                       callback=lambda: {(modem_id,): signal['dbm'] for modem_id, signal in modem_status.signal().items()
+                                         if signal and signal['dbm'] is not None})
+
+
+def status_refresher(stop_event, modem_id=None):
+    """
+    状态刷新线程，每个模块一个
+    模块串口未打开或尚未回应AT时跳过，状态变化(如重新初始化完成)后立即刷新一次
+    """
+    modem = get_modem(modem_id)
+    next_refresh = 0
+    last_state = None
+    while not stop_event.is_set():
+        if modem.connected and modem.state != ModemState.PROBING and (
+                time.monotonic() >= next_refresh or modem.state != last_state):
+            last_state = modem.state
+            try:
+                modem_status.refresh(modem.modem_id)
+            except Exception as e:
+                logger.error(f"status_refresher {modem.modem_id} error: {e}")
+            next_refresh = time.monotonic() + modem_status.interval
+        stop_event.wait(1)
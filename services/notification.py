@@ -1,17 +1,30 @@
 import logging
 import re
+import hmac
+import time
+import string
+import hashlib
 import smtplib
+import threading
+from datetime import datetime, timezone
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 
 from .utils.config_parser import config
 
 logger = logging.getLogger("PyAirLink")
 
+# 复用 keep-alive 连接，避免每次推送都重新握手
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+http_session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
 
-def serverchan(title, desp='', options=None):
+
+def serverchan(title, desp='', options=None, timeout=10):
     """
     照抄自 https://github.com/easychen/serverchan-demo
     """
@@ -33,7 +46,7 @@ def serverchan(title, desp='', options=None):
         **options
     }
     try:
-        response = requests.post(url, json=data)
+        response = http_session.post(url, json=data, timeout=timeout)
         if response.ok:
             logger.info(f"serverChan has been pushed, return: {response.json()}")
             return True
@@ -44,7 +57,7 @@ def serverchan(title, desp='', options=None):
     return False
 
 
-def bark(title, body, options=None):
+def bark(title, body, options=None, timeout=10):
     """
     使用 Bark 推送消息
     """
@@ -54,7 +67,7 @@ def bark(title, body, options=None):
     options = options if options else {}
     data = {"title": title, "body": body, "device_key": key, **options}
     try:
-        response = requests.post(url, json=data)
+        response = http_session.post(url, json=data, timeout=timeout)
         if response.ok:
             logger.info(f"Bark push has been sent, return: {response.json()}")
             return True
@@ -65,7 +78,56 @@ def bark(title, body, options=None):
     return False
 
 
-def send_email(subject, body):
+class SMTPConnection:
+    """
+    复用已登录的SMTP连接，连接失效时重新连接并登录
+    """
+
+    def __init__(self):
+        self._server = None
+        self._lock = threading.Lock()
+
+    def _connect(self, email_account, timeout):
+        server = smtplib.SMTP(email_account.get('smtp_server'), email_account.get('smtp_port'), timeout=timeout)
+        if email_account.get('tls'):
+            server.starttls()
+        server.login(email_account.get('account'), email_account.get('password'))
+        return server
+
+    def _alive(self):
+        try:
+            return self._server is not None and self._server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def sendmail(self, email_account, message, timeout=10):
+        with self._lock:
+            if not self._alive():
+                self.close()
+                self._server = self._connect(email_account, timeout)
+            try:
+                self._server.sendmail(email_account.get('account'), email_account.get('mail_to'), message)
+            except (smtplib.SMTPServerDisconnected, OSError):
+                # 服务端可能已关闭空闲连接，重连后再试一次
+                self.close()
+                self._server = self._connect(email_account, timeout)
+                self._server.sendmail(email_account.get('account'), email_account.get('mail_to'), message)
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+
+smtp_connection = SMTPConnection()
+
+
+def send_email(subject, body, timeout=10):
     email_account = config.mail()
     try:
         msg = MIMEMultipart()
@@ -74,15 +136,78 @@ def send_email(subject, body):
         msg['Subject'] = subject
 
         msg.attach(MIMEText(body, 'plain'))
-        server = smtplib.SMTP(email_account.get('smtp_server'), email_account.get('smtp_port'), timeout=5)
-
-        if email_account.get('tls'):
-            server.starttls()
-
-        server.login(email_account.get('account'), email_account.get('password'))
-        server.sendmail(email_account.get('account'), email_account.get('mail_to'), msg.as_string())
-        server.quit()
+        smtp_connection.sendmail(email_account, msg.as_string(), timeout=timeout)
 
         logger.info(f"Successfully sent email to: {email_account.get('mail_to')}")
+        return True
     except Exception as e:
-        logger.error(f"Email sending failed: {str(e)}")
\ No newline at end of file
+        logger.error(f"Email sending failed: {str(e)}")
+    return False
+
+
+DEFAULT_WEBHOOK_TEMPLATE = {'title': '$title', 'content': '$content', 'message_id': '$message_id', 'time': '$time'}
+
+
+def _render(template, values):
+    if isinstance(template, str):
+        return string.Template(template).safe_substitute(values)
+    if isinstance(template, list):
+        return [_render(value, values) for value in template]
+    if isinstance(template, dict):
+        return {key: _render(value, values) for key, value in template.items()}
+    return template
+
+
+class Webhook:
+    """
+    通用 webhook 渠道，POST 按模板生成的JSON，配置了 SECRET 时附带签名：
+        X-PyAirLink-Timestamp: 秒级时间戳
+        X-PyAirLink-Signature: sha256=HMAC-SHA256(SECRET, "<timestamp>.<body>") 的十六进制
+    batch_window 大于0时由 dispatcher 合并推送，请求体为数组
+    """
+
+    def __init__(self, name, settings):
+        self.name = name
+        self.url = settings.get('url')
+        self.secret = settings.get('secret')
+        self.batch_window = settings.get('batch_window')
+        self.batch_size = settings.get('batch_size')
+        try:
+            self.template = orjson.loads(settings['template']) if settings.get('template') else DEFAULT_WEBHOOK_TEMPLATE
+        except orjson.JSONDecodeError as e:
+            raise ValueError(f"Invalid TEMPLATE for {name}: {e}")
+
+    def render(self, title, content, message_id=None):
+        return _render(self.template, {'title': title, 'content': content, 'message_id': message_id or '',
+                                       'time': datetime.now(timezone.utc).isoformat()})
+
+    def post(self, payload, timeout=10):
+        body = orjson.dumps(payload)
+        headers = {'Content-Type': 'application/json'}
+        if self.secret:
+            timestamp = str(int(time.time()))
+            signature = hmac.new(self.secret.encode(), timestamp.encode() + b'.' + body, hashlib.sha256).hexdigest()
+            headers['X-PyAirLink-Timestamp'] = timestamp
+            headers['X-PyAirLink-Signature'] = f'sha256={signature}'
+        try:
+            response = http_session.post(self.url, data=body, headers=headers, timeout=timeout)
+            if response.ok:
+                logger.info(f"Webhook {self.name} has been pushed, "
+                            f"{len(payload) if isinstance(payload, list) else 1} message(s)")
+                return True
+            logger.warning(f"Webhook {self.name} push failed, status: {response.status_code}, "
+                           f"return: {response.text[:200]}")
+        except Exception as e:
+            logger.error(f"Webhook {self.name} push error: {e}")
+        return False
+
+    def __call__(self, title, content, timeout=10, message_id=None):
+        """
+        逐条推送，调用方式与其它渠道一致
+        """
+        return self.post(self.render(title, content, message_id), timeout)
+
+
+webhooks = {channel: Webhook(channel, settings) for channel, settings in config.webhooks().items()}
+
+channels = {'serverchan': serverchan, 'mail': send_email, 'bark': bark, **webhooks}
@@ -0,0 +1,135 @@
+import time
+import random
+import logging
+
+from services.utils.config_parser import config
+from services.utils.database import database
+
+logger = logging.getLogger("PyAirLink")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    title TEXT NOT NULL,
+    content TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (message_id, channel)
+);
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_due ON notification_outbox (status, next_attempt);
+"""
+
+
+class NotificationOutbox:
+    """
+    持久化的待推送通知，每条短信的每个渠道一行。
+    pending: 等待推送或重试，sent: 推送成功，failed: 超过最大尝试次数
+    同一 message_id 和渠道只会记录一次，重复读到同一条短信不会重复推送。
+    """
+
+    def __init__(self, db=database):
+        self._db = db
+        settings = config.dispatcher()
+        self.max_attempts = settings.get('max_attempts')
+        self.retry_base = settings.get('retry_base')
+        self.retry_max = settings.get('retry_max')
+        self._ready = False
+
+    def _ensure_schema(self):
+        if not self._ready:
+            self._db.executescript(SCHEMA)
+            self._ready = True
+
+    def add(self, message_id, title, content, channels, lease):
+        """
+        记录新通知，lease 秒内由调用方负责首次推送，之后未完成的由重试线程接手
+        :return: {channel: row_id}，已经记录过的渠道不包含在内
+        """
+        self._ensure_schema()
+        now = time.time()
+        rows = {}
+        with self._db.lock:
+            for channel in channels:
+                cursor = self._db.execute(
+                    'INSERT OR IGNORE INTO notification_outbox '
+                    '(message_id, channel, title, content, next_attempt, created_at, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (message_id, channel, title, content, now + lease, now, now))
+                if cursor.rowcount:
+                    rows[channel] = cursor.lastrowid
+                else:
+                    logger.info(f"Notification {message_id} for {channel} already recorded, skipped")
+        return rows
+
+    def lease(self, row_ids, seconds):
+        with self._db.lock:
+            for row_id in row_ids:
+                self._db.execute('UPDATE notification_outbox SET next_attempt = ? WHERE id = ?',
+                                 (time.time() + seconds, row_id))
+
+    def mark(self, row_id, success, error=None):
+        """
+        记录一次推送结果，失败时按指数退避加随机抖动安排下一次重试
+        """
+        self._ensure_schema()
+        now = time.time()
+        with self._db.lock:
+            rows = self._db.query('SELECT attempts FROM notification_outbox WHERE id = ?', (row_id,))
+            if not rows:
+                return
+            attempts = rows[0]['attempts'] + 1
+            if success:
+                status, next_attempt = 'sent', now
+            elif attempts >= self.max_attempts:
+                status, next_attempt = 'failed', now
+                logger.error(f"Notification {row_id} failed after {attempts} attempts, giving up")
+            else:
+                delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+                status, next_attempt = 'pending', now + delay * random.uniform(0.5, 1.5)
+            self._db.execute(
+                'UPDATE notification_outbox SET status = ?, attempts = ?, next_attempt = ?, last_error = ?, '
+                'updated_at = ? WHERE id = ?',
+                (status, attempts, next_attempt, None if success else error, now, row_id))
+
+    def due(self, limit=100):
+        """
+        到期需要重试的通知
+        """
+        self._ensure_schema()
+        return [dict(row) for row in self._db.query(
+            "SELECT * FROM notification_outbox WHERE status = 'pending' AND next_attempt <= ? "
+            "ORDER BY next_attempt LIMIT ?", (time.time(), limit))]
+
+    def list(self, status=None, limit=100):
+        self._ensure_schema()
+        if status:
+            rows = self._db.query('SELECT * FROM notification_outbox WHERE status = ? ORDER BY id DESC LIMIT ?',
+                                  (status, limit))
+        else:
+            rows = self._db.query('SELECT * FROM notification_outbox ORDER BY id DESC LIMIT ?', (limit,))
+        return [dict(row) for row in rows]
+
+    def replay(self, row_id=None, message_id=None):
+        """
+        把通知重新放回待推送状态并清零尝试次数，不传参数时重放所有 failed 的通知
+        :return: 重放的条数
+        """
+        self._ensure_schema()
+        now = time.time()
+        sql = "UPDATE notification_outbox SET status = 'pending', attempts = 0, next_attempt = ?, updated_at = ? "
+        if row_id is not None:
+            cursor = self._db.execute(sql + 'WHERE id = ?', (now, now, row_id))
+        elif message_id is not None:
+            cursor = self._db.execute(sql + 'WHERE message_id = ?', (now, now, message_id))
+        else:
+            cursor = self._db.execute(sql + "WHERE status = 'failed'", (now, now))
+        return cursor.rowcount
+
+
+outbox = NotificationOutbox()
@@ -0,0 +1,233 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    # 没有 flock 的平台(Windows)只能单进程运行，该进程总是 owner
+    fcntl = None
+
+from services import scheduler
+from services.dispatcher import dispatcher
+from services.inbox import inbox
+from services.initialize import sms_listener, bulk_sender, modem_supervisor, restart_module
+from services.modem_status import modem_status, status_refresher
+from services.utils.config_parser import config
+from services.utils.events import events, MODEM_STATE, MODEM_STATUS
+from services.utils.ipc import IPCServer, IPCClient
+from services.utils.modem_session import modems, get_modem, use_remote, use_local, Priority, ModemState, \
+    RemoteModemSession, ModemBusy, DeadlineExceeded, LinkDown, ModemNotReady, UnknownModem
+from services.utils import metrics
+
+logger = logging.getLogger("PyAirLink")
+
+# 最多记住的提前到达的取消通知
+CANCELLED_LIMIT = 1000
+
+
+class ModemOwner:
+    """
+    多进程部署(uvicorn --workers N)时只有一个进程持有串口，称为 owner：
+    它运行模块会话、监听线程、批量发送、状态刷新和定时任务，并在 Unix socket 上提供 IPC 服务。
+    其余 worker 进程把模块指令经 IPC 转发给 owner，订阅 owner 推送的模块状态、状态快照和新短信事件。
+    owner 由数据目录下的文件锁(flock)选举，owner 退出后锁被释放，等待中的某个 worker 接管。
+    单进程运行时该进程就是 owner，行为与之前相同。
+    """
+
+    def __init__(self):
+        data_dir = os.path.dirname(config.sqlite_path()) or '.'
+        self.lock_path = os.path.join(data_dir, 'pyairlink.lock')
+        self.socket_path = os.path.join(data_dir, 'pyairlink.sock')
+        self.is_owner = False
+        self.client = None
+        self._lock_fd = None
+        self._stop = threading.Event()
+        self._owner_stop = threading.Event()
+        self._worker_stop = threading.Event()
+        self._threads = []
+        self._server = None
+        # 选举线程接管与进程退出互斥
+        self._lock = threading.Lock()
+        # worker 的请求标识 -> 排队中的指令 future，worker 端取消等待时据此跳过尚未执行的指令
+        self._inflight = {}
+        # 取消通知先于请求到达时记下标识，请求到达后立即取消
+        self._cancelled = OrderedDict()
+        self._inflight_lock = threading.Lock()
+
+    def _try_lock(self):
+        if fcntl is None:
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # 记录 owner 的进程号，便于排查
+        os.ftruncate(fd, 0)
+        os.write(fd, f'{os.getpid()}\n'.encode())
+        self._lock_fd = fd
+        return True
+
+    def start(self):
+        """
+        在 lifespan 中调用，调度器需已用 paused=True 启动，成为 owner 时才恢复
+        """
+        self._stop.clear()
+        if self._try_lock():
+            self._become_owner()
+        else:
+            self._become_worker()
+
+    def stop(self):
+        with self._lock:
+            self._stop.set()
+        self._worker_stop.set()
+        if self.is_owner:
+            self._stop_owner()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self.client:
+            self.client.close()
+            self.client = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _start_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _become_owner(self):
+        use_local()
+        self.is_owner = True
+        inbox.start()
+        dispatcher.start()
+        self._owner_stop.clear()
+        for modem_id, modem in modems.items():
+            modem.start()
+            # 模块在后台初始化，HTTP服务立即可用，就绪状态见 /readyz
+            self._start_thread(modem_supervisor, self._owner_stop, modem_id)
+            self._start_thread(sms_listener, self._owner_stop, modem_id)
+            logger.info(f"sms_listener {modem_id} started")
+            self._start_thread(bulk_sender, self._owner_stop, modem_id)
+            self._start_thread(status_refresher, self._owner_stop, modem_id)
+        if fcntl is not None:
+            self._server = IPCServer(self.socket_path, self._handlers(), events)
+            self._server.start()
+        scheduler.resume()
+        logger.info(f"Process {os.getpid()} owns the modems")
+
+    def _stop_owner(self):
+        self._owner_stop.set()
+        if self._server:
+            self._server.stop()
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        logger.info("modem_supervisor, sms_listener, bulk_sender and status_refresher stopped")
+        for modem in modems.values():
+            modem.stop()
+        dispatcher.stop()
+        inbox.stop()
+
+    def _become_worker(self):
+        self.client = IPCClient(self.socket_path, errors=(ModemBusy, DeadlineExceeded, LinkDown, ModemNotReady,
+                                                          UnknownModem, ValueError))
+        use_remote(self.client)
+        events.subscribe(self._mirror, (MODEM_STATE, MODEM_STATUS))
+        self._worker_stop.clear()
+        self._start_thread(self.client.subscribe, events.publish, self._worker_stop, self._sync)
+        self._start_thread(self._elect)
+        logger.info(f"Process {os.getpid()} forwards modem commands to the owner process")
+
+    def _sync(self):
+        """
+        连接(或重新连接)到 owner 后拉取完整状态，之后的变化由事件推送
+        """
+        snapshot = self.client.call('snapshot')
+        for info in snapshot['states']:
+            events.publish(MODEM_STATE, info)
+        for modem_id, status in snapshot['status'].items():
+            events.publish(MODEM_STATUS, {'modem': modem_id, 'snapshot': status})
+
+    @staticmethod
+    def _mirror(topic, data):
+        if topic == MODEM_STATE:
+            modem = modems.get(data['modem'])
+            if isinstance(modem, RemoteModemSession):
+                modem.apply_state(data)
+        else:
+            modem_status.apply(data['modem'], data['snapshot'])
+
+    def _elect(self):
+        while not self._stop.wait(1):
+            with self._lock:
+                if self._stop.is_set() or not self._try_lock():
+                    continue
+                logger.warning(f"Owner process is gone, process {os.getpid()} takes over the modems")
+                self._worker_stop.set()
+                events.unsubscribe(self._mirror)
+                client, self.client = self.client, None
+                client.close()
+                self._become_owner()
+                return
+
+    async def scheduler_changed(self):
+        """
+        worker 中增删定时任务后通知 owner 的调度器重新读取任务存储
+        """
+        if not self.is_owner and self.client:
+            await self.client.async_call('scheduler_wakeup')
+
+    def _handlers(self):
+        return {
+            'transaction': self._transaction,
+            'set_state': lambda modem, state, reason=None: get_modem(modem).set_state(ModemState(state), reason),
+            'queue_stats': lambda modem: get_modem(modem).queue_stats(),
+            'cancel': self._cancel,
+            'restart': lambda modem, deadline=None: restart_module(modem, deadline=deadline),
+            'snapshot': lambda: {'states': [{'modem': modem_id, **modem.state_info()}
+                                            for modem_id, modem in modems.items()],
+                                 'status': modem_status.snapshots()},
+            'metrics': metrics.registry.exposition,
+            'scheduler_wakeup': scheduler.wakeup,
+        }
+
+    def _transaction(self, modem, steps, priority, deadline=None, request=None):
+        session = get_modem(modem)
+        steps = [(command.encode('latin-1'), keywords, timeout) for command, keywords, timeout in steps]
+        request_future = session.submit(steps, Priority(priority), deadline)
+        if request is not None:
+            with self._inflight_lock:
+                if self._cancelled.pop(request, False):
+                    request_future.cancel()
+                self._inflight[request] = request_future
+        try:
+            responses = session.wait(request_future, steps, deadline)
+        finally:
+            if request is not None:
+                with self._inflight_lock:
+                    self._inflight.pop(request, None)
+        return [None if response is None else (response.lines, response.result) for response in responses]
+
+    def _cancel(self, request):
+        """
+        worker 端取消了等待，跳过仍在排队的指令；已经开始执行的指令无法中断，与单进程时相同
+        """
+        with self._inflight_lock:
+            request_future = self._inflight.get(request)
+            if request_future is None:
+                self._cancelled[request] = True
+                while len(self._cancelled) > CANCELLED_LIMIT:
+                    self._cancelled.popitem(last=False)
+                return False
+        return request_future.cancel()
+
+
+modem_owner = ModemOwner()
@@ -0,0 +1,144 @@
+import time
+import logging
+from collections import OrderedDict
+
+from services.utils.pdu import IEI_CONCAT_8, IEI_CONCAT_16
+from services.utils import metrics
+
+logger = logging.getLogger("PyAirLink")
+
+# 超时或被挤出缓冲区时，缺失的分段用该标记代替
+MISSING_PART = '[…]'
+
+
+def concat_info(message):
+    """
+    :return: 长短信用户数据头中的 {'reference', 'parts_count', 'part_number'}，不是长短信时返回None
+    """
+    header = message['user_data']['header']
+    if not header:
+        return None
+    for element in header['elements']:
+        if element['iei'] in (IEI_CONCAT_8, IEI_CONCAT_16) and isinstance(element['data'], dict):
+            info = element['data']
+            if 1 <= info['part_number'] <= info['parts_count'] and info['parts_count'] > 1:
+                return info
+    return None
+
+
+class _Pending:
+    __slots__ = ('modem', 'parts', 'parts_count', 'created')
+
+    def __init__(self, modem, parts_count):
+        self.modem = modem
+        self.parts = {}
+        self.parts_count = parts_count
+        self.created = time.monotonic()
+
+
+class Reassembler:
+    """
+    把长短信的各个分段按 (号码, 参考号, 总条数) 合并后再交给 handler，一条长短信只入库、推送一次。
+    存储在模块中的分段在整条长短信保存之前不会被删除，进程在收齐之前退出或崩溃时，
+    重新启动后从模块中重新读出这些分段再次合并。
+    缓冲区最多保留 capacity 条未收齐的长短信，超出时最早的一条提前输出；
+    超过 timeout 秒仍未收齐的也按已收到的分段输出，缺失部分以 MISSING_PART 标记。
+    每个模块的监听线程各用一个实例，不做加锁。
+    """
+
+    def __init__(self, handler, timeout=300, capacity=100, release=None):
+        """
+        :param handler: handler(modem, message)，与 InboxSync 的 handler 相同
+        :param release: release(indexes)，长短信保存后删除模块中仍保留的各分段
+        """
+        self._handler = handler
+        self._timeout = timeout
+        self._capacity = capacity
+        self._release = release
+        self._pending = OrderedDict()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, modem, message):
+        """
+        :return: 分段是否留在缓冲区中等待其余分段，为 True 时调用方暂不删除模块中的该分段
+        """
+        info = concat_info(message)
+        if info is None:
+            self._handler(modem, message)
+            return False
+        key = (message['sender']['number'], info['reference'], info['parts_count'])
+        pending = self._pending.get(key)
+        if pending is None:
+            while len(self._pending) >= self._capacity:
+                self._flush(next(iter(self._pending)), reason='buffer full')
+            pending = self._pending[key] = _Pending(modem, info['parts_count'])
+        existing = pending.parts.get(info['part_number'])
+        if existing is not None and existing.get('sim') != message.get('sim'):
+            # 重复收到的分段(另一个索引上的副本或再次直接上报)，保留先收到的一份
+            logger.info(f"Duplicate part {info['part_number']}/{info['parts_count']} of concatenated SMS "
+                        f"from {key[0]} (reference {key[1]}) ignored")
+            return False
+        pending.parts[info['part_number']] = message
+        if len(pending.parts) < pending.parts_count:
+            return True
+        # handler 失败时保留已收到的分段，模块中未删除的最后一段下次重试时会再次合并
+        self._handler(modem, self._merge(pending))
+        del self._pending[key]
+        # 最后一段由调用方删除，其余分段在这里删除
+        self._release_parts(part for part in pending.parts.values() if part is not message)
+        return False
+
+    def expire(self):
+        """
+        输出超时的长短信，由监听线程定期调用
+        """
+        deadline = time.monotonic() - self._timeout
+        while self._pending:
+            key, pending = next(iter(self._pending.items()))
+            if pending.created > deadline:
+                break
+            self._flush(key, reason='timed out')
+
+    def flush(self):
+        """
+        监听器退出时调用。
+        输出含有直接上报(模块中没有存储)的分段的长短信，其余分段都在模块中的留到下次启动时再合并
+        """
+        for key, pending in list(self._pending.items()):
+            if all(part.get('sim') for part in pending.parts.values()):
+                continue
+            try:
+                self._flush(key, reason='listener stopped')
+            except Exception as e:
+                logger.error(f"Unable to deliver concatenated SMS from {key[0]}: {e}")
+
+    def _flush(self, key, reason):
+        pending = self._pending[key]
+        missing = [n for n in range(1, pending.parts_count + 1) if n not in pending.parts]
+        logger.warning(f"Concatenated SMS from {key[0]} (reference {key[1]}) {reason}, "
+                       f"missing part(s) {missing} of {pending.parts_count}")
+        metrics.sms_concat_incomplete.labels(pending.modem.modem_id).inc()
+        self._handler(pending.modem, self._merge(pending))
+        del self._pending[key]
+        self._release_parts(pending.parts.values())
+
+    def _release_parts(self, parts):
+        indexes = [index for part in parts for index, _ in part.get('sim') or ()]
+        if indexes and self._release:
+            self._release(indexes)
+
+    @staticmethod
+    def _merge(pending):
+        parts = [pending.parts.get(n) for n in range(1, pending.parts_count + 1)]
+        received = [part for part in parts if part is not None]
+        message = dict(received[0])
+        message['scts'] = min(part['scts'] for part in received)
+        message['user_data'] = {
+            'header': None,
+            'data': ''.join(part['user_data']['data'] if part else MISSING_PART for part in parts),
+        }
+        message['pdu'] = '\n'.join(part['pdu'] for part in received)
+        message['sim'] = [entry for part in received for entry in part.get('sim') or ()]
+        return message
@@ -0,0 +1,175 @@
+import time
+import random
+import logging
+
+from services.utils.config_parser import config
+from services.utils.database import database
+from services.utils import metrics
+
+logger = logging.getLogger("PyAirLink")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sms_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id TEXT NOT NULL,
+    modem TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_due ON sms_outbox (modem, status, next_attempt);
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_batch ON sms_outbox (batch_id, id);
+"""
+
+
+class SMSOutbox:
+    """
+    持久化的批量发送队列，每个收件人一行，进程重启后继续发送。
+    pending: 等待发送或重试，sending: 已被发送线程领取，sent: 发送成功，failed: 超过最大尝试次数或无法编码
+    """
+
+    def __init__(self, db=database):
+        self._db = db
+        settings = config.bulk()
+        self.max_attempts = settings.get('max_attempts')
+        self.retry_base = settings.get('retry_base')
+        self._ready = False
+
+    def _ensure_schema(self):
+        if not self._ready:
+            self._db.executescript(SCHEMA)
+            self._ready = True
+
+    def add(self, batch_id, modem_id, items):
+        """
+        :param items: [(收件人, 内容), ...]
+        :return: 写入的条数
+        """
+        self._ensure_schema()
+        now = time.time()
+        with self._db.lock:
+            self._db.execute('BEGIN')
+            try:
+                self._db.conn.executemany(
+                    'INSERT INTO sms_outbox (batch_id, modem, recipient, message, next_attempt, created_at, '
+                    'updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(batch_id, modem_id, recipient, message, now, now, now) for recipient, message in items])
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return len(items)
+
+    def claim(self, modem_id, limit=20):
+        """
+        领取该模块到期的待发送短信，按写入顺序发送
+        """
+        self._ensure_schema()
+        with self._db.lock:
+            rows = [dict(row) for row in self._db.query(
+                "SELECT * FROM sms_outbox WHERE modem = ? AND status = 'pending' AND next_attempt <= ? "
+                "ORDER BY id LIMIT ?", (modem_id, time.time(), limit))]
+            if rows:
+                self._db.execute(
+                    f"UPDATE sms_outbox SET status = 'sending' WHERE id IN ({','.join('?' * len(rows))})",
+                    [row['id'] for row in rows])
+        return rows
+
+    def release(self, row_ids):
+        """
+        领取后未发送的短信放回队列，不计入尝试次数
+        """
+        if not row_ids:
+            return
+        with self._db.lock:
+            self._db.execute(
+                f"UPDATE sms_outbox SET status = 'pending' WHERE status = 'sending' "
+                f"AND id IN ({','.join('?' * len(row_ids))})", list(row_ids))
+
+    def recover(self, modem_id):
+        """
+        进程异常退出时停留在 sending 的短信重新发送，这些短信可能已经发出过一次
+        """
+        self._ensure_schema()
+        cursor = self._db.execute("UPDATE sms_outbox SET status = 'pending' WHERE modem = ? AND status = 'sending'",
+                                  (modem_id,))
+        if cursor.rowcount:
+            logger.warning(f"{cursor.rowcount} bulk SMS on {modem_id} were interrupted while sending, resending")
+
+    def mark(self, row_id, success, error=None, retry=True):
+        """
+        记录一次发送结果，失败时按指数退避加随机抖动安排重试
+        :param retry: 为False时直接标记为 failed，用于内容无法编码等重试也不会成功的错误
+        """
+        now = time.time()
+        with self._db.lock:
+            rows = self._db.query('SELECT attempts FROM sms_outbox WHERE id = ?', (row_id,))
+            if not rows:
+                return
+            attempts = rows[0]['attempts'] + 1
+            if success:
+                status, next_attempt = 'sent', now
+            elif not retry or attempts >= self.max_attempts:
+                status, next_attempt = 'failed', now
+                logger.error(f"Bulk SMS {row_id} failed after {attempts} attempts, giving up: {error}")
+            else:
+                delay = self.retry_base * 2 ** (attempts - 1)
+                status, next_attempt = 'pending', now + delay * random.uniform(0.5, 1.5)
+            self._db.execute(
+                'UPDATE sms_outbox SET status = ?, attempts = ?, next_attempt = ?, last_error = ?, updated_at = ? '
+                'WHERE id = ?', (status, attempts, next_attempt, None if success else error, now, row_id))
+
+    def counts(self, batch_id):
+        """
+        :return: {状态: 条数}，批次不存在时为空
+        """
+        self._ensure_schema()
+        rows = self._db.query('SELECT status, COUNT(*) AS n FROM sms_outbox WHERE batch_id = ? GROUP BY status',
+                              (batch_id,))
+        return {row['status']: row['n'] for row in rows}
+
+    def items(self, batch_id, status=None, recipient=None, after=None, limit=100):
+        """
+        批次中每个收件人的发送状态，按 id 正序做 keyset 分页
+        """
+        self._ensure_schema()
+        sql = 'SELECT * FROM sms_outbox WHERE batch_id = ?'
+        params = [batch_id]
+        if status:
+            sql += ' AND status = ?'
+            params.append(status)
+        if recipient:
+            sql += ' AND recipient = ?'
+            params.append(recipient)
+        if after is not None:
+            sql += ' AND id > ?'
+            params.append(after)
+        sql += ' ORDER BY id LIMIT ?'
+        params.append(limit)
+        return [dict(row) for row in self._db.query(sql, params)]
+
+    def depth(self):
+        """
+        各模块等待发送的条数
+        """
+        self._ensure_schema()
+        rows = self._db.query("SELECT modem, COUNT(*) AS n FROM sms_outbox WHERE status IN ('pending', 'sending') "
+                              "GROUP BY modem")
+        return {row['modem']: row['n'] for row in rows}
+
+
+sms_outbox = SMSOutbox()
+
+metrics.registry.gauge('pyairlink_bulk_sms_queue_depth', 'Bulk SMS waiting to be sent', ('modem',),
+                       callback=lambda: {(modem_id,): depth for modem_id, depth in _depth_by_modem().items()})
+
+
+def _depth_by_modem():
+    depth = sms_outbox.depth()
+    # 队列清空的模块也要输出0，否则指标会停留在上一次的值
+    return {modem_id: depth.get(modem_id, 0) for modem_id in set(config.modems()) | set(depth)}
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+
+from services.inbox import inbox
+from services.utils.config_parser import config
+from services.utils.events import events, SMS_RECEIVED, DELIVERY_REPORT, MODEM_STATE
+
+logger = logging.getLogger("PyAirLink")
+
+# /api/v1/sms/stream 可订阅的事件
+STREAM_TOPICS = (SMS_RECEIVED, DELIVERY_REPORT, MODEM_STATE)
+
+# 队列中的标记：积压过多，服务退出
+_OVERFLOW = object()
+_CLOSED = object()
+
+
+class SlowConsumer(Exception):
+    """
+    订阅者积压的事件超过 BUFFER，连接将被断开
+    """
+
+
+class StreamSubscription:
+    """
+    一个 SSE/WebSocket 连接的订阅，在 async with 中使用。
+    事件总线在发布事件的线程(收件箱写入、状态报告处理、IPC订阅线程)中回调，
+    经 call_soon_threadsafe 放入连接所在事件循环的队列，不会阻塞接收短信。
+    """
+
+    def __init__(self, topics, modem_id, after, settings, active):
+        self.topics = topics
+        self.modem_id = modem_id
+        # 已推送的最后一条短信的 id
+        self.last_id = after
+        self._buffer = settings.get('buffer')
+        self._heartbeat = settings.get('heartbeat')
+        self._replay_limit = settings.get('replay_limit')
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._overflow = False
+        self._active = active
+
+    async def __aenter__(self):
+        # 先订阅再补发，补发期间到达的新短信留在队列中，不会遗漏
+        events.subscribe(self._publish, self.topics)
+        self._active.add(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._active.discard(self)
+        events.unsubscribe(self._publish)
+
+    def close(self):
+        """
+        结束 stream，可在任意线程(包括信号处理函数)中调用
+        """
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, _CLOSED)
+
+    def _publish(self, topic, data):
+        if self.modem_id and data.get('modem') != self.modem_id:
+            return
+        self._loop.call_soon_threadsafe(self._put, topic, data)
+
+    def _put(self, topic, data):
+        if self._overflow:
+            return
+        if self._queue.qsize() >= self._buffer:
+            # 客户端读得太慢，不再缓存，由 stream 断开连接，客户端重连时按 last_id 续传
+            self._overflow = True
+            self._queue.put_nowait(_OVERFLOW)
+            return
+        self._queue.put_nowait((topic, data))
+
+    async def stream(self):
+        """
+        先补发 id 大于 after 的短信，再推送实时事件 (topic, data)；没有事件时每 HEARTBEAT 秒产生一个 None 作为心跳
+        积压超过 BUFFER 时抛出 SlowConsumer，服务退出时正常结束
+        """
+        if self.last_id is not None and SMS_RECEIVED in self.topics:
+            for message in await asyncio.to_thread(inbox.list_after, self.last_id, self.modem_id,
+                                                   self._replay_limit):
+                self.last_id = message['id']
+                yield SMS_RECEIVED, message
+        while True:
+            try:
+                item = await asyncio.wait_for(self._queue.get(), self._heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if item is _CLOSED:
+                return
+            if item is _OVERFLOW:
+                logger.warning(f"SMS stream subscriber dropped, more than {self._buffer} events pending")
+                raise SlowConsumer(f"More than {self._buffer} events pending, reconnect with the last received id")
+            topic, data = item
+            if topic == SMS_RECEIVED:
+                if self.last_id is not None and data['id'] <= self.last_id:
+                    # 补发时已推送过
+                    continue
+                self.last_id = data['id']
+            yield item
+
+
+class SMSStream:
+    def __init__(self):
+        self.settings = config.stream()
+        self._active = set()
+
+    def subscribe(self, topics=(SMS_RECEIVED,), modem_id=None, after=None):
+        """
+        :param topics: STREAM_TOPICS 中的事件
+        :param modem_id: 只推送该模块的事件，None 表示全部
+        :param after: 续传，先补发 id 大于该值的短信
+        """
+        return StreamSubscription(frozenset(topics), modem_id, after, self.settings, self._active)
+
+    def close(self):
+        """
+        结束所有推送连接。uvicorn 退出时会等待所有连接结束，而推送连接不会自行结束
+        """
+        for subscription in list(self._active):
+            subscription.close()
+
+
+sms_stream = SMSStream()
@@ -0,0 +1,90 @@
+import re
+
+# 结束一条指令的最终结果码(3GPP TS 27.007 / V.250)
+FINAL_RESULT_CODES = ('OK', 'ERROR', 'NO CARRIER', 'NO DIALTONE', 'BUSY', 'NO ANSWER')
+# 带错误码的最终结果码，如 +CME ERROR: 10、+CMS ERROR: 500
+ERROR_RESULT_PREFIXES = ('+CME ERROR:', '+CMS ERROR:')
+# AT+CMGS 等待输入PDU的提示符，后面没有换行
+PROMPT = '>'
+
+_LINE_END = re.compile(rb'[\r\n]+')
+
+
+def final_result(line):
+    """
+    判断一行是否为最终结果码
+    :return: 结果码('OK'、'ERROR'、'+CME ERROR'、'>' 等)，不是最终结果码时返回None
+    """
+    if line in FINAL_RESULT_CODES or line == PROMPT:
+        return line
+    if line.startswith(ERROR_RESULT_PREFIXES):
+        return line.split(':', 1)[0]
+    return None
+
+
+class LineFramer:
+    """
+    把串口读到的字节流切分成行，每行单独解码，多字节字符不会因为跨越两次读取而被截断。
+    """
+
+    def __init__(self):
+        self._buffer = b''
+
+    def reset(self):
+        self._buffer = b''
+
+    def feed(self, data):
+        """
+        :param data: 新读到的字节
+        :return: 已完整的行(不含行尾和空行)，缓冲区中只剩下提示符 '>' 时也作为一行返回
+        """
+        parts = _LINE_END.split(self._buffer + data)
+        # 最后一段没有行尾，留到下次
+        self._buffer = parts.pop()
+        lines = [part.decode(errors='replace').strip() for part in parts]
+        if self._buffer.strip() == PROMPT.encode():
+            self._buffer = b''
+            lines.append(PROMPT)
+        return [line for line in lines if line]
+
+
+class ATResponse(str):
+    """
+    一条指令的完整回应。
+    本身是各行以 '\\r\\n' 连接的字符串，原有的 `'OK' in response` 等写法不受影响；
+    另外提供结构化的结果码和错误码。
+    """
+
+    def __new__(cls, lines, result=None):
+        response = super().__new__(cls, '\r\n'.join(lines))
+        response.lines = list(lines)
+        response.result = result
+        response.error = None
+        if result in ('+CME ERROR', '+CMS ERROR'):
+            detail = lines[-1].split(':', 1)[1].strip()
+            response.error = int(detail) if detail.isdigit() else detail
+        return response
+
+    @property
+    def ok(self):
+        """
+        指令执行成功(OK 或收到提示符 '>')
+        """
+        return self.result in ('OK', PROMPT)
+
+    @property
+    def timed_out(self):
+        """
+        超时前没有收到最终结果码
+        """
+        return self.result is None
+
+    @property
+    def data(self):
+        """
+        最终结果码之前的信息行
+        """
+        return self.lines[:-1] if self.result is not None else self.lines
+
+    def __reduce__(self):
+        return self.__class__, (self.lines, self.result)
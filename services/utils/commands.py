@@ -96,6 +96,17 @@ class ATCommands:
         """
         return ATCommands._send(f"AT+CMGL={stat}")
 
+    @staticmethod
+    def cmgr(index):
+        """
+        读取指定位置的短信，且返回如下：
+            +CMGR:<stat>,[<alpha>],<length><CR><LF><pdu>
+            OK
+        :param index: 短信在<mem>1中的索引，一般来自 +CMTI: <mem>,<index>
+        :return:
+        """
+        return ATCommands._send(f"AT+CMGR={index}")
+
     @staticmethod
     def cmgd(index=1, delflag=3):
         """
@@ -128,10 +139,75 @@ class ATCommands:
         """ Prepare for sending a message. The command must be followed by the PDU and Ctrl-Z. """
         return ATCommands._send(f"AT+CMGS={to}")
 
+    @staticmethod
+    def cmms(mode=1):
+        """
+        连续发送多条短信时保持中继协议链路
+        0 关闭
+        1 保持链路，上一条发送完成后1-5秒内没有下一条时关闭，并自动变回0
+        2 保持链路，超时关闭链路后仍保持为2
+        """
+        return ATCommands._send(f"AT+CMMS={mode}")
+
     @staticmethod
     def cpms(mem='SM'):
         """ Set up a short message storage area; "SM" stands for SIM card. """
-        return ATCommands._send(f'"AT+CPMS="{mem}","{mem}","{mem}"')
+        return ATCommands._send(f'AT+CPMS="{mem}","{mem}","{mem}"')
+
+    @staticmethod
+    def cpms_status():
+        """
+        查询短信存储区的占用，返回如下：
+            +CPMS: <mem1>,<used1>,<total1>,<mem2>,<used2>,<total2>,<mem3>,<used3>,<total3>
+            OK
+        """
+        return ATCommands._send("AT+CPMS?")
+
+    @staticmethod
+    def csq():
+        """
+        查询信号质量，返回如下：
+            +CSQ: <rssi>,<ber>
+            OK
+        <rssi> 0-31 对应 -113~-51dBm，99 表示未知；<ber> 误码率等级，99 表示未知
+        """
+        return ATCommands._send("AT+CSQ")
+
+    @staticmethod
+    def creg():
+        """
+        查询CS域(2G/3G)网络注册状态，返回如下：
+            +CREG: <n>,<stat>[,<lac>,<ci>[,<act>]]
+            OK
+        <stat>: 0 未注册 1 已注册本地网络 2 正在搜索 3 注册被拒绝 4 未知 5 已注册漫游
+        """
+        return ATCommands._send("AT+CREG?")
+
+    @staticmethod
+    def cereg():
+        """
+        查询EPS(4G)网络注册状态，返回 +CEREG: <n>,<stat>[,...]，<stat> 含义同 AT+CREG
+        """
+        return ATCommands._send("AT+CEREG?")
+
+    @staticmethod
+    def cops():
+        """
+        查询当前运营商，返回如下：
+            +COPS: <mode>[,<format>,<oper>[,<act>]]
+            OK
+        """
+        return ATCommands._send("AT+COPS?")
+
+    @staticmethod
+    def ccid():
+        """ 查询SIM卡的ICCID """
+        return ATCommands._send("AT+CCID")
+
+    @staticmethod
+    def cimi():
+        """ 查询SIM卡的IMSI """
+        return ATCommands._send("AT+CIMI")
 
     @staticmethod
     def reset():
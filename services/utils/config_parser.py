@@ -9,15 +9,57 @@ class Config:
             print(f"Warning: '{ini_path}' not found. Using default settings.")
             self.config.read(default_ini_path)
 
+    def sqlite_path(self):
+        return f"data/{self.config.get('DATABASE', 'SQLITE')}"
+
     def sqlite_url(self):
-        url = self.config.get('DATABASE', 'SQLITE')
-        return f'sqlite:///data/{url}'
+        return f'sqlite:///{self.sqlite_path()}'
+
+    def serial(self, section='SERIAL'):
+        def get(key, fallback):
+            # [SERIAL:<id>] 中未配置的项沿用 [SERIAL] 的配置
+            return int(self.config.get(section, key, fallback=self.config.get('SERIAL', key, fallback=fallback)))
+
+        port = self.config.get(section, 'PORT')
+        rate = get('BAUD_RATE', 115200)
+        timeout = get('TIMEOUT', 1)
+        queue_size = get('QUEUE_SIZE', 32)
+        queue_deadline = get('QUEUE_DEADLINE', 30)
+        attach_timeout = get('ATTACH_TIMEOUT', 120)
+        reconnect_max = get('RECONNECT_MAX', 30)
+        keepalive = get('KEEPALIVE', 30)
+        # 未配置时由传输方式决定，本地串口为0
+        latency = self.config.get(section, 'LATENCY', fallback=self.config.get('SERIAL', 'LATENCY', fallback=''))
+        latency = float(latency) if latency.strip() else None
+        return {'port': port, 'rate': rate, 'timeout': timeout, 'queue_size': queue_size,
+                'queue_deadline': queue_deadline, 'attach_timeout': attach_timeout, 'reconnect_max': reconnect_max,
+                'keepalive': keepalive, 'latency': latency}
 
-    def serial(self):
-        port = self.config.get('SERIAL', 'PORT')
-        rate = self.config.getint('SERIAL', 'BAUD_RATE')
-        timeout = self.config.getint('SERIAL', 'TIMEOUT')
-        return {'port': port, 'rate': rate, 'timeout': timeout}
+    def modems(self):
+        """
+        所有模块的串口配置，[SERIAL] 为默认模块(id为default)，[SERIAL:<id>] 为其它模块
+        """
+        modems = {}
+        for section in self.config.sections():
+            if section == 'SERIAL':
+                modems['default'] = self.serial(section)
+            elif section.startswith('SERIAL:'):
+                modems[section.split(':', 1)[1].strip()] = self.serial(section)
+        return modems
+
+    def sms(self):
+        mode = self.config.get('SMS', 'MODE', fallback='event').strip().lower()
+        sweep_interval = self.config.getint('SMS', 'SWEEP_INTERVAL', fallback=60)
+        storage_threshold = self.config.getint('SMS', 'STORAGE_THRESHOLD', fallback=80)
+        concat_timeout = self.config.getint('SMS', 'CONCAT_TIMEOUT', fallback=300)
+        concat_buffer = self.config.getint('SMS', 'CONCAT_BUFFER', fallback=100)
+        concat_reference = 16 if self.config.getint('SMS', 'CONCAT_REFERENCE', fallback=8) == 16 else 8
+        delivery_report = self.config.getboolean('SMS', 'DELIVERY_REPORT', fallback=False)
+        delivery_retention = self.config.getint('SMS', 'DELIVERY_RETENTION', fallback=30)
+        return {'mode': mode, 'sweep_interval': sweep_interval, 'storage_threshold': storage_threshold,
+                'concat_timeout': concat_timeout, 'concat_buffer': concat_buffer,
+                'concat_reference': concat_reference, 'delivery_report': delivery_report,
+                'delivery_retention': delivery_retention}
 
     def server_chan(self):
         return self.config.get('SERVERCHAN', 'SENDKEY')
@@ -36,8 +78,63 @@ class Config:
         tls = self.config.getboolean('MAIL', 'TLS')
         return {'smtp_server': smtp_server, 'smtp_port': smtp_port, 'account': account, 'password': password, 'mail_to': mail_to, 'tls': tls}
 
+    def webhook(self, section='WEBHOOK'):
+        def get(key, fallback=''):
+            # [WEBHOOK:<name>] 中未配置的项沿用 [WEBHOOK] 的配置
+            return self.config.get(section, key, fallback=self.config.get('WEBHOOK', key, fallback=fallback)).strip()
+        return {'url': get('URL'), 'secret': get('SECRET'), 'template': get('TEMPLATE'),
+                'batch_window': max(float(get('BATCH_WINDOW') or 0), 0), 'batch_size': max(int(get('BATCH_SIZE') or 50), 1)}
+
+    def webhooks(self):
+        """
+        所有 webhook 渠道的配置，[WEBHOOK] 为渠道 webhook，[WEBHOOK:<name>] 为渠道 webhook:<name>，没有 URL 的忽略
+        """
+        webhooks = {}
+        for section in self.config.sections():
+            if section == 'WEBHOOK':
+                channel = 'webhook'
+            elif section.startswith('WEBHOOK:'):
+                channel = f"webhook:{section.split(':', 1)[1].strip()}"
+            else:
+                continue
+            settings = self.webhook(section)
+            if settings['url']:
+                webhooks[channel] = settings
+        return webhooks
+
     def notification(self):
         channels = self.config.get('NOTIFICATION', 'CHANNELS').split(',')
-        return [channel.strip() for channel in channels] if channels else []
+        return [channel.strip() for channel in channels if channel.strip()]
+
+    def dispatcher(self):
+        timeout = self.config.getint('NOTIFICATION', 'TIMEOUT', fallback=10)
+        queue_size = self.config.getint('NOTIFICATION', 'QUEUE_SIZE', fallback=256)
+        workers = self.config.getint('NOTIFICATION', 'WORKERS', fallback=2)
+        max_attempts = self.config.getint('NOTIFICATION', 'MAX_ATTEMPTS', fallback=8)
+        retry_base = self.config.getint('NOTIFICATION', 'RETRY_BASE', fallback=5)
+        retry_max = self.config.getint('NOTIFICATION', 'RETRY_MAX', fallback=600)
+        return {'timeout': timeout, 'queue_size': queue_size, 'workers': workers, 'max_attempts': max_attempts,
+                'retry_base': retry_base, 'retry_max': retry_max}
+
+    def bulk(self):
+        rate = self.config.getfloat('BULK', 'RATE', fallback=20)
+        burst = self.config.getint('BULK', 'BURST', fallback=5)
+        max_attempts = self.config.getint('BULK', 'MAX_ATTEMPTS', fallback=3)
+        retry_base = self.config.getint('BULK', 'RETRY_BASE', fallback=30)
+        return {'rate': rate, 'burst': burst, 'max_attempts': max_attempts, 'retry_base': retry_base}
+
+    def status(self):
+        refresh_interval = self.config.getint('STATUS', 'REFRESH_INTERVAL', fallback=30)
+        return {'refresh_interval': max(refresh_interval, 1)}
+
+    def stream(self):
+        buffer = self.config.getint('STREAM', 'BUFFER', fallback=256)
+        heartbeat = self.config.getint('STREAM', 'HEARTBEAT', fallback=15)
+        replay_limit = self.config.getint('STREAM', 'REPLAY_LIMIT', fallback=500)
+        return {'buffer': max(buffer, 1), 'heartbeat': max(heartbeat, 1), 'replay_limit': max(replay_limit, 0)}
+
+    def server(self):
+        workers = self.config.getint('SERVER', 'WORKERS', fallback=1)
+        return {'workers': max(workers, 1)}
 
 config = Config()
\ No newline at end of file
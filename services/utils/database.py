@@ -0,0 +1,47 @@
+import sqlite3
+import threading
+
+from .config_parser import config
+
+
+class Database:
+    """
+    与 APScheduler 任务存储共用同一个 SQLite 文件的连接，开启 WAL 以便读写并发。
+    连接在线程间共享，所有操作需在 lock 内进行。
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.sqlite_path()
+        self.lock = threading.RLock()
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('PRAGMA busy_timeout=5000')
+        return self._conn
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params)
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def executescript(self, sql):
+        with self.lock:
+            self.conn.executescript(sql)
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+database = Database()
@@ -0,0 +1,48 @@
+import logging
+import threading
+
+logger = logging.getLogger("PyAirLink")
+
+# 模块状态变化: {'modem', 'state', 'reason', 'since', 'connected'}
+MODEM_STATE = 'modem_state'
+# 模块状态快照刷新: {'modem', 'snapshot'}
+MODEM_STATUS = 'modem_status'
+# 收到新短信(长短信合并后)并写入收件箱: {'id', 'message_id', 'modem', 'sender', 'content', 'receive_time', 'received_at'}
+SMS_RECEIVED = 'sms'
+# 收到短信状态报告: sms_deliveries 中更新后的记录，另有 'state'
+DELIVERY_REPORT = 'delivery'
+
+
+class EventBus:
+    """
+    进程内的事件分发。owner 进程通过 IPC 把事件转发给各 worker 进程，worker 收到后在本进程内再次分发，
+    订阅方不需要关心自己运行在哪个进程。
+    回调在发布事件的线程中调用，应尽快返回。
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback, topics=None):
+        """
+        :param callback: callback(topic, data)
+        :param topics: 只接收这些主题，None 表示全部
+        """
+        with self._lock:
+            self._subscribers = self._subscribers + [(frozenset(topics) if topics else None, callback)]
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [(topics, cb) for topics, cb in self._subscribers if cb != callback]
+
+    def publish(self, topic, data):
+        for topics, callback in self._subscribers:
+            if topics is None or topic in topics:
+                try:
+                    callback(topic, data)
+                except Exception as e:
+                    logger.error(f"Event subscriber error on {topic}: {e}")
+
+
+events = EventBus()
@@ -0,0 +1,255 @@
+"""
+owner 进程与 worker 进程之间的本地 IPC，Unix socket 上每行一个 JSON 消息：
+    请求 {"id": 1, "method": "...", "params": {...}}
+    应答 {"id": 1, "result": ...} 或 {"id": 1, "error": {"type": "ModemBusy", "message": "..."}}
+method 为 subscribe 时该连接此后只用于推送事件 {"event": "<topic>", "data": ...}，空闲时定期推送 ping。
+"""
+import os
+import queue
+import socket
+import asyncio
+import logging
+import itertools
+import threading
+import socketserver
+
+import orjson
+
+logger = logging.getLogger("PyAirLink")
+
+# 事件连接空闲时的心跳间隔，worker 超过三个间隔没有收到任何消息即认为 owner 已退出
+HEARTBEAT_INTERVAL = 5
+# 每个订阅连接最多积压的事件数，worker 处理不过来时丢弃新事件
+SUBSCRIBER_QUEUE_SIZE = 1000
+# asyncio 读取单行的上限，状态快照等应答可能较长
+STREAM_LIMIT = 16 * 1024 * 1024
+
+
+class IPCError(Exception):
+    """
+    与 owner 进程的连接失败，或对端返回了无法识别的异常
+    """
+
+
+def _encode(message):
+    return orjson.dumps(message) + b'\n'
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        try:
+            for line in self.rfile:
+                try:
+                    message = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    logger.warning(f"Malformed IPC message: {line[:100]}")
+                    return
+                if message.get('method') == 'subscribe':
+                    self._stream(server)
+                    return
+                self.wfile.write(_encode(self._call(server, message)))
+                self.wfile.flush()
+        except OSError:
+            # worker 进程退出或被杀死，连接被重置
+            pass
+
+    @staticmethod
+    def _call(server, message):
+        handler = server.handlers.get(message.get('method'))
+        if handler is None:
+            return {'id': message.get('id'), 'error': {'type': 'IPCError',
+                                                       'message': f"Unknown method: {message.get('method')}"}}
+        try:
+            return {'id': message.get('id'), 'result': handler(**(message.get('params') or {}))}
+        except Exception as e:
+            return {'id': message.get('id'), 'error': {'type': type(e).__name__,
+                                                       'message': e.args[0] if e.args else str(e)}}
+
+    def _stream(self, server):
+        events = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+        def forward(topic, data):
+            try:
+                events.put_nowait((topic, data))
+            except queue.Full:
+                logger.warning(f"IPC subscriber is too slow, event {topic} dropped")
+
+        server.bus.subscribe(forward)
+        try:
+            while not server.stopping.is_set():
+                try:
+                    topic, data = events.get(timeout=HEARTBEAT_INTERVAL)
+                    message = {'event': topic, 'data': data}
+                except queue.Empty:
+                    message = {'event': 'ping', 'data': None}
+                self.wfile.write(_encode(message))
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            server.bus.unsubscribe(forward)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class IPCServer:
+    """
+    owner 进程中的 IPC 服务，每个连接一个线程，请求在连接线程中同步执行
+    """
+
+    def __init__(self, path, handlers, bus):
+        """
+        :param handlers: {method: handler(**params)}，返回值需能序列化为JSON
+        :param bus: EventBus，其中的事件推送给订阅的 worker
+        """
+        self.path = path
+        self._server = _Server(self._bind_path(path), _Handler, bind_and_activate=False)
+        self._server.handlers = handlers
+        self._server.bus = bus
+        self._server.stopping = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _bind_path(path):
+        # 上一个 owner 异常退出时留下的 socket 文件，持有锁的进程才会走到这里，可以直接删除
+        if os.path.exists(path):
+            os.remove(path)
+        return path
+
+    def start(self):
+        self._server.server_bind()
+        os.chmod(self.path, 0o600)
+        self._server.server_activate()
+        self._thread = threading.Thread(target=self._server.serve_forever, name='ipc-server', daemon=True)
+        self._thread.start()
+        logger.info(f"IPC server listening on {self.path}")
+
+    def stop(self):
+        self._server.stopping.set()
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class IPCClient:
+    """
+    worker 进程中的 IPC 客户端。同步和 asyncio 调用各自维护一个连接池，
+    每个连接同一时间只处理一个请求，慢指令不会挡住其它请求。
+    """
+
+    def __init__(self, path, errors=()):
+        """
+        :param errors: 可以按类名还原的异常类，owner 抛出这些异常时在 worker 中抛出同类异常
+        """
+        self.path = path
+        self._errors = {cls.__name__: cls for cls in errors}
+        self._ids = itertools.count(1)
+        self._pool = []
+        self._pool_lock = threading.Lock()
+        self._async_pool = []
+        # notify 发出的后台请求，保留引用以免任务被回收
+        self._background = set()
+
+    def _result(self, line):
+        if not line:
+            raise IPCError("Connection to the owner process closed")
+        reply = orjson.loads(line)
+        error = reply.get('error')
+        if error:
+            raise self._errors.get(error['type'], IPCError)(error['message'])
+        return reply.get('result')
+
+    def call(self, method, **params):
+        with self._pool_lock:
+            conn = self._pool.pop() if self._pool else None
+        try:
+            if conn is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(self.path)
+                conn = (sock, sock.makefile('rb'))
+            conn[0].sendall(_encode({'id': next(self._ids), 'method': method, 'params': params}))
+            line = conn[1].readline()
+        except OSError as e:
+            if conn is not None:
+                conn[0].close()
+            raise IPCError(f"Owner process is not reachable: {e}")
+        if not line:
+            conn[0].close()
+        else:
+            with self._pool_lock:
+                self._pool.append(conn)
+        return self._result(line)
+
+    async def async_call(self, method, **params):
+        conn = self._async_pool.pop() if self._async_pool else None
+        try:
+            if conn is None:
+                conn = await asyncio.open_unix_connection(self.path, limit=STREAM_LIMIT)
+            conn[1].write(_encode({'id': next(self._ids), 'method': method, 'params': params}))
+            await conn[1].drain()
+            line = await conn[0].readline()
+        except (OSError, asyncio.CancelledError) as e:
+            # 等待中被取消时连接上可能还会收到这次的应答，不能再复用
+            if conn is not None:
+                conn[1].close()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise IPCError(f"Owner process is not reachable: {e}")
+        if not line:
+            conn[1].close()
+        else:
+            self._async_pool.append(conn)
+        return self._result(line)
+
+    def notify(self, method, **params):
+        """
+        在后台发出请求，不等待结果，失败时只记录日志。可以在任务被取消的处理中调用
+        """
+        task = asyncio.get_running_loop().create_task(self.async_call(method, **params))
+        self._background.add(task)
+        task.add_done_callback(self._notified)
+
+    def _notified(self, task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"IPC notification failed: {task.exception()}")
+
+    def subscribe(self, callback, stop_event, on_connect=None):
+        """
+        接收 owner 推送的事件直到 stop_event 被设置，断开后每秒重连，在调用线程中阻塞运行
+        :param callback: callback(topic, data)
+        :param on_connect: 每次(重新)连接成功后调用，用于拉取完整状态
+        """
+        while not stop_event.is_set():
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(self.path)
+                    sock.settimeout(HEARTBEAT_INTERVAL * 3)
+                    sock.sendall(_encode({'id': 0, 'method': 'subscribe'}))
+                    if on_connect:
+                        on_connect()
+                    with sock.makefile('rb') as rfile:
+                        for line in rfile:
+                            if stop_event.is_set():
+                                return
+                            message = orjson.loads(line)
+                            if message['event'] != 'ping':
+                                callback(message['event'], message['data'])
+            except (OSError, IPCError, ValueError) as e:
+                logger.warning(f"IPC event stream interrupted: {e}")
+            stop_event.wait(1)
+
+    def close(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for sock, rfile in pool:
+            rfile.close()
+            sock.close()
+        pool, self._async_pool = self._async_pool, []
+        for _, writer in pool:
+            writer.close()
@@ -0,0 +1,264 @@
+import re
+import time
+import bisect
+import functools
+import threading
+
+# 秒级延迟的默认分桶，覆盖几毫秒的AT指令到几十秒的发送短信、推送超时
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# ATCommands 中用到的指令，其余指令归入 OTHER，避免任意AT指令产生无限多的标签
+KNOWN_COMMANDS = frozenset(('AT', 'CPIN', 'CMGF', 'CSCS', 'CNMI', 'CMGL', 'CMGR', 'CMGD', 'CGATT', 'CMGS', 'CPMS',
+                            'RESET', 'CSQ', 'CMMS', 'CREG', 'CEREG', 'COPS', 'CCID', 'CIMI'))
+_COMMAND_VERB = re.compile(rb'\s*AT\+?([A-Za-z]*)')
+
+
+def command_verb(command):
+    """
+    从AT指令字节串中取出指令名作为标签，短信PDU数据记为 PDU
+    """
+    match = _COMMAND_VERB.match(command)
+    if not match:
+        return 'PDU'
+    verb = match.group(1).decode().upper() or 'AT'
+    return verb if verb in KNOWN_COMMANDS else 'OTHER'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # 每个桶单独计数，输出时再累加
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ('_child', '_start')
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """
+        取得某组标签值对应的子指标，热路径上应当缓存返回值
+        """
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def __getattr__(self, item):
+        # 没有标签的指标可以直接调用 inc/observe 等方法
+        if not self.labelnames and item in ('inc', 'dec', 'set', 'observe', 'time', 'value'):
+            return getattr(self._children[()], item)
+        raise AttributeError(item)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for values, child in list(self._children.items()):
+            lines.extend(self._samples(values, child))
+        return lines
+
+    def _samples(self, values, child):
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {child.value}']
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        """
+        :param callback: 输出时调用，返回 {标签值元组: 数值}，用于队列深度等现成的状态
+        """
+        super().__init__(name, documentation, labelnames)
+        self._callback = callback
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def collect(self):
+        if self._callback is not None:
+            for values, value in self._callback().items():
+                self.labels(*values).set(value)
+        return super().collect()
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _samples(self, values, child):
+        with child._lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket
+            le = '+Inf' if bound == float('inf') else repr(float(bound))
+            bucket_labels = _format_labels(self.labelnames, values, 'le="' + le + '"')
+            lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f'{self.name}_sum{labels} {total}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def exposition(self):
+        """
+        Prometheus 文本格式(0.0.4)
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+at_command_duration = registry.histogram(
+    'pyairlink_at_command_duration_seconds', 'Time from writing an AT command to its final result code',
+    ('modem', 'command'))
+at_command_results = registry.counter(
+    'pyairlink_at_command_results_total', 'AT command outcomes by final result', ('modem', 'command', 'result'))
+command_queue_wait = registry.histogram(
+    'pyairlink_command_queue_wait_seconds', 'Time a command waited in the modem queue before running',
+    ('modem', 'priority'))
+command_rejected = registry.counter(
+    'pyairlink_command_rejected_total', 'Commands rejected because the queue was full or the deadline passed',
+    ('modem', 'reason'))
+serial_reconnects = registry.counter(
+    'pyairlink_serial_reconnects_total', 'Serial port (re)connections', ('modem',))
+serial_bytes_read = registry.counter('pyairlink_serial_read_bytes_total', 'Bytes read from the modem', ('modem',))
+serial_bytes_written = registry.counter(
+    'pyairlink_serial_written_bytes_total', 'Bytes written to the modem', ('modem',))
+sms_received = registry.counter('pyairlink_sms_received_total', 'Incoming SMS handed to the inbox', ('modem',))
+sms_concat_incomplete = registry.counter(
+    'pyairlink_sms_concat_incomplete_total', 'Concatenated SMS delivered with missing parts', ('modem',))
+sms_sent = registry.counter('pyairlink_sms_sent_total', 'Outgoing SMS by result', ('modem', 'result'))
+notification_duration = registry.histogram(
+    'pyairlink_notification_duration_seconds', 'Time to push one notification to a channel', ('channel',))
+notification_results = registry.counter(
+    'pyairlink_notification_results_total', 'Notification pushes by result', ('channel', 'result'))
+sms_delivery_duration = registry.histogram(
+    'pyairlink_sms_delivery_seconds', 'Time from AT+CMGS to the final status report', ('modem', 'result'),
+    buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 21600, 86400))
+job_duration = registry.histogram(
+    'pyairlink_scheduler_job_duration_seconds', 'Scheduled job run time', ('job', 'result'))
+
+
+def timed_job(func):
+    """
+    记录定时任务的运行时间，被装饰的函数仍可按原来的模块路径被 APScheduler 序列化引用
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = 'error'
+        try:
+            value = func(*args, **kwargs)
+            result = 'success' if value else 'failure'
+            return value
+        finally:
+            job_duration.labels(func.__name__, result).observe(time.perf_counter() - start)
+    return wrapper
@@ -0,0 +1,669 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import itertools
+import threading
+from enum import Enum, IntEnum
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import serial
+
+from .config_parser import config
+from .serial_manager import SerialManager
+from .at_parser import LineFramer, ATResponse, final_result
+from .events import events, MODEM_STATE
+from . import metrics
+
+logger = logging.getLogger("PyAirLink")
+
+# 无论当前是否有指令在等待回应，都按非请求结果码(URC)处理的前缀
+URC_PREFIXES = ('+CMTI:', '+CMT:', '+CDS:', '+CDSI:', '+CBM:', 'RING', '+CLIP:')
+# 这些URC的下一行是PDU数据
+URC_WITH_PDU = ('+CMT:', '+CDS:', '+CBM:')
+
+
+class Priority(IntEnum):
+    """
+    指令优先级，数值越小越先执行
+    """
+    INTERACTIVE = 0   # 用户通过API直接发起的指令
+    OUTBOUND_SMS = 1  # 发送短信
+    HOUSEKEEPING = 2  # 收短信、初始化等后台维护指令
+    SCHEDULED = 3     # 定时任务
+    BULK_SMS = 4      # 批量发送短信
+
+
+class ModemState(str, Enum):
+    """
+    模块初始化进度，由后台的 modem_supervisor 推进
+    """
+    PROBING = 'probing'        # 等待模块回应AT
+    SIM_READY = 'sim_ready'    # SIM卡就绪，正在设置短信参数
+    CONFIGURED = 'configured'  # 短信参数已设置，可以读取已存储的短信，等待附着网络
+    ATTACHED = 'attached'      # 已附着网络，可以收发短信
+    DEGRADED = 'degraded'      # 初始化失败或长时间无法附着网络，后台稍后重试
+
+
+# 可以读取、处理模块中短信的状态
+CONFIGURED_STATES = (ModemState.CONFIGURED, ModemState.ATTACHED)
+
+
+class ModemBusy(Exception):
+    """
+    指令队列已满，调用方应稍后重试
+    """
+
+
+class DeadlineExceeded(Exception):
+    """
+    指令在截止时间前没有执行完成
+    """
+
+
+class ModemNotReady(Exception):
+    """
+    模块尚未完成初始化或未附着网络，调用方应稍后重试
+    """
+
+
+class LinkDown(ModemNotReady):
+    """
+    串口断开，重连成功之前指令直接失败，不再排队等待
+    """
+
+
+class UnknownModem(KeyError):
+    """
+    配置中没有该id的模块
+    """
+
+
+def _normalize_keywords(keywords):
+    if not keywords:
+        return []
+    if isinstance(keywords, str):
+        return [keywords]
+    return keywords
+
+
+class _PendingCommand:
+    """
+    收集一条指令的回应行，收到最终结果码或匹配到调用方指定的关键字时结束
+    """
+
+    def __init__(self, keywords):
+        self.keywords = keywords
+        self.lines = []
+        self.result = None
+        self.aborted = False
+        self.done = threading.Event()
+
+    def feed(self, line):
+        self.lines.append(line)
+        self.result = final_result(line)
+        if self.result is not None:
+            self.done.set()
+            return
+        for kw in self.keywords:
+            if kw in line:
+                logger.debug(f"Matched keyword '{kw}' in response: {self.lines}")
+                self.done.set()
+                return
+
+    def abort(self):
+        """
+        串口断开时结束等待，不必等到超时
+        """
+        self.aborted = True
+        self.done.set()
+
+    def response(self):
+        return ATResponse(self.lines, self.result) if self.lines else None
+
+
+class _Request:
+    def __init__(self, steps, priority, deadline):
+        self.steps = steps
+        self.priority = priority
+        # 截止时间(time.monotonic)，在此之前仍未开始执行则放弃
+        self.submitted = time.monotonic()
+        self.deadline = self.submitted + deadline if deadline else None
+        self.future = Future()
+
+
+class ModemSession:
+    """
+    进程内唯一的模块会话。
+    持有串口并运行独立的读线程，把指令回应交给正在等待的调用方，把URC分发给订阅者。
+    串口断开时由读线程负责重连。
+
+    指令由单独的指令线程按优先级逐个执行，同一优先级内按提交顺序，调用方拿到 Future：
+    同步代码(监听线程、定时任务)阻塞等待结果，asyncio 代码 await 结果，不会阻塞事件循环。
+    队列积压超过上限时拒绝新的非后台指令(ModemBusy)，排队超过截止时间的指令不再执行(DeadlineExceeded)。
+    """
+
+    def __init__(self, modem_id='default', settings=None):
+        settings = settings or config.serial()
+        self.modem_id = modem_id
+        self.settings = settings
+        self._serial = SerialManager(settings)
+        self._requests = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._queue_size = settings.get('queue_size')
+        self.default_deadline = settings.get('queue_deadline')
+        self.attach_timeout = settings.get('attach_timeout') or 120
+        self.reconnect_max = settings.get('reconnect_max') or 30
+        self._stats_lock = threading.Lock()
+        self._depth = {priority: 0 for priority in Priority}
+        self._rejected = 0
+        self._expired = 0
+        self._pending = None
+        self._subscribers = []
+        self._pdu_header = None
+        self._connected = threading.Event()
+        self._state = ModemState.PROBING
+        self._state_reason = None
+        self._state_since = time.time()
+        self._state_changed = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        # 热路径上用到的指标子项，提前取好
+        self._queue_wait = {priority: metrics.command_queue_wait.labels(modem_id, priority.name.lower())
+                            for priority in Priority}
+        self._bytes_read = metrics.serial_bytes_read.labels(modem_id)
+        self._bytes_written = metrics.serial_bytes_written.labels(modem_id)
+        self._command_metrics = {}
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._read_loop, name=f'modem-reader-{self.modem_id}', daemon=True),
+            threading.Thread(target=self._command_loop, name=f'modem-commands-{self.modem_id}', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Modem session {self.modem_id} started")
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        # 丢弃尚未执行的指令
+        self._drain(lambda future: future.set_result([None]))
+        self._serial.close()
+        self._connected.clear()
+        logger.info(f"Modem session {self.modem_id} stopped")
+
+    def subscribe(self, prefixes, callback):
+        """
+        订阅URC。callback(line, pdu) 在读线程中调用，应尽快返回。
+        :param prefixes: URC前缀，如 '+CMTI:' 或它们的元组
+        :param callback: 回调函数，pdu 仅在 +CMT/+CDS/+CBM 时为下一行的PDU数据，否则为None
+        """
+        if isinstance(prefixes, str):
+            prefixes = (prefixes,)
+        self._subscribers.append((tuple(prefixes), callback))
+
+    def unsubscribe(self, callback):
+        self._subscribers = [(p, cb) for p, cb in self._subscribers if cb != callback]
+
+    def submit(self, steps, priority=Priority.INTERACTIVE, deadline=None):
+        """
+        提交一组需要连续执行、中间不被其它指令打断的AT指令。
+        某一步没有回应或返回错误结果码时停止执行后续步骤。
+
+        :param steps: [(command, keywords, timeout), ...]
+        :param priority: 优先级
+        :param deadline: 排队等待的最长秒数，None表示不限
+        :return: concurrent.futures.Future，结果为每一步的回应列表
+        """
+        request = _Request([(command, _normalize_keywords(keywords), timeout) for command, keywords, timeout in steps],
+                           priority, deadline)
+        # 熔断：串口断开期间直接失败，避免调用方排队等到超时
+        if not self._connected.is_set() and self._threads:
+            metrics.command_rejected.labels(self.modem_id, 'link_down').inc()
+            raise LinkDown(f"Serial link of modem {self.modem_id} is down")
+        with self._stats_lock:
+            if priority != Priority.HOUSEKEEPING and sum(self._depth.values()) >= self._queue_size:
+                self._rejected += 1
+                metrics.command_rejected.labels(self.modem_id, 'busy').inc()
+                raise ModemBusy(f"Modem {self.modem_id} command queue is full ({self._queue_size})")
+            self._depth[priority] += 1
+        self._requests.put((priority, next(self._sequence), request))
+        return request.future
+
+    def transaction(self, steps, priority=Priority.INTERACTIVE, deadline=None):
+        return self.wait(self.submit(steps, priority, deadline), steps, deadline)
+
+    def wait(self, request_future, steps, deadline=None):
+        """
+        等待 submit 返回的 future，超时后取消尚未执行的指令
+        """
+        try:
+            return request_future.result(timeout=self._wait_timeout(steps, deadline))
+        except FutureTimeoutError:
+            request_future.cancel()
+            raise DeadlineExceeded(f"Modem command not completed within deadline ({deadline}s)")
+
+    async def async_transaction(self, steps, priority=Priority.INTERACTIVE, deadline=None):
+        """
+        transaction 的 asyncio 版本，等待中的任务被取消(如HTTP客户端断开)时，尚未执行的指令会被跳过
+        """
+        request_future = self.submit(steps, priority, deadline)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(request_future), self._wait_timeout(steps, deadline))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Modem command not completed within deadline ({deadline}s)")
+
+    def send_at_command(self, command, keywords=None, timeout=3, priority=Priority.INTERACTIVE, deadline=None):
+        """
+        发送AT指令并等待响应。
+
+        :param command: 要发送的AT指令字节串
+        :param keywords: 除最终结果码外，额外判断响应结束的关键字列表，不传则只以最终结果码判断
+        :param timeout: 等待响应的超时时间(秒)
+        :param priority: 优先级
+        :param deadline: 排队等待的最长秒数，None表示不限
+        :return: 命令响应 ATResponse，或None表示失败
+        """
+        return self.transaction([(command, keywords, timeout)], priority, deadline)[0]
+
+    async def async_send_at_command(self, command, keywords=None, timeout=3, priority=Priority.INTERACTIVE,
+                                    deadline=None):
+        """
+        send_at_command 的 asyncio 版本
+        """
+        responses = await self.async_transaction([(command, keywords, timeout)], priority, deadline)
+        return responses[0]
+
+    @property
+    def connected(self):
+        return self._connected.is_set()
+
+    def wait_connected(self, timeout=None):
+        return self._connected.wait(timeout)
+
+    @property
+    def port(self):
+        return self._serial.port
+
+    @property
+    def state(self):
+        return self._state
+
+    def set_state(self, state, reason=None):
+        with self._state_changed:
+            if state != self._state:
+                logger.info(f"Modem {self.modem_id} is {state.value}" + (f": {reason}" if reason else ""))
+                self._state_since = time.time()
+            self._state = state
+            self._state_reason = reason
+            self._state_changed.notify_all()
+        self._publish_state()
+
+    async def async_set_state(self, state, reason=None):
+        self.set_state(state, reason)
+
+    def _publish_state(self):
+        events.publish(MODEM_STATE, {'modem': self.modem_id, **self.state_info()})
+
+    def wait_state(self, states, timeout=None):
+        """
+        等待模块进入 states 中的任一状态
+        :return: 是否已进入
+        """
+        with self._state_changed:
+            return self._state_changed.wait_for(lambda: self._state in states, timeout)
+
+    def wait_changed(self, timeout=None):
+        """
+        等待状态变化，用于在已就绪时阻塞后台线程
+        """
+        with self._state_changed:
+            state = self._state
+            return self._state_changed.wait_for(lambda: self._state != state, timeout)
+
+    def check_ready(self, timeout=0):
+        """
+        发送短信前调用，等待至多 timeout 秒直到模块附着网络，否则抛出 ModemNotReady
+        """
+        if not self.wait_state((ModemState.ATTACHED,), timeout):
+            raise ModemNotReady(f"Modem {self.modem_id} is not ready ({self._describe_state()})")
+
+    async def async_check_ready(self, timeout=0):
+        """
+        check_ready 的 asyncio 版本，在线程中等待，不阻塞事件循环
+        """
+        if self._state != ModemState.ATTACHED:
+            await asyncio.to_thread(self.check_ready, timeout)
+
+    def _describe_state(self):
+        return self._state.value + (f": {self._state_reason}" if self._state_reason else "")
+
+    def state_info(self):
+        with self._state_changed:
+            return {'state': self._state.value, 'reason': self._state_reason, 'since': self._state_since,
+                    'connected': self.connected}
+
+    def queue_stats(self):
+        with self._stats_lock:
+            depth = sum(self._depth.values())
+            return {
+                'depth': depth,
+                'limit': self._queue_size,
+                'saturated': depth >= self._queue_size,
+                'by_priority': {priority.name.lower(): count for priority, count in self._depth.items()},
+                'rejected': self._rejected,
+                'expired': self._expired,
+            }
+
+    async def async_queue_stats(self):
+        return self.queue_stats()
+
+    def _wait_timeout(self, steps, deadline):
+        """
+        调用方最长等待时间：排队截止时间加上每一步的超时(含网络传输的额外延迟)
+        """
+        if not deadline:
+            return None
+        return deadline + sum(timeout + self._serial.latency for _, _, timeout in steps)
+
+    def _drain(self, finish):
+        """
+        取出队列中尚未执行的全部指令，finish(future) 设置其结果
+        """
+        while True:
+            try:
+                _, _, request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            self._dequeued(request)
+            if request.future.set_running_or_notify_cancel():
+                finish(request.future)
+
+    def _dequeued(self, request):
+        with self._stats_lock:
+            self._depth[request.priority] -= 1
+
+    def _command_loop(self):
+        while not self._stop.is_set():
+            try:
+                _, _, request = self._requests.get(timeout=1)
+            except queue.Empty:
+                continue
+            self._dequeued(request)
+            # 调用方已取消则跳过
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            now = time.monotonic()
+            self._queue_wait[request.priority].observe(now - request.submitted)
+            if request.deadline is not None and now > request.deadline:
+                with self._stats_lock:
+                    self._expired += 1
+                metrics.command_rejected.labels(self.modem_id, 'deadline').inc()
+                logger.warning(f"Modem command expired in queue: {request.steps[0][0]}")
+                request.future.set_exception(DeadlineExceeded("Modem command expired in queue"))
+                continue
+            if not self._connected.is_set():
+                metrics.command_rejected.labels(self.modem_id, 'link_down').inc()
+                request.future.set_exception(LinkDown(f"Serial link of modem {self.modem_id} is down"))
+                continue
+            responses = []
+            try:
+                for command, keywords, timeout in request.steps:
+                    response = self._execute(command, keywords, timeout)
+                    responses.append(response)
+                    # 没有回应或返回错误时不再执行后续步骤
+                    if response is None or (response.result is not None and not response.ok):
+                        break
+                request.future.set_result(responses)
+            except Exception as e:
+                logger.error(f"send_at_command error: {e}")
+                request.future.set_exception(e)
+
+    def _metrics_for(self, command):
+        verb = metrics.command_verb(command)
+        children = self._command_metrics.get(verb)
+        if children is None:
+            children = self._command_metrics[verb] = (
+                metrics.at_command_duration.labels(self.modem_id, verb),
+                {result: metrics.at_command_results.labels(self.modem_id, verb, result)
+                 for result in ('ok', 'error', 'timeout', 'unavailable')},
+            )
+        return children
+
+    def _execute(self, command, keywords, timeout):
+        duration, results = self._metrics_for(command)
+        if not self._connected.is_set():
+            logger.error(f"Serial port is not available, command dropped: {command}")
+            results['unavailable'].inc()
+            return None
+        pending = _PendingCommand(keywords)
+        self._pending = pending
+        start = time.perf_counter()
+        try:
+            logger.debug(f"Sending command: {command}")
+            self._serial.write(command)
+            self._bytes_written.inc(len(command))
+            if not pending.done.wait(timeout + self._serial.latency):
+                logger.debug(f"Waiting for keywords {keywords} Timed out: {pending.response()}")
+        except (serial.SerialException, serial.SerialTimeoutException, OSError) as e:
+            logger.error(f"Serial communication error: {e}")
+            results['unavailable'].inc()
+            return None
+        finally:
+            self._pending = None
+        if pending.aborted:
+            logger.error(f"Serial link lost while waiting for response: {command}")
+            results['unavailable'].inc()
+            return None
+        duration.observe(time.perf_counter() - start)
+        response = pending.response()
+        if not pending.done.is_set():
+            results['timeout'].inc()
+        elif response.timed_out or response.ok:
+            # 匹配到调用方指定的关键字时没有最终结果码
+            results['ok'].inc()
+        else:
+            results['error'].inc()
+        return response
+
+    def _read_loop(self):
+        """
+        读线程同时是唯一负责重连的线程。串口断开后熔断(新指令直接抛出 LinkDown，排队中的指令立即失败)，
+        按 1 秒起指数退避重连，最长间隔 RECONNECT_MAX 秒；重连成功后模块回到 PROBING，
+        由 modem_supervisor 重新执行初始化
+        """
+        framer = LineFramer()
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                if not self._serial.is_open:
+                    self._serial.open()
+                    self._connected.set()
+                    metrics.serial_reconnects.labels(self.modem_id).inc()
+                    if backoff > 1:
+                        self.set_state(ModemState.PROBING, 'serial link restored')
+                    else:
+                        self._publish_state()
+                    backoff = 1
+                data = self._serial.read()
+            except (serial.SerialException, OSError) as e:
+                if self._connected.is_set():
+                    logger.error(f"Serial communication error on {self.modem_id}: {e}")
+                    self._link_lost()
+                self._serial.close()
+                framer.reset()
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.reconnect_max)
+                continue
+            if not data:
+                continue
+            self._bytes_read.inc(len(data))
+            for line in framer.feed(data):
+                self._dispatch(line)
+
+    def _link_lost(self):
+        self._connected.clear()
+        pending = self._pending
+        if pending is not None:
+            pending.abort()
+        self.set_state(ModemState.PROBING, 'serial link lost')
+        self._drain(lambda future: future.set_exception(
+            LinkDown(f"Serial link of modem {self.modem_id} is down")))
+
+    def _dispatch(self, line):
+        if not line:
+            return
+        if self._pdu_header is not None:
+            header, self._pdu_header = self._pdu_header, None
+            self._publish(header, line)
+            return
+        pending = self._pending
+        if pending is None or line.startswith(URC_PREFIXES):
+            if line.startswith(URC_WITH_PDU):
+                self._pdu_header = line
+                return
+            self._publish(line, None)
+            return
+        pending.feed(line)
+
+    def _publish(self, line, pdu):
+        delivered = False
+        for prefixes, callback in self._subscribers:
+            if line.startswith(prefixes):
+                delivered = True
+                try:
+                    callback(line, pdu)
+                except Exception as e:
+                    logger.error(f"URC subscriber error: {e}")
+        if not delivered:
+            logger.debug(f"Unsolicited line ignored: {line}")
+
+
+class RemoteModemSession(ModemSession):
+    """
+    多进程部署时 worker 进程中的模块会话。
+    指令经 IPC 交给持有串口的 owner 进程排队执行，状态由 owner 推送的 modem_state 事件维护，
+    读取状态、等待就绪都在本进程内完成。
+    asyncio 调用方取消等待时通知 owner 跳过仍在排队的指令，已经开始执行的指令会执行完。
+    """
+
+    def __init__(self, modem_id, settings, client):
+        super().__init__(modem_id, settings)
+        self._client = client
+        # 本进程内的请求编号，加上进程号作为取消排队指令时的标识
+        self._request_ids = itertools.count(1)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def subscribe(self, prefixes, callback):
+        raise RuntimeError("URC subscriptions are only available in the owner process")
+
+    @staticmethod
+    def _encode_steps(steps):
+        # AT指令和PDU都是ASCII加控制字符，按 latin-1 转换不会丢失内容
+        return [(command.decode('latin-1'), keywords, timeout) for command, keywords, timeout in steps]
+
+    @staticmethod
+    def _decode_responses(responses):
+        return [None if response is None else ATResponse(*response) for response in responses]
+
+    def transaction(self, steps, priority=Priority.INTERACTIVE, deadline=None):
+        return self._decode_responses(self._client.call(
+            'transaction', modem=self.modem_id, steps=self._encode_steps(steps), priority=int(priority),
+            deadline=deadline))
+
+    async def async_transaction(self, steps, priority=Priority.INTERACTIVE, deadline=None):
+        request = f'{os.getpid()}-{next(self._request_ids)}'
+        try:
+            return self._decode_responses(await self._client.async_call(
+                'transaction', modem=self.modem_id, steps=self._encode_steps(steps), priority=int(priority),
+                deadline=deadline, request=request))
+        except asyncio.CancelledError:
+            # owner 不会因为连接关闭而取消排队中的指令，需要单独通知
+            self._client.notify('cancel', request=request)
+            raise
+
+    def set_state(self, state, reason=None):
+        self._client.call('set_state', modem=self.modem_id, state=state.value, reason=reason)
+
+    async def async_set_state(self, state, reason=None):
+        await self._client.async_call('set_state', modem=self.modem_id, state=state.value, reason=reason)
+
+    def apply_state(self, info):
+        """
+        更新 owner 推送的状态
+        """
+        if info['connected']:
+            self._connected.set()
+        else:
+            self._connected.clear()
+        with self._state_changed:
+            self._state = ModemState(info['state'])
+            self._state_reason = info['reason']
+            self._state_since = info['since']
+            self._state_changed.notify_all()
+
+    def queue_stats(self):
+        return self._client.call('queue_stats', modem=self.modem_id)
+
+    async def async_queue_stats(self):
+        return await self._client.async_call('queue_stats', modem=self.modem_id)
+
+    async def async_restart(self, deadline=None):
+        """
+        由 owner 重启模块并等待重新就绪
+        :return: 是否重新就绪
+        """
+        return await self._client.async_call('restart', modem=self.modem_id, deadline=deadline)
+
+
+modems = {modem_id: ModemSession(modem_id, settings) for modem_id, settings in config.modems().items()}
+default_modem_id = next(iter(modems), None)
+_local_modems = dict(modems)
+
+
+def use_remote(client):
+    """
+    worker 进程中把模块会话替换为 RemoteModemSession，已通过 get_modem 取得会话的代码下次调用时生效
+    """
+    modems.update({modem_id: RemoteModemSession(modem_id, modem.settings, client)
+                   for modem_id, modem in _local_modems.items()})
+
+
+def use_local():
+    """
+    worker 进程接管串口成为 owner 时换回本地会话
+    """
+    modems.update(_local_modems)
+
+
+metrics.registry.gauge('pyairlink_modem_connected', 'Whether the serial port of the modem is open', ('modem',),
+                       callback=lambda: {(modem_id,): int(modem.connected) for modem_id, modem in modems.items()})
+metrics.registry.gauge('pyairlink_modem_state', 'Current initialization state of the modem (1 for the current state)',
+                       ('modem', 'state'),
+                       callback=lambda: {(modem_id, state.value): int(modem.state == state)
+                                         for modem_id, modem in modems.items() for state in ModemState})
+metrics.registry.gauge('pyairlink_command_queue_depth', 'Commands waiting in the modem queue', ('modem',),
+                       callback=lambda: {(modem_id,): modem.queue_stats()['depth']
+                                         for modem_id, modem in modems.items()})
+
+
+def get_modem(modem_id=None):
+    """
+    根据id获取模块会话，不传则返回默认模块(配置中的第一个)
+    """
+    modem_id = modem_id or default_modem_id
+    if modem_id not in modems:
+        raise UnknownModem(f"Unknown modem: {modem_id}")
+    return modems[modem_id]
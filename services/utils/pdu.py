@@ -0,0 +1,397 @@
+"""
+SMS PDU 编解码(3GPP TS 23.040)，支持 SMS-DELIVER、SMS-SUBMIT、SMS-STATUS-REPORT。
+直接在字节上解析，号码、时间戳、GSM 7-bit 字符都用预先计算好的查找表转换。
+解码结果的结构与 smspdudecoder 保持一致，原有代码中的 message['sender']['number'] 等写法不变。
+"""
+from datetime import datetime, timezone, timedelta
+
+
+class PDUError(ValueError):
+    """
+    PDU 格式错误或被截断
+    """
+
+
+# GSM 03.38 默认字母表
+GSM7_BASIC = (
+    '@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ !"#¤%&\'()*+,-./0123456789:;<=>?'
+    '¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà'
+)
+# 扩展表，以转义字符 0x1B 开头
+GSM7_EXTENDED = {10: '\f', 20: '^', 40: '{', 41: '}', 47: '\\', 60: '[', 61: '~', 62: ']', 64: '|', 101: '€'}
+GSM7_ESCAPE = 0x1B
+
+# 字符 -> septet 序列，编码时使用
+GSM7_ENCODE = {char: (septet,) for septet, char in enumerate(GSM7_BASIC) if septet != GSM7_ESCAPE}
+GSM7_ENCODE.update({char: (GSM7_ESCAPE, septet) for septet, char in GSM7_EXTENDED.items()})
+
+# 半八位组号码：每个字节两位数字，低半字节在前，F 为填充
+_NIBBLE_DIGITS = '0123456789*#abc'
+_SEMI_OCTETS = tuple(
+    (_NIBBLE_DIGITS[b & 0x0F] if (b & 0x0F) < 15 else '') + (_NIBBLE_DIGITS[b >> 4] if (b >> 4) < 15 else '')
+    for b in range(256)
+)
+_DIGIT_NIBBLES = {digit: value for value, digit in enumerate(_NIBBLE_DIGITS)}
+# 时间戳中的两位十进制数，同样低半字节在前
+_BCD = tuple((b & 0x0F) * 10 + (b >> 4) for b in range(256))
+
+TYPE_OF_NUMBER = ('unknown', 'international', 'national', 'network', 'subscriber', 'alphanumeric',
+                  'abbreviated', 'reserved')
+NUMBERING_PLAN = {0: 'unknown', 1: 'isdn', 3: 'data', 4: 'telex', 8: 'national', 9: 'private', 10: 'ermes'}
+
+MTI_DELIVER, MTI_SUBMIT, MTI_STATUS_REPORT = 0, 1, 2
+
+# IEI 0x00: 8位参考号的长短信，0x08: 16位参考号的长短信
+IEI_CONCAT_8, IEI_CONCAT_16 = 0x00, 0x08
+
+
+def _to_bytes(pdu):
+    if isinstance(pdu, (bytes, bytearray, memoryview)):
+        return bytes(pdu)
+    try:
+        return bytes.fromhex(pdu.strip())
+    except ValueError as e:
+        raise PDUError(f"PDU is not valid hex: {e}")
+
+
+def unpack_gsm7(data, count, skip=0):
+    """
+    解包 GSM 7-bit 字符
+    :param data: 打包后的字节
+    :param count: septet 个数(TP-UDL)
+    :param skip: 开头跳过的 septet 数，用于跳过用户数据头和填充位
+    """
+    value = int.from_bytes(data, 'little')
+    septets = [(value >> shift) & 0x7F for shift in range(skip * 7, count * 7, 7)]
+    if GSM7_ESCAPE not in septets:
+        return ''.join([GSM7_BASIC[septet] for septet in septets])
+    chars = []
+    escaped = False
+    for septet in septets:
+        if escaped:
+            chars.append(GSM7_EXTENDED.get(septet, GSM7_BASIC[septet]))
+            escaped = False
+        elif septet == GSM7_ESCAPE:
+            escaped = True
+        else:
+            chars.append(GSM7_BASIC[septet])
+    return ''.join(chars)
+
+
+def gsm7_septets(text):
+    """
+    把文本转换为 GSM 7-bit septet 列表，有字符不在 GSM 字母表中时返回None
+    """
+    septets = []
+    try:
+        for char in text:
+            septets.extend(GSM7_ENCODE[char])
+    except KeyError:
+        return None
+    return septets
+
+
+def pack_gsm7(septets, skip=0):
+    """
+    打包 septet 列表
+    :param skip: 前面预留的 septet 数(用户数据头占用)，返回的字节中不包含这部分
+    """
+    value = 0
+    for i, septet in enumerate(septets):
+        value |= septet << ((i + skip) * 7)
+    length = ((len(septets) + skip) * 7 + 7) // 8
+    return value.to_bytes(length, 'little')[(skip * 7) // 8:] if septets else b''
+
+
+def decode_number(data, length, toa):
+    if TYPE_OF_NUMBER[(toa >> 4) & 0x07] == 'alphanumeric':
+        return unpack_gsm7(data, length * 4 // 7)
+    return ''.join([_SEMI_OCTETS[b] for b in data])[:length]
+
+
+def encode_number(number):
+    """
+    :return: (号码位数, 类型字节, 半八位组编码的号码)
+    """
+    toa = 0x91 if number.startswith('+') else 0x81
+    digits = number.lstrip('+')
+    try:
+        nibbles = [_DIGIT_NIBBLES[digit] for digit in digits]
+    except KeyError:
+        raise PDUError(f"Invalid character in number: {number}")
+    if len(nibbles) % 2:
+        nibbles.append(0x0F)
+    return len(digits), toa, bytes(nibbles[i] | (nibbles[i + 1] << 4) for i in range(0, len(nibbles), 2))
+
+
+def decode_timestamp(data):
+    """
+    7字节的服务中心时间戳，转换为UTC时间
+    """
+    if len(data) < 7:
+        raise PDUError("Timestamp is truncated")
+    tz = ((data[6] & 0x0F) << 4) | (data[6] >> 4)
+    quarters = (tz >> 4 & 0x07) * 10 + (tz & 0x0F)
+    offset = timedelta(minutes=15 * quarters * (-1 if tz & 0x80 else 1))
+    try:
+        local = datetime(2000 + _BCD[data[0]], _BCD[data[1]], _BCD[data[2]], _BCD[data[3]], _BCD[data[4]],
+                         _BCD[data[5]], tzinfo=timezone(offset))
+    except ValueError as e:
+        raise PDUError(f"Invalid timestamp: {e}")
+    return local.astimezone(timezone.utc)
+
+
+def decode_dcs(dcs):
+    """
+    数据编码方案(TS 23.038)
+    """
+    group = dcs >> 4
+    if group <= 0x07:
+        # 通用数据编码，bit5 为压缩标志
+        if dcs & 0x20:
+            return {'encoding': 'binary'}
+        return {'encoding': ('gsm', 'binary', 'ucs2', 'gsm')[(dcs >> 2) & 0x03]}
+    if group == 0x0F:
+        return {'encoding': 'binary' if dcs & 0x04 else 'gsm'}
+    if group == 0x0E:
+        return {'encoding': 'ucs2'}
+    return {'encoding': 'gsm'}
+
+
+class _Reader:
+    __slots__ = ('data', 'pos')
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def byte(self):
+        if self.pos >= len(self.data):
+            raise PDUError("PDU is truncated")
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def take(self, length):
+        end = self.pos + length
+        if end > len(self.data):
+            raise PDUError("PDU is truncated")
+        chunk = self.data[self.pos:end]
+        self.pos = end
+        return chunk
+
+    def rest(self):
+        chunk = self.data[self.pos:]
+        self.pos = len(self.data)
+        return chunk
+
+
+def _read_address(reader, smsc=False):
+    length = reader.byte()
+    if smsc:
+        # SMSC 地址的长度是字节数(含类型字节)
+        if length == 0:
+            return {'length': 0, 'toa': None, 'number': None}
+        toa = reader.byte()
+        data = reader.take(length - 1)
+        digits = (length - 1) * 2
+    else:
+        # 其它地址的长度是号码位数
+        toa = reader.byte()
+        data = reader.take((length + 1) // 2)
+        digits = length
+    return {
+        'length': length,
+        'toa': {'ton': TYPE_OF_NUMBER[(toa >> 4) & 0x07], 'npi': NUMBERING_PLAN.get(toa & 0x0F, 'reserved')},
+        'number': decode_number(data, digits, toa),
+    }
+
+
+def _read_user_data_header(data):
+    elements = []
+    length = data[0]
+    pos = 1
+    while pos + 1 < length + 1:
+        iei, element_length = data[pos], data[pos + 1]
+        value = data[pos + 2:pos + 2 + element_length]
+        if iei == IEI_CONCAT_8 and element_length == 3:
+            value = {'reference': value[0], 'parts_count': value[1], 'part_number': value[2]}
+        elif iei == IEI_CONCAT_16 and element_length == 4:
+            value = {'reference': value[0] << 8 | value[1], 'parts_count': value[2], 'part_number': value[3]}
+        else:
+            value = value.hex().upper()
+        elements.append({'iei': iei, 'length': element_length, 'data': value})
+        pos += 2 + element_length
+    return {'length': length, 'elements': elements}
+
+
+def _read_user_data(reader, udhi, encoding):
+    length = reader.byte()
+    data = reader.rest()
+    if len(data) < ((length * 7 + 7) // 8 if encoding == 'gsm' else length):
+        raise PDUError("User data is truncated")
+    header, header_length = None, 0
+    if udhi and data:
+        header = _read_user_data_header(data)
+        header_length = header['length'] + 1
+    if encoding == 'gsm':
+        # 用户数据头之后补齐到 septet 边界
+        skip = (header_length * 8 + 6) // 7
+        text = unpack_gsm7(data[:(length * 7 + 7) // 8], length, skip)
+    elif encoding == 'ucs2':
+        payload = data[header_length:length]
+        text = payload[:len(payload) // 2 * 2].decode('utf-16-be', errors='replace')
+    else:
+        text = data[header_length:length]
+    return {'header': header, 'data': text}
+
+
+def _read_first_octet(reader, submit=False):
+    first = reader.byte()
+    header = {'rp': bool(first & 0x80), 'udhi': bool(first & 0x40)}
+    if submit:
+        header.update({'srr': bool(first & 0x20), 'vpf': (first >> 3) & 0x03, 'rd': bool(first & 0x04),
+                       'mti': 'submit'})
+    else:
+        header.update({'sri': bool(first & 0x20), 'lp': bool(first & 0x08), 'mms': bool(first & 0x04),
+                       'mti': ('deliver', 'submit', 'status-report', 'reserved')[first & 0x03]})
+    return header
+
+
+def decode_deliver(pdu):
+    """
+    解码 SMS-DELIVER(含SMSC部分)，即 +CMGL/+CMGR/+CMT 中的PDU数据
+    """
+    reader = _Reader(_to_bytes(pdu))
+    result = {'smsc': _read_address(reader, smsc=True), 'header': _read_first_octet(reader)}
+    result['sender'] = _read_address(reader)
+    result['pid'] = reader.byte()
+    result['dcs'] = decode_dcs(reader.byte())
+    result['scts'] = decode_timestamp(reader.take(7))
+    result['user_data'] = _read_user_data(reader, result['header']['udhi'], result['dcs']['encoding'])
+    return result
+
+
+def decode_submit(pdu):
+    """
+    解码 SMS-SUBMIT(含SMSC部分)，即模块中存储的待发送/已发送短信
+    """
+    reader = _Reader(_to_bytes(pdu))
+    result = {'smsc': _read_address(reader, smsc=True), 'header': _read_first_octet(reader, submit=True)}
+    result['message-ref'] = reader.byte()
+    result['recipient'] = _read_address(reader)
+    result['pid'] = reader.byte()
+    result['dcs'] = decode_dcs(reader.byte())
+    vpf = result['header']['vpf']
+    if vpf == 2:
+        result['vp'] = reader.byte()
+    elif vpf == 3:
+        result['vp'] = decode_timestamp(reader.take(7))
+    elif vpf == 1:
+        reader.take(7)  # 跳过增强格式
+    result['user_data'] = _read_user_data(reader, result['header']['udhi'], result['dcs']['encoding'])
+    return result
+
+
+def decode_status_report(pdu):
+    """
+    解码 SMS-STATUS-REPORT(含SMSC部分)，即 +CDS 上报的PDU数据
+    :return: status 为 TP-ST，0x00-0x1F 表示已送达
+    """
+    reader = _Reader(_to_bytes(pdu))
+    result = {'smsc': _read_address(reader, smsc=True)}
+    first = reader.byte()
+    result['header'] = {'udhi': bool(first & 0x40), 'srq': bool(first & 0x20), 'lp': bool(first & 0x08),
+                        'mms': bool(first & 0x04), 'mti': 'status-report'}
+    result['message-ref'] = reader.byte()
+    result['recipient'] = _read_address(reader)
+    result['scts'] = decode_timestamp(reader.take(7))
+    result['discharge_time'] = decode_timestamp(reader.take(7))
+    result['status'] = reader.byte()
+    return result
+
+
+_DECODERS = {MTI_DELIVER: decode_deliver, MTI_SUBMIT: decode_submit, MTI_STATUS_REPORT: decode_status_report}
+
+
+def decode(pdu):
+    """
+    按 TP-MTI 自动选择解码方式
+    """
+    data = _to_bytes(pdu)
+    if not data or len(data) <= data[0] + 1:
+        raise PDUError("PDU is truncated")
+    decoder = _DECODERS.get(data[data[0] + 1] & 0x03)
+    if decoder is None:
+        raise PDUError("Unsupported TP-MTI")
+    return decoder(data)
+
+
+def decode_batch(pdus):
+    """
+    一次解码多条PDU，所有十六进制字符串只转换一次
+    :return: 与输入一一对应的解码结果，无法解码的为 PDUError 实例
+    """
+    pdus = [pdu.strip() for pdu in pdus]
+    try:
+        data = bytes.fromhex(''.join(pdus))
+    except ValueError:
+        # 其中有非法数据时逐条转换，只影响出错的那一条
+        return [_decode_or_error(pdu) for pdu in pdus]
+    results = []
+    pos = 0
+    for pdu in pdus:
+        length = len(pdu) // 2
+        if len(pdu) % 2:
+            results.append(PDUError("PDU has an odd number of hex digits"))
+            return results + [_decode_or_error(rest) for rest in pdus[len(results):]]
+        results.append(_decode_or_error(data[pos:pos + length]))
+        pos += length
+    return results
+
+
+def _decode_or_error(pdu):
+    try:
+        return decode(pdu)
+    except PDUError as e:
+        return e
+    except (IndexError, ValueError) as e:
+        return PDUError(str(e))
+
+
+def concat_header(reference, parts_count, part_number, reference_bits=8):
+    """
+    长短信的用户数据头(不含长度字节)
+    :param reference_bits: 8 使用 IEI 0x00，16 使用 IEI 0x08
+    """
+    if reference_bits == 16:
+        return bytes((IEI_CONCAT_16, 4, (reference >> 8) & 0xFF, reference & 0xFF, parts_count, part_number))
+    return bytes((IEI_CONCAT_8, 3, reference & 0xFF, parts_count, part_number))
+
+
+def encode_submit(number, text=None, user_data=None, dcs=0x08, message_ref=0, srr=False, udh=None):
+    """
+    编码 SMS-SUBMIT，SMSC 使用模块默认值
+    :param number: 目标号码，以 + 开头时为国际号码
+    :param text: 短信内容，dcs 为 0x00 时按 GSM 7-bit 编码，否则按 UCS2 编码
+    :param user_data: 已编码的用户数据(GSM 7-bit 时为 septet 列表)，与 text 二选一
+    :param message_ref: TP-MR
+    :param srr: 是否请求状态报告
+    :param udh: 用户数据头(不含长度字节)
+    :return: (PDU十六进制字符串, AT+CMGS 的长度参数)
+    """
+    digits, toa, encoded_number = encode_number(number)
+    first = 0x01 | (0x20 if srr else 0) | (0x40 if udh else 0)
+    header = bytes((len(udh),)) + udh if udh else b''
+    if dcs == 0x00:
+        septets = user_data if user_data is not None else gsm7_septets(text)
+        if septets is None:
+            raise PDUError("Text contains characters outside the GSM 7-bit alphabet")
+        skip = (len(header) * 8 + 6) // 7
+        payload = header + pack_gsm7(septets, skip)
+        udl = skip + len(septets)
+    else:
+        payload = header + (user_data if user_data is not None else text.encode('utf-16-be'))
+        udl = len(payload)
+    tpdu = bytes((first, message_ref & 0xFF, digits, toa)) + encoded_number + bytes((0x00, dcs, udl)) + payload
+    return '00' + tpdu.hex().upper(), len(tpdu)
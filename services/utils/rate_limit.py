@@ -0,0 +1,47 @@
+import time
+import threading
+
+
+class TokenBucket:
+    """
+    令牌桶限速，按 rate 个/秒补充令牌，最多积攒 burst 个
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """
+        :return: 0 表示已取得令牌，否则为还需等待的秒数
+        """
+        # 一次需要的令牌比桶容量多时(长短信分段多)，攒满即可发送，之后按欠下的令牌等待
+        needed = min(tokens, self.burst)
+        with self._lock:
+            self._refill()
+            if self._tokens >= needed:
+                self._tokens -= tokens
+                return 0
+            return (needed - self._tokens) / self.rate
+
+    def acquire(self, tokens=1, stop_event=None):
+        """
+        阻塞直到取得令牌
+        :return: 是否取得，stop_event 被设置时放弃并返回False
+        """
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return True
+            if stop_event is None:
+                time.sleep(wait)
+            elif stop_event.wait(wait):
+                return False
@@ -1,35 +1,94 @@
-import time
+import socket
+import select
+import threading
 import logging
 
 import serial
 
-from services import serial_lock
 from .config_parser import config
 
 logger = logging.getLogger("PyAirLink")
 
+# PORT 支持的传输方式，没有 scheme 时为本地串口
+TRANSPORTS = ('serial', 'tcp', 'rfc2217')
+# 网络传输默认额外等待的秒数，用于补偿网络往返和串口服务器的转发延迟
+NETWORK_LATENCY = 0.5
+
+
+def parse_port(port):
+    """
+    :param port: /dev/ttyACM0、serial:///dev/ttyACM0、tcp://host:port 或 rfc2217://host:port
+    :return: (传输方式, 交给 pyserial 打开的路径或URL)
+    """
+    if '://' not in port:
+        return 'serial', port
+    scheme, address = port.split('://', 1)
+    scheme = scheme.lower()
+    if scheme == 'serial':
+        return 'serial', address
+    if scheme in ('tcp', 'socket'):
+        # 透传模式的串口服务器(DTU)，由 pyserial 的 socket:// 处理
+        return 'tcp', f'socket://{address}'
+    if scheme == 'rfc2217':
+        return 'rfc2217', port
+    raise ValueError(f"Unsupported serial transport: {scheme}, expected one of {', '.join(TRANSPORTS)}")
+
 
 class SerialManager:
-    def __init__(self):
-        self.port = config.serial().get('port')
-        self.rate = config.serial().get('rate')
-        self.timeout = config.serial().get('timeout')
+    def __init__(self, settings=None):
+        settings = settings or config.serial()
+        self.port = settings.get('port')
+        self.rate = settings.get('rate')
+        self.timeout = settings.get('timeout')
+        self.transport, self.url = parse_port(self.port)
+        self.keepalive = settings.get('keepalive') or 30
+        latency = settings.get('latency')
+        # 每条指令在超时之外额外等待的秒数
+        self.latency = latency if latency is not None else (0 if self.transport == 'serial' else NETWORK_LATENCY)
         self._ser = None
+        self._socket = None
+        self._write_lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._ser is not None and self._ser.is_open
 
     def open(self):
         """
-        打开串口连接。
+        打开串口连接。网络传输的连接建立后一直保持，断开后由调用方重新 open。
         """
         if self._ser is None or not self._ser.is_open:
             try:
-                self._ser = serial.Serial(self.port, self.rate, timeout=self.timeout)
+                if self.transport == 'serial':
+                    self._ser = serial.Serial(self.url, self.rate, timeout=self.timeout)
+                else:
+                    self._ser = serial.serial_for_url(self.url, baudrate=self.rate, timeout=self.timeout)
+                    self._socket = getattr(self._ser, '_socket', None)
+                    self._tune_socket()
                 logger.info(f"Serial port is open：{self.port}, baud rate：{self.rate}")
             except Exception as e:
                 logger.error(f"Unable to open serial port：{e}")
                 self._ser = None
+                self._socket = None
                 raise e
         return self
 
+    def _tune_socket(self):
+        """
+        关闭 Nagle 算法，AT指令是短小的请求-应答；
+        开启 TCP keepalive，及时发现串口服务器掉电、NAT超时等静默断开的连接
+        """
+        sock = self._socket
+        if sock is None:
+            return
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # 以下选项只在 Linux 等平台可用
+        for option, value in (('TCP_KEEPIDLE', self.keepalive), ('TCP_KEEPINTVL', max(1, self.keepalive // 3)),
+                              ('TCP_KEEPCNT', 3)):
+            if hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
     def __enter__(self):
         self.open()
         return self
@@ -49,59 +108,46 @@ class SerialManager:
                 logger.error(f"Error closing serial port: {e}")
             finally:
                 self._ser = None
+                self._socket = None
 
-    def send_at_command(self, command, keywords=None, timeout=3, retries=120):
+    def write(self, data):
+        """
+        写入数据并等待发送完成，串口未打开时抛出 SerialException。
         """
-        发送AT指令并等待响应，支持自动重连机制。
+        ser = self._ser
+        if ser is None or not ser.is_open:
+            raise serial.SerialException("Serial port is not open")
+        with self._write_lock:
+            ser.write(data)
+            ser.flush()
 
-        :param command: 要发送的AT指令字符串
-        :param keywords: 判断响应成功的关键字列表
-        :param timeout: 等待响应的超时时间(秒)
-        :param retries: 最大重试次数
-        :return: 命令响应字符串，或None表示失败
+    def read(self):
         """
-        if not keywords:
-            keywords = ['OK', 'ERROR']
-        if isinstance(keywords, str):
-            keywords = [keywords]
-
-        attempt = 0  # 当前重试次数
-
-        while attempt < retries:
-            with serial_lock:
-                try:
-                    # 检查串口是否已打开
-                    if self._ser is None or not self._ser.is_open:
-                        logger.warning("The serial port is not open, trying to open...")
-                        self.open()
-
-                    logger.debug(f"Sending command: {command}")
-                    self._ser.write(command)
-                    self._ser.flush()
-                    response = ''
-                    start_time = time.time()
-                    while time.time() - start_time < timeout:
-                        if self._ser.in_waiting:
-                            data = self._ser.read(self._ser.in_waiting).decode(errors='ignore')
-                            response += data
-                            for kw in keywords:
-                                if kw in response:
-                                    logger.debug(f"Matched keyword '{kw}' in response: {response}")
-                                    return response
-                        time.sleep(0.1)
-                    logger.debug(f"Waiting for keywords {keywords} Timed out: {response}")
-                    return response if response else None
-                except (serial.SerialException, serial.SerialTimeoutException, OSError) as e:
-                    logger.error(f"Serial communication error: {e}")
-                    # 尝试重连
-                    attempt += 1
-                    logger.info(f"Trying to reconnect to the serial port ({attempt} times)")
-                    self.close()  # 关闭串口，准备重新打开
-                    time.sleep(1)  # 等待一段时间再尝试
-                    continue  # 继续下一次重试
-                except Exception as e:
-                    logger.error(f"send_at_command error: {e}")
-                    return None
-
-        logger.error(f"Unable to complete command send after {retries} attempts: {command}")
-        return None
\ No newline at end of file
+        阻塞读取，至少收到一个字节或到达串口超时后返回，并带上缓冲区中已到达的全部数据。
+        """
+        ser = self._ser
+        if ser is None or not ser.is_open:
+            raise serial.SerialException("Serial port is not open")
+        data = ser.read(1)
+        if not data:
+            return data
+        if self.transport == 'tcp':
+            # socket:// 的 in_waiting 只表示是否可读，直接从 socket 收取已到达的数据
+            data += self._drain_socket()
+        elif ser.in_waiting:
+            data += ser.read(ser.in_waiting)
+        return data
+
+    def _drain_socket(self):
+        sock = self._socket
+        data = b''
+        try:
+            while select.select([sock], [], [], 0)[0]:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    # 对端关闭连接，下一次 read 时由 pyserial 报告断开
+                    break
+                data += chunk
+        except OSError as e:
+            raise serial.SerialException(f"read failed: {e}")
+        return data
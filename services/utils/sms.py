@@ -1,77 +1,126 @@
+import random
 import logging
+import itertools
 
-from smspdudecoder.fields import SMSDeliver
-from smspdudecoder.codecs import UCS2
-from smspdudecoder.elements import Number, TypeOfAddress
+from .pdu import decode, decode_batch, encode_submit, concat_header, gsm7_septets, GSM7_ESCAPE, PDUError
 
 
 logger = logging.getLogger("PyAirLink")
 
+# TP-DCS：GSM 7-bit 默认字母表 / UCS2
+DCS_GSM7, DCS_UCS2 = 0x00, 0x08
+# 单条短信140字节的用户数据可容纳的字符数
+GSM7_MAX_SEPTETS = 160
+UCS2_MAX_UNITS = 70
+USER_DATA_BYTES = 140
+# 长短信总条数和序号都只占一个字节
+MAX_PARTS = 255
+
+_references = itertools.count(random.randrange(1 << 16))
+
 
 def parse_pdu(pdu):
     """
     简单解析 PDU 格式短信
+    :param pdu: 十六进制字符串或字节
     """
     try:
-        sms_data = SMSDeliver.decode(pdu)
-        return sms_data
-    except Exception as e:
+        return decode(pdu)
+    except PDUError as e:
         logger.error(f"PDU parsing failed: {e}")
         raise e
 
 
-def encode_pdu(destination_number, message):
-    if len(message) > 70:
-        raise ValueError("Message too long")
-
-    # 假设使用默认SMSC
-    smsc_len = "00"
-
-    # First Octet: SMS-SUBMIT，一般为0x11或0x01，如果是11需要做别的改动
-    first_octet = "01"
-
-    # TP-MR(消息参考号)，可用固定值或计数器
-    tp_mr = "00"
+def parse_pdus(pdus):
+    """
+    批量解析，用于一次读出多条短信的 AT+CMGL
+    :return: 与输入一一对应的结果，解析失败的为 PDUError 实例
+    """
+    return decode_batch(pdus)
 
-    # TypeOfAddress编码
-    toa = TypeOfAddress.encode({'ton': 'international', 'npi': 'isdn'})  # 若号码有+号则国际，否则可改'ton'
 
-    # 编码号码
-    # 先去掉+号
-    dest_num = destination_number[1:] if destination_number.startswith('+') else destination_number
-    encoded_number = Number.encode(dest_num)
-    # 号码长度(十进制转两位十六进制)
-    num_len = f"{len(dest_num):02X}"
+def choose_encoding(message):
+    """
+    选择能表示全部字符的最省空间的编码，只有出现 GSM 03.38 字母表(含扩展表)以外的字符时才使用UCS2
+    :return: (TP-DCS, 用户数据)，GSM 7-bit 时用户数据为 septet 列表，UCS2 时为字节
+    """
+    septets = gsm7_septets(message)
+    if septets is not None:
+        return DCS_GSM7, septets
+    return DCS_UCS2, message.encode('utf-16-be')
 
-    # TP-PID = 00（普通SMS）
-    tp_pid = "00"
 
-    # TP-DCS = 08 (UCS2编码)
-    tp_dcs = "08"
+def split_message(message, reference_bits=8):
+    """
+    按单条短信的容量切分内容，超出一条时每段预留长短信用户数据头的位置。
+    GSM 7-bit 不拆开转义序列，UCS2 不拆开代理对。
+    :return: (TP-DCS, [每段的用户数据])
+    """
+    dcs, user_data = choose_encoding(message)
+    if dcs == DCS_GSM7:
+        if len(user_data) <= GSM7_MAX_SEPTETS:
+            return dcs, [user_data]
+        size = (USER_DATA_BYTES - _header_bytes(reference_bits)) * 8 // 7
+    else:
+        if len(user_data) <= UCS2_MAX_UNITS * 2:
+            return dcs, [user_data]
+        size = (USER_DATA_BYTES - _header_bytes(reference_bits)) // 2 * 2
+    parts = []
+    start = 0
+    while start < len(user_data):
+        end = min(start + size, len(user_data))
+        if end < len(user_data):
+            if dcs == DCS_GSM7 and user_data[end - 1] == GSM7_ESCAPE:
+                end -= 1
+            elif dcs == DCS_UCS2 and 0xD8 <= user_data[end - 2] <= 0xDB:
+                end -= 2
+        parts.append(user_data[start:end])
+        start = end
+    return dcs, parts
+
+
+def _header_bytes(reference_bits):
+    # 用户数据头长度字节 + IEI + 元素长度 + 参考号 + 总条数 + 序号
+    return 1 + len(concat_header(0, 0, 0, reference_bits))
+
+
+def check_message_length(message, reference_bits=8):
+    """
+    检查短信内容能否在长短信允许的条数内发出，超出时抛出 ValueError
+    :return: (TP-DCS, [每段的用户数据])
+    """
+    dcs, parts = split_message(message, reference_bits)
+    if len(parts) > MAX_PARTS:
+        raise ValueError(f"Message too long, it would be split into {len(parts)} SMS, "
+                         f"at most {MAX_PARTS} are allowed.")
+    return dcs, parts
 
-    # 编码短信内容为UCS2
-    ucs2_data = UCS2.encode(message)
-    ucs2_len = f"{len(ucs2_data) // 2:02X}"
 
-    # 拼接PDU：SMSC + FirstOctet + TP-MR + DA-Length + TOA + DA-Number + TP-PID + TP-DCS + TP-UDL + TP-UD
-    pdu = (
-            smsc_len +  # SMSC为空
-            first_octet +
-            tp_mr +
-            num_len + toa + encoded_number +
-            tp_pid + tp_dcs +
-            ucs2_len + ucs2_data
-    )
+def next_reference(reference_bits=8):
+    """
+    长短信参考号，同一号码短时间内的不同长短信需要使用不同的参考号
+    """
+    return next(_references) % (1 << reference_bits)
 
-    # 计算AT+CMGS中的长度
-    # 长度 = PDU的字节数(不包括SMSC长度字节本身)
-    pdu_length = (len(pdu) // 2) - 1
 
-    return pdu, pdu_length
+def encode_pdus(destination_number, message, reference_bits=8, srr=False, message_refs=None):
+    """
+    使用默认SMSC，号码带+号时按国际号码编码，内容自动选择 GSM 7-bit 或 UCS2 编码，
+    超出一条短信容量时按长短信切分，每段带用户数据头
+    :param srr: 是否请求状态报告
+    :param message_refs: 依次产生每段 TP-MR 的迭代器，不传则为0，由模块分配
+    :return: [(PDU, 长度), ...]，长度用于 AT+CMGS，为不包括SMSC部分的字节数
+    """
+    dcs, parts = check_message_length(message, reference_bits)
+    reference = next_reference(reference_bits) if len(parts) > 1 else None
+    return [encode_submit(destination_number, user_data=part, dcs=dcs, srr=srr,
+                          message_ref=next(message_refs) if message_refs else 0,
+                          udh=concat_header(reference, len(parts), number, reference_bits) if reference is not None
+                          else None)
+            for number, part in enumerate(parts, 1)]
 
 
 if __name__ == "__main__":
-    from io import StringIO
     test = [
         '0791448720003023240DD0E474D81C0EBB010000111011315214000BE474D81C0EBB5DE3771B',
         '07917238010010F5040BC87238880900F100009930925161958003C16010',
@@ -79,4 +128,4 @@ if __name__ == "__main__":
         '07912180958739F1040B917120069876F000009140503223218A21D4F29C0E6A97E7F3F0B90CA2BF41412A68F86EB7C36E32885A9ED3CB72',
     ]
     for t in test:
-        print(parse_pdu(StringIO(t)))
\ No newline at end of file
+        print(parse_pdu(t))
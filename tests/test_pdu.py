@@ -0,0 +1,197 @@
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from services.utils.pdu import decode, decode_batch, encode_submit, unpack_gsm7, pack_gsm7, gsm7_septets, \
+    PDUError, GSM7_ESCAPE
+from services.utils.sms import split_message, check_message_length, encode_pdus, DCS_GSM7, DCS_UCS2, MAX_PARTS
+
+# 3GPP TS 23.040 / Wikipedia "GSM 03.40" 中的示例
+WIKI_DELIVER = '07917283010010F5040BC87238880900F10000993092516195800AE8329BFD4697D9EC37'
+WIKI_SUBMIT = '0011000B916407281553F80000AA0AE8329BFD4697D9EC37'
+# 8613800138000 发来的 UCS2 短信“你好”，2025-01-06 14:56:32 +08:00
+UCS2_DELIVER = '00040D91683108108300F0000852106041652323044F60597D'
+# TP-MR 0x2A 的状态报告，提交一分钟后送达
+STATUS_REPORT = '0006' '2A' '0D91683108108300F0' '52106041652323' '52106041752323' '00'
+
+
+def _segments(text, reference_bits=8):
+    """
+    编码后逐段解码
+    :return: (各段的解码结果, 各段 AT+CMGS 长度)
+    """
+    pdus = encode_pdus('+8613800138000', text, reference_bits=reference_bits)
+    return [decode(pdu) for pdu, _ in pdus], [length for _, length in pdus]
+
+
+def _concat(segment):
+    header = segment['user_data']['header']
+    return header['elements'][0]['data'] if header else None
+
+
+def test_decode_deliver_reference_vector():
+    message = decode(WIKI_DELIVER)
+    assert message['header']['mti'] == 'deliver'
+    assert message['smsc']['number'] == '27381000015'
+    assert message['smsc']['toa']['ton'] == 'international'
+    assert message['sender']['number'] == '27838890001'
+    assert message['dcs']['encoding'] == 'gsm'
+    # 99-03-29 15:16:59，时区 +8 刻钟
+    assert message['scts'] == datetime(2099, 3, 29, 13, 16, 59, tzinfo=timezone.utc)
+    assert message['user_data'] == {'header': None, 'data': 'hellohello'}
+
+
+def test_decode_submit_reference_vector():
+    message = decode(WIKI_SUBMIT)
+    assert message['header']['mti'] == 'submit'
+    assert message['header']['vpf'] == 2
+    assert message['vp'] == 0xAA
+    assert message['recipient']['number'] == '46708251358'
+    assert message['user_data']['data'] == 'hellohello'
+
+
+def test_encode_submit_reference_vector():
+    # 与 WIKI_SUBMIT 相同，只是不带有效期(TP-VPF=0)
+    assert encode_submit('+46708251358', 'hellohello', dcs=DCS_GSM7) == \
+        ('0001000B916407281553F800000AE8329BFD4697D9EC37', 22)
+
+
+def test_decode_ucs2_deliver():
+    message = decode(UCS2_DELIVER)
+    assert message['sender']['number'] == '8613800138000'
+    assert message['sender']['toa']['ton'] == 'international'
+    assert message['dcs']['encoding'] == 'ucs2'
+    assert message['scts'] == datetime(2025, 1, 6, 14, 56, 32, tzinfo=timezone(timedelta(hours=8)))
+    assert message['user_data']['data'] == '你好'
+
+
+def test_decode_status_report():
+    message = decode(STATUS_REPORT)
+    assert message['header']['mti'] == 'status-report'
+    assert message['message-ref'] == 0x2A
+    assert message['recipient']['number'] == '8613800138000'
+    assert message['discharge_time'] - message['scts'] == timedelta(minutes=1)
+    assert message['status'] == 0
+
+
+@pytest.mark.parametrize('pdu', ['', '00', 'ZZ', WIKI_DELIVER[:-6], UCS2_DELIVER[:-4], UCS2_DELIVER[:30]],
+                         ids=['empty', 'smsc-only', 'not-hex', 'gsm-user-data', 'ucs2-user-data', 'timestamp'])
+def test_decode_rejects_malformed(pdu):
+    with pytest.raises(PDUError):
+        decode(pdu)
+
+
+def test_decode_batch_isolates_errors():
+    results = decode_batch([WIKI_DELIVER, WIKI_DELIVER[:-6], UCS2_DELIVER, 'XYZ', STATUS_REPORT])
+    assert results[0]['user_data']['data'] == 'hellohello'
+    assert isinstance(results[1], PDUError)
+    assert results[2]['user_data']['data'] == '你好'
+    assert isinstance(results[3], PDUError)
+    assert results[4]['message-ref'] == 0x2A
+
+
+@pytest.mark.parametrize('skip', [0, 1, 6, 7, 8])
+def test_gsm7_pack_round_trip(skip):
+    septets = gsm7_septets('The quick brown fox {jumps} over €5 [lazy] dogs~')
+    packed = pack_gsm7(septets, skip)
+    # 解包时跳过的位置由调用方补齐，这里补上 skip 个 septet 占用的字节
+    prefix = bytes((skip * 7) // 8)
+    assert unpack_gsm7(prefix + packed, skip + len(septets), skip) == \
+        'The quick brown fox {jumps} over €5 [lazy] dogs~'
+
+
+def test_gsm7_extension_uses_escape():
+    assert gsm7_septets('€') == [GSM7_ESCAPE, 101]
+    assert gsm7_septets('中') is None
+
+
+@pytest.mark.parametrize('text, parts', [
+    ('a' * 160, 1),
+    ('a' * 161, 2),
+    ('a' * 153 * 2, 2),
+    ('a' * (153 * 2 + 1), 3),
+], ids=['160', '161', '306', '307'])
+def test_gsm7_boundaries(text, parts):
+    segments, lengths = _segments(text)
+    # 首字节、TP-MR、号码(13位)、TP-PID、TP-DCS、TP-UDL 共14字节，用户数据不超过140字节
+    assert max(lengths) <= 14 + 140
+    assert len(segments) == parts
+    assert all(segment['dcs']['encoding'] == 'gsm' for segment in segments)
+    assert ''.join(segment['user_data']['data'] for segment in segments) == text
+
+
+def test_gsm7_escape_counts_two_septets():
+    # 80 个扩展字符占 160 个 septet，仍是一条；再多一个就要分段
+    assert len(split_message('€' * 80)[1]) == 1
+    assert len(split_message('€' * 80 + 'a')[1]) == 2
+
+
+def test_gsm7_escape_not_split():
+    # 第153个 septet 是转义字符，应整体移到下一段
+    text = 'a' * 152 + '€' + 'b' * 10
+    dcs, parts = split_message(text)
+    assert dcs == DCS_GSM7
+    assert len(parts[0]) == 152 and parts[1][:2] == [GSM7_ESCAPE, 101]
+    segments, _ = _segments(text)
+    assert ''.join(segment['user_data']['data'] for segment in segments) == text
+
+
+@pytest.mark.parametrize('text, parts', [
+    ('中' * 70, 1),
+    ('中' * 71, 2),
+    ('中' * 67 * 2, 2),
+    ('中' * (67 * 2 + 1), 3),
+], ids=['70', '71', '134', '135'])
+def test_ucs2_boundaries(text, parts):
+    segments, _ = _segments(text)
+    assert len(segments) == parts
+    assert all(segment['dcs']['encoding'] == 'ucs2' for segment in segments)
+    assert ''.join(segment['user_data']['data'] for segment in segments) == text
+
+
+def test_ucs2_surrogate_pair_not_split():
+    # 每个 emoji 占两个 UTF-16 单元，第67个单元是高代理项，整个代理对应移到下一段
+    text = '😀' * 41
+    dcs, parts = split_message(text)
+    assert dcs == DCS_UCS2
+    assert len(parts[0]) == 66 * 2
+    segments, _ = _segments(text)
+    assert all('�' not in segment['user_data']['data'] for segment in segments)
+    assert ''.join(segment['user_data']['data'] for segment in segments) == text
+
+
+def test_surrogate_pair_fits_exactly():
+    # 35 个 emoji 正好 70 个单元，不分段
+    assert len(split_message('😀' * 35)[1]) == 1
+    assert len(split_message('😀' * 35 + 'a')[1]) == 2
+
+
+@pytest.mark.parametrize('reference_bits, per_part', [(8, 153), (16, 152)])
+def test_concat_header(reference_bits, per_part):
+    segments, _ = _segments('a' * (per_part * 3), reference_bits=reference_bits)
+    headers = [_concat(segment) for segment in segments]
+    assert [header['part_number'] for header in headers] == [1, 2, 3]
+    assert {header['parts_count'] for header in headers} == {3}
+    assert len({header['reference'] for header in headers}) == 1
+    assert [len(segment['user_data']['data']) for segment in segments] == [per_part] * 3
+
+
+def test_max_parts_boundary():
+    text = 'a' * 153 * MAX_PARTS
+    assert len(check_message_length(text)[1]) == MAX_PARTS
+    segments, _ = _segments(text)
+    assert _concat(segments[-1]) == {'reference': _concat(segments[0])['reference'],
+                                     'parts_count': MAX_PARTS, 'part_number': MAX_PARTS}
+    assert ''.join(segment['user_data']['data'] for segment in segments) == text
+    with pytest.raises(ValueError):
+        check_message_length(text + 'a')
+    with pytest.raises(ValueError):
+        encode_pdus('+8613800138000', '中' * (67 * MAX_PARTS + 1))
+
+
+def test_encode_status_report_request_and_message_refs():
+    pdus = encode_pdus('13800138000', 'a' * 200, srr=True, message_refs=iter((7, 8)))
+    segments = [decode(pdu) for pdu, _ in pdus]
+    assert [segment['message-ref'] for segment in segments] == [7, 8]
+    assert all(segment['header']['srr'] for segment in segments)
+    assert segments[0]['recipient']['toa']['ton'] == 'unknown'
@@ -0,0 +1,154 @@
+from types import SimpleNamespace
+
+import pytest
+
+from services.reassembly import Reassembler, MISSING_PART
+from services.utils.pdu import decode
+from tools.modem_simulator import deliver_pdu, deliver_pdus
+
+MODEM = SimpleNamespace(modem_id='test')
+TEXT = '长短信合并测试' * 25
+
+
+def _message(pdu, index=None):
+    """
+    与 InboxSync 交给 handler 的短信相同，存储在模块中的带有 sim
+    """
+    message = decode(pdu)
+    message['pdu'] = pdu
+    if index is not None:
+        message['sim'] = [(index, pdu)]
+    return message
+
+
+class Recorder:
+    def __init__(self, fail=0):
+        self.messages = []
+        self.released = []
+        self.fail = fail
+
+    def handler(self, modem, message):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError('database is locked')
+        self.messages.append(message)
+
+    def release(self, indexes):
+        self.released.extend(indexes)
+
+
+@pytest.fixture
+def parts():
+    pdus = deliver_pdus('+8613900000000', TEXT, reference=42)
+    assert len(pdus) == 3
+    return [_message(pdu, index) for index, pdu in enumerate(pdus, 1)]
+
+
+def _reassembler(recorder, **kwargs):
+    return Reassembler(recorder.handler, release=recorder.release, **kwargs)
+
+
+def test_plain_message_passes_through():
+    recorder = Recorder()
+    reassembler = _reassembler(recorder)
+    assert reassembler.add(MODEM, _message(deliver_pdu('+8613900000000', 'hello'), 5)) is False
+    assert [message['user_data']['data'] for message in recorder.messages] == ['hello']
+    assert recorder.released == [] and len(reassembler) == 0
+
+
+def test_parts_stay_on_sim_until_merged(parts):
+    recorder = Recorder()
+    reassembler = _reassembler(recorder)
+    assert reassembler.add(MODEM, parts[0]) is True
+    assert reassembler.add(MODEM, parts[1]) is True
+    assert recorder.messages == [] and recorder.released == []
+    # 最后一段由调用方删除，其余分段在合并保存后释放
+    assert reassembler.add(MODEM, parts[2]) is False
+    assert [message['user_data']['data'] for message in recorder.messages] == [TEXT]
+    assert recorder.messages[0]['sim'] == [part['sim'][0] for part in parts]
+    assert sorted(recorder.released) == [1, 2]
+    assert len(reassembler) == 0
+
+
+@pytest.mark.parametrize('order', [(2, 0, 1), (1, 2, 0), (2, 1, 0)])
+def test_out_of_order(parts, order):
+    recorder = Recorder()
+    reassembler = _reassembler(recorder)
+    for n in order:
+        reassembler.add(MODEM, parts[n])
+    assert [message['user_data']['data'] for message in recorder.messages] == [TEXT]
+    assert recorder.messages[0]['scts'] == min(part['scts'] for part in parts)
+    assert sorted(recorder.released) == sorted(parts[n]['sim'][0][0] for n in order[:-1])
+
+
+def test_duplicate_part_at_another_index(parts):
+    recorder = Recorder()
+    reassembler = _reassembler(recorder)
+    reassembler.add(MODEM, parts[0])
+    duplicate = _message(parts[0]['pdu'], 9)
+    # 重复的副本不保留，调用方直接删除
+    assert reassembler.add(MODEM, duplicate) is False
+    reassembler.add(MODEM, parts[1])
+    reassembler.add(MODEM, parts[2])
+    assert [message['user_data']['data'] for message in recorder.messages] == [TEXT]
+    assert sorted(recorder.released) == [1, 2]
+
+
+def test_handler_failure_keeps_parts(parts):
+    recorder = Recorder(fail=1)
+    reassembler = _reassembler(recorder)
+    reassembler.add(MODEM, parts[0])
+    reassembler.add(MODEM, parts[1])
+    with pytest.raises(RuntimeError):
+        reassembler.add(MODEM, parts[2])
+    assert recorder.released == [] and len(reassembler) == 1
+    # 最后一段仍在模块中，下次同步时再次交出
+    assert reassembler.add(MODEM, parts[2]) is False
+    assert [message['user_data']['data'] for message in recorder.messages] == [TEXT]
+    assert sorted(recorder.released) == [1, 2]
+
+
+def test_timeout_flushes_received_parts(parts):
+    recorder = Recorder()
+    reassembler = _reassembler(recorder, timeout=0)
+    reassembler.add(MODEM, parts[0])
+    reassembler.add(MODEM, parts[2])
+    reassembler.expire()
+    merged = recorder.messages[0]['user_data']['data']
+    assert merged == parts[0]['user_data']['data'] + MISSING_PART + parts[2]['user_data']['data']
+    assert sorted(recorder.released) == [1, 3]
+    assert len(reassembler) == 0
+
+
+def test_expire_keeps_recent(parts):
+    recorder = Recorder()
+    reassembler = _reassembler(recorder, timeout=300)
+    reassembler.add(MODEM, parts[0])
+    reassembler.expire()
+    assert recorder.messages == [] and len(reassembler) == 1
+
+
+def test_buffer_full_flushes_oldest(parts):
+    recorder = Recorder()
+    reassembler = _reassembler(recorder, capacity=1)
+    reassembler.add(MODEM, parts[0])
+    other = [_message(pdu, index) for index, pdu in
+             enumerate(deliver_pdus('+8613900000001', TEXT, reference=43), 11)]
+    reassembler.add(MODEM, other[0])
+    assert len(recorder.messages) == 1 and recorder.messages[0]['sender']['number'] == '8613900000000'
+    assert recorder.released == [1]
+    assert len(reassembler) == 1
+
+
+def test_flush_on_stop_keeps_sim_parts(parts):
+    recorder = Recorder()
+    reassembler = _reassembler(recorder)
+    reassembler.add(MODEM, parts[0])
+    # 直接上报(+CMT)的分段不在模块中，退出时必须保存
+    direct = [_message(pdu) for pdu in deliver_pdus('+8613900000001', TEXT, reference=44)]
+    reassembler.add(MODEM, direct[0])
+    reassembler.flush()
+    assert [message['sender']['number'] for message in recorder.messages] == ['8613900000001']
+    assert recorder.messages[0]['sim'] == []
+    assert recorder.released == []
+    assert len(reassembler) == 1
@@ -0,0 +1,73 @@
+"""
+PDU 编解码微基准：单条解析、AT+CMGL 批量解析和编码，安装了 smspdudecoder 时一并测量作对比。
+
+    python -m tools.bench_pdu
+    python -m tools.bench_pdu --batch 255 --rounds 20 --output pdu.json
+"""
+import json
+import time
+import argparse
+import platform
+from io import StringIO
+from statistics import median
+
+from services.utils.pdu import decode, decode_batch, encode_submit
+from tools.modem_simulator import deliver_pdu
+
+try:
+    from smspdudecoder.fields import SMSDeliver
+except ImportError:
+    SMSDeliver = None
+
+SAMPLES = [
+    ('+8613800000000', 'Hello world, this is a GSM 7-bit message [1]'),
+    ('+8613800000001', '验证码 123456，五分钟内有效。'),
+    ('10086', '您的话费余额为 12.34 元'),
+]
+
+
+def _timeit(func, rounds):
+    """
+    :return: 每轮耗时的中位数(秒)
+    """
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return median(timings)
+
+
+def run(batch, rounds):
+    pdus = [deliver_pdu(sender, text) for sender, text in SAMPLES]
+    listing = [pdus[i % len(pdus)] for i in range(batch)]
+    results = {
+        'decode_us': _timeit(lambda: [decode(pdu) for pdu in listing], rounds) / batch * 1e6,
+        'decode_batch_us': _timeit(lambda: decode_batch(listing), rounds) / batch * 1e6,
+        'encode_us': _timeit(lambda: [encode_submit('+8613800000000', text) for _, text in SAMPLES * (batch // 3)],
+                             rounds) / (batch // 3 * 3) * 1e6,
+    }
+    if SMSDeliver is not None:
+        results['smspdudecoder_decode_us'] = _timeit(
+            lambda: [SMSDeliver.decode(StringIO(pdu)) for pdu in listing], rounds) / batch * 1e6
+        results['speedup'] = results['smspdudecoder_decode_us'] / results['decode_batch_us']
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyAirLink PDU codec micro-benchmark')
+    parser.add_argument('--batch', type=int, default=255, help='PDUs per AT+CMGL listing')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {'python': platform.python_version(), 'batch': args.batch, **run(args.batch, args.rounds)}
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+"""
+端到端压测：在临时目录中用模拟模块(tools/modem_simulator.py)和本地的 Bark/SMTP 接收端启动 main:app，
+测量API延迟、短信发送吞吐、收到短信到推送的延迟和持续接收速率，结果输出为JSON，方便前后对比。
+
+    python -m tools.benchmark --output before.json
+    python -m tools.benchmark --output after.json --baseline before.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import socketserver
+from statistics import mean
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from tools.modem_simulator import ModemSimulator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = re.compile(r'bench-(\w+?)-(\d+)')
+
+CONFIG_TEMPLATE = """
+[DATABASE]
+SQLITE = database.sqlite
+
+[SERIAL]
+PORT = {port}
+BAUD_RATE = 115200
+TIMEOUT = 1
+QUEUE_SIZE = {queue_size}
+QUEUE_DEADLINE = 30
+
+[SMS]
+MODE = {sms_mode}
+SWEEP_INTERVAL = 60
+
+[SERVERCHAN]
+SENDKEY =
+
+[BARK]
+URL = http://127.0.0.1:{http_port}
+KEY = benchmark
+
+[MAIL]
+SMTP_SERVER = 127.0.0.1
+SMTP_PORT = {smtp_port}
+ACCOUNT = bench@example.com
+PASSWORD = password
+MAIL_TO = bench@example.com
+TLS = false
+
+[NOTIFICATION]
+CHANNELS = bark, mail
+TIMEOUT = 10
+QUEUE_SIZE = 1024
+WORKERS = 2
+MAX_ATTEMPTS = 3
+RETRY_BASE = 1
+RETRY_MAX = 10
+"""
+
+
+def summarize(samples):
+    """
+    延迟样本(秒)的统计，输出为毫秒
+    """
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(mean(ordered) * 1000, 3),
+        'p50_ms': round(percentile(50), 3),
+        'p95_ms': round(percentile(95), 3),
+        'p99_ms': round(percentile(99), 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+class Arrivals:
+    """
+    按短信中的 bench-<phase>-<n> 标记记录到达接收端的时间，只记录当前阶段的短信，
+    上一阶段迟到的推送不会计入
+    """
+
+    def __init__(self):
+        self.phase = None
+        self.times = {}
+        self.lock = threading.Lock()
+        self.received = threading.Condition(self.lock)
+
+    def record(self, text):
+        match = TOKEN.search(text)
+        if not match:
+            return
+        with self.lock:
+            if match.group(1) != self.phase:
+                return
+            self.times.setdefault(int(match.group(2)), time.perf_counter())
+            self.received.notify_all()
+
+    def wait(self, count, timeout):
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while len(self.times) < count and time.monotonic() < deadline:
+                self.received.wait(max(0.0, deadline - time.monotonic()))
+            return len(self.times)
+
+    def clear(self, phase=None):
+        with self.lock:
+            self.phase = phase
+            self.times.clear()
+
+
+class HTTPSink(ThreadingHTTPServer):
+    """
+    代替 Bark 服务端，记录每次推送到达的时间，delay 模拟慢速的推送服务
+    """
+    daemon_threads = True
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.arrivals = Arrivals()
+        super().__init__(('127.0.0.1', 0), self._Handler)
+
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.server.arrivals.record(body.decode(errors='replace'))
+            if self.server.delay:
+                time.sleep(self.server.delay)
+            payload = b'{"code":200,"message":"success"}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    只实现 smtplib 用到的最小SMTP会话：EHLO、AUTH、MAIL、RCPT、DATA、NOOP、RSET、QUIT
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        self.arrivals = Arrivals()
+        super().__init__(('127.0.0.1', 0), self._Handler)
+
+    class _Handler(socketserver.StreamRequestHandler):
+        def reply(self, line):
+            self.wfile.write(line.encode() + b'\r\n')
+
+        def handle(self):
+            self.reply('220 benchmark ESMTP')
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                verb = line.decode(errors='replace').strip().split(' ', 1)[0].upper()
+                if verb == 'EHLO':
+                    self.wfile.write(b'250-benchmark\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+                elif verb == 'HELO':
+                    self.reply('250 benchmark')
+                elif verb == 'AUTH':
+                    self.reply('235 Authentication successful')
+                elif verb == 'DATA':
+                    self.reply('354 End data with <CR><LF>.<CR><LF>')
+                    message = []
+                    for data in self.rfile:
+                        if data in (b'.\r\n', b'.\n'):
+                            break
+                        message.append(data)
+                    self.server.arrivals.record(b''.join(message).decode(errors='replace'))
+                    self.reply('250 OK')
+                elif verb == 'QUIT':
+                    self.reply('221 Bye')
+                    return
+                else:
+                    self.reply('250 OK')
+
+
+def _serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_requests(method, url, params_list, concurrency):
+    """
+    并发调用API
+    :return: (延迟样本, 状态码计数, 总耗时)
+    """
+    local = threading.local()
+    statuses = {}
+    lock = threading.Lock()
+
+    def call(params):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        response = local.session.request(method, url, params=params, timeout=120)
+        elapsed = time.perf_counter() - start
+        with lock:
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        return elapsed if response.status_code == 200 else None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        samples = [sample for sample in executor.map(call, params_list) if sample is not None]
+    return samples, statuses, time.perf_counter() - start
+
+
+def bench_command(base, args):
+    samples, statuses, elapsed = run_requests('POST', f'{base}/api/v1/module/command/base',
+                                              [{'command': 'AT+CSQ'}] * args.requests, args.concurrency)
+    return {**summarize(samples), 'statuses': statuses, 'throughput_per_s': round(len(samples) / elapsed, 2)}
+
+
+def bench_send(base, args, simulator):
+    sent_before = len(simulator.sent)
+    params = [{'country': 86, 'number': 13800138000, 'message': f'bench send {i}'} for i in range(args.sms)]
+    samples, statuses, elapsed = run_requests('POST', f'{base}/api/v1/sms/sms/send', params, args.concurrency)
+    sent = len(simulator.sent) - sent_before
+    return {**summarize(samples), 'statuses': statuses, 'modem_accepted': sent,
+            'sms_per_minute': round(sent / elapsed * 60, 1)}
+
+
+def bench_receive(simulator, sinks, phase, count, interval, timeout):
+    """
+    按固定间隔注入短信，统计从模块上报到各推送渠道收到的延迟
+    :param phase: 阶段名，作为短信标记的前缀，各阶段的短信内容互不相同
+    """
+    for sink in sinks.values():
+        sink.arrivals.clear(phase)
+    injected = {}
+    rejected = simulator.stats['rejected']
+    start = time.perf_counter()
+    for n in range(count):
+        injected[n] = time.perf_counter()
+        simulator.inject(text=f'bench-{phase}-{n}')
+        if interval:
+            time.sleep(max(0.0, start + (n + 1) * interval - time.perf_counter()))
+    inject_elapsed = time.perf_counter() - start
+    result = {'injected': count, 'rejected_by_sim': simulator.stats['rejected'] - rejected}
+    for name, sink in sinks.items():
+        received = sink.arrivals.wait(count, timeout)
+        times = dict(sink.arrivals.times)
+        latencies = [times[n] - injected[n] for n in times if n in injected]
+        channel = {**summarize(latencies), 'received': received}
+        if times:
+            # 从第一条注入到最后一条推送完成的平均速率
+            channel['rate_per_s'] = round(received / (max(times.values()) - start), 2)
+        result[name] = channel
+    result['inject_rate_per_s'] = round(count / inject_elapsed, 2) if inject_elapsed else None
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(result, baseline, path=()):
+    """
+    打印与上一次结果相比的变化，只比较数值项
+    """
+    for key, value in result.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            compare(value, old, path + (key,))
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            change = (value - old) / old * 100
+            print(f"{'.'.join(path + (key,)):<48} {old:>12} -> {value:<12} {change:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyAirLink end-to-end benchmark')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='previous JSON results to compare against')
+    parser.add_argument('--requests', type=int, default=500, help='AT command API calls')
+    parser.add_argument('--sms', type=int, default=50, help='SMS send API calls')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--receive', type=int, default=50, help='messages for receive-to-push latency')
+    parser.add_argument('--receive-interval', type=float, default=0.1)
+    parser.add_argument('--sustained', type=float, default=10, help='seconds of sustained incoming SMS')
+    parser.add_argument('--sustained-rate', type=float, default=20, help='incoming SMS per second')
+    parser.add_argument('--modem-latency', type=float, default=0.005, help='simulated per-command latency')
+    parser.add_argument('--cmgs-latency', type=float, default=0.5, help='simulated network latency of AT+CMGS')
+    parser.add_argument('--storage', type=int, default=255, help='simulated SIM storage')
+    parser.add_argument('--sink-delay', type=float, default=0.0, help='Bark sink response delay')
+    parser.add_argument('--sms-mode', choices=['event', 'poll'], default='event')
+    parser.add_argument('--queue-size', type=int, default=64)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    simulator = ModemSimulator(latency=args.modem_latency, command_latency={'CMGS': args.cmgs_latency},
+                               storage=args.storage).start()
+    http_sink = _serve(HTTPSink(delay=args.sink_delay))
+    smtp_sink = _serve(SMTPSink())
+    sinks = {'bark': http_sink, 'mail': smtp_sink}
+
+    # 应用在导入时读取 data/config.ini，并把数据库放在 data/ 下，所以切换到临时目录后再导入
+    workdir = tempfile.mkdtemp(prefix='pyairlink-bench-')
+    os.makedirs(os.path.join(workdir, 'data'))
+    with open(os.path.join(workdir, 'data', 'config.ini'), 'w') as f:
+        f.write(CONFIG_TEMPLATE.format(port=simulator.port, queue_size=args.queue_size, sms_mode=args.sms_mode,
+                                       http_port=http_sink.server_address[1],
+                                       smtp_port=smtp_sink.server_address[1]))
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import uvicorn
+    import main as app_module
+
+    logging.getLogger("PyAirLink").setLevel(logging.INFO if args.verbose else logging.WARNING)
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app_module.app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    base = f'http://127.0.0.1:{port}'
+
+    results = {
+        'meta': {
+            'revision': _git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': vars(args),
+        },
+    }
+    try:
+        results['command_base'] = bench_command(base, args)
+        results['sms_send'] = bench_send(base, args, simulator)
+        results['receive_to_push'] = bench_receive(simulator, sinks, 'receive', args.receive, args.receive_interval, 60)
+        count = int(args.sustained * args.sustained_rate)
+        sustained = bench_receive(simulator, sinks, 'sustained', count, 1 / args.sustained_rate,
+                                  60 + args.sustained)
+        sustained['target_rate_per_s'] = args.sustained_rate
+        results['sustained_receive'] = sustained
+    finally:
+        server.should_exit = True
+        thread.join()
+        simulator.stop()
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare({k: v for k, v in results.items() if k != 'meta'}, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
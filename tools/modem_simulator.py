@@ -0,0 +1,626 @@
+"""
+模拟 Air780E 的伪终端(pty)模块，用于在没有硬件的情况下做压测和问题复现。
+
+把 config.ini 中 [SERIAL] PORT 指向模拟器打印的路径(或 --link 指定的固定路径)即可；
+加上 --tcp 时同时像串口服务器(DTU)一样在TCP端口上透传，PORT 写 tcp://host:port。
+支持 ATCommands 用到的 3GPP TS 27.005 子集：
+AT/ATE、CPIN、CMGF、CSCS、CPMS、CNMI、CGATT、CMGL、CMGR、CMGD、CMGS(带 '>' 提示符)、CSQ、RESET。
+
+    python -m tools.modem_simulator --link /tmp/ttyAIR --latency 0.02 --latency CMGS=1.5 --storage 50
+    python -m tools.modem_simulator --tcp 127.0.0.1:7000
+
+运行时可以在标准输入中输入控制命令，输入 help 查看。
+"""
+import os
+import re
+import pty
+import tty
+import time
+import random
+import select
+import socket
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone, timedelta
+
+logger = logging.getLogger("PyAirLink.simulator")
+
+# <stat>: 0 已接收未读 1 已接收已读 2 已存储未发送 3 已存储已发送 4 全部
+REC_UNREAD, REC_READ, STO_UNSENT, STO_SENT, ALL = range(5)
+
+_COMMAND_NAME = re.compile(r'AT\+?([A-Z]*)', re.IGNORECASE)
+
+
+def _semi_octets(digits):
+    digits = digits + 'F' if len(digits) % 2 else digits
+    return ''.join(digits[i + 1] + digits[i] for i in range(0, len(digits), 2))
+
+
+def deliver_pdu(sender, text, scts=None, udh=None):
+    """
+    构造一条 UCS2 编码的 SMS-DELIVER PDU，SMSC部分为空
+    :param sender: 发送方号码，以 + 开头时按国际号码编码
+    :param text: 短信内容，最多70个字符，带用户数据头时相应减少
+    :param scts: 服务中心时间戳，默认为当前时间
+    :param udh: 用户数据头的十六进制字符串(含长度字节)
+    """
+    toa = '91' if sender.startswith('+') else '81'
+    number = sender.lstrip('+')
+    scts = (scts or datetime.now(timezone.utc)).astimezone(timezone(timedelta(hours=8)))
+    timestamp = _semi_octets(scts.strftime('%y%m%d%H%M%S') + '32')  # 时区 +8 小时，即32个15分钟
+    user_data = (udh or '') + text.encode('utf-16-be').hex().upper()
+    return (
+            '00' +  # SMSC为空
+            ('44' if udh else '04') +  # SMS-DELIVER，没有更多短信，带用户数据头时置 TP-UDHI
+            f'{len(number):02X}' + toa + _semi_octets(number) +
+            '00' +  # TP-PID
+            '08' +  # TP-DCS UCS2
+            timestamp +
+            f'{len(user_data) // 2:02X}' + user_data
+    )
+
+
+def deliver_pdus(sender, text, scts=None, reference=None):
+    """
+    超过70个字符时按长短信切分，每段67个字符，带8位参考号的用户数据头
+    """
+    if len(text) <= 70:
+        return [deliver_pdu(sender, text, scts)]
+    chunks = [text[i:i + 67] for i in range(0, len(text), 67)]
+    reference = random.randrange(256) if reference is None else reference
+    return [deliver_pdu(sender, chunk, scts, udh=f'050003{reference:02X}{len(chunks):02X}{number:02X}')
+            for number, chunk in enumerate(chunks, 1)]
+
+
+def status_report_pdu(message_ref, recipient, scts, discharge_time, status=0):
+    """
+    构造一条 SMS-STATUS-REPORT PDU，SMSC部分为空
+    :param recipient: (号码位数, 类型, 半八位组编码的号码)，直接取自 SMS-SUBMIT 中的目标地址
+    """
+    digits, toa, number = recipient
+    return '00' + '06' + f'{message_ref:02X}' + f'{digits:02X}' + toa + number + _timestamp(scts) + \
+        _timestamp(discharge_time) + f'{status:02X}'
+
+
+def _timestamp(moment):
+    moment = moment.astimezone(timezone(timedelta(hours=8)))
+    return _semi_octets(moment.strftime('%y%m%d%H%M%S') + '32')
+
+
+class ModemSimulator:
+    """
+    打开一对 pty，在后台线程中按行处理AT指令。
+    所有故障注入参数都可以在运行时直接修改属性。
+    """
+
+    def __init__(self, latency=0.0, command_latency=None, storage=50, drop_rate=0.0, error_rate=0.0,
+                 attach_delay=0.0, reset_time=2.0, echo=False, link=None, seed=None, delivery_delay=1.0,
+                 delivery_status=0, tcp=None):
+        """
+        :param latency: 每条指令的默认回应延迟(秒)
+        :param command_latency: 按指令名单独设置的延迟，如 {'CMGS': 1.5, 'CMGL': 0.2}
+        :param storage: SIM卡短信存储容量，存满后新短信被丢弃
+        :param drop_rate: 每次输出随机丢掉一段字节的概率
+        :param error_rate: 指令随机返回 ERROR 的概率
+        :param attach_delay: 启动或重启后多久才附着网络(+CGATT: 1)
+        :param reset_time: AT+RESET 后串口消失的秒数，0表示不消失
+        :param echo: 是否回显指令(ATE1)
+        :param link: 指向当前pty的符号链接路径，串口消失重建后路径保持不变
+        :param delivery_delay: 请求了状态报告的短信在多久后以 +CDS 上报(需要 AT+CNMI 的 ds=1)
+        :param delivery_status: 状态报告中的 TP-ST，0为已送达
+        :param tcp: (host, port)，在该地址上透传pty的数据，模拟串口服务器，同一时间只接受一个连接
+        """
+        self.latency = latency
+        self.command_latency = {k.upper(): v for k, v in (command_latency or {}).items()}
+        self.storage = storage
+        self.drop_rate = drop_rate
+        self.error_rate = error_rate
+        self.attach_delay = attach_delay
+        self.reset_time = reset_time
+        self.echo = echo
+        self.link = link
+        self.delivery_delay = delivery_delay
+        self.delivery_status = delivery_status
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._master = None
+        self._slave = None
+        self._path = None
+        self._buffer = b''
+        self._pdu_length = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.tcp = tcp
+        self._server = None
+        self._tcp_thread = None
+        self.sim_ready = True
+        self.messages = {}
+        self.sent = []
+        self.stats = {'commands': 0, 'injected': 0, 'rejected': 0, 'dropped_writes': 0, 'errors': 0, 'vanished': 0}
+        self._reset_state()
+
+    def _reset_state(self):
+        self.cnmi_mt = 0
+        self.cnmi_ds = 0
+        self.cmgf = 1
+        self.cmms = 0
+        self._message_reference = 0
+        self._attach_at = time.monotonic() + self.attach_delay
+
+    @property
+    def port(self):
+        """
+        客户端应当打开的路径
+        """
+        if self.tcp:
+            return f'tcp://{self.tcp[0]}:{self._server.getsockname()[1] if self._server else self.tcp[1]}'
+        return self.link or self._path
+
+    def start(self):
+        self._open()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='modem-simulator', daemon=True)
+        self._thread.start()
+        if self.tcp:
+            self._server = socket.create_server(self.tcp)
+            self._server.settimeout(0.2)
+            self._tcp_thread = threading.Thread(target=self._serve_tcp, name='modem-simulator-tcp', daemon=True)
+            self._tcp_thread.start()
+        logger.info(f"Modem simulator listening on {self.port}")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._tcp_thread:
+            self._tcp_thread.join()
+            self._tcp_thread = None
+            self._server.close()
+            self._server = None
+        self._close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _open(self):
+        master, slave = pty.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        with self._lock:
+            # 模拟器自己也保持 slave 打开，客户端断开时读 master 不会出错
+            self._master, self._slave, self._path = master, slave, os.ttyname(slave)
+            self._buffer = b''
+            self._pdu_length = None
+        if self.link:
+            tmp = f'{self.link}.tmp'
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            os.symlink(self._path, tmp)
+            os.replace(tmp, self.link)
+
+    def _close(self):
+        with self._lock:
+            fds, self._master, self._slave = (self._master, self._slave), None, None
+        for fd in fds:
+            if fd is not None:
+                os.close(fd)
+        if self.link and os.path.lexists(self.link):
+            os.remove(self.link)
+
+    def _serve_tcp(self):
+        while not self._stop.is_set():
+            try:
+                client, address = self._server.accept()
+            except socket.timeout:
+                continue
+            logger.info(f"TCP client connected from {address[0]}:{address[1]}")
+            try:
+                self._bridge(client)
+            finally:
+                client.close()
+                logger.info("TCP client disconnected")
+
+    def _bridge(self, client):
+        """
+        在TCP连接和pty之间双向转发，pty消失(vanish)时断开连接，与串口服务器断电的表现一致
+        """
+        try:
+            fd = os.open(self._path, os.O_RDWR | os.O_NOCTTY)
+        except (OSError, TypeError):
+            return
+        try:
+            while not self._stop.is_set() and self._master is not None:
+                readable, _, _ = select.select([client, fd], [], [], 0.2)
+                if client in readable:
+                    data = client.recv(4096)
+                    if not data:
+                        return
+                    os.write(fd, data)
+                if fd in readable:
+                    client.sendall(os.read(fd, 4096))
+        except OSError:
+            return
+        finally:
+            os.close(fd)
+
+    def vanish(self, seconds):
+        """
+        模拟USB断开：关闭pty，seconds 秒后重新创建
+        """
+        self.stats['vanished'] += 1
+        logger.info(f"Port vanished for {seconds}s")
+        self._close()
+        if not self._stop.wait(seconds):
+            self._open()
+            logger.info(f"Port is back on {self.port}")
+
+    def inject(self, pdu=None, sender='+8613800138000', text='simulated message'):
+        """
+        模拟收到一条短信，按 CNMI 设置存储并上报 +CMTI，或者直接以 +CMT 上报
+        超过70个字符的 text 按长短信分段依次注入
+        :return: 存储的索引(长短信为最后一段的索引)，直接上报或存储已满时返回None
+        """
+        if pdu is None and len(text) > 70:
+            index = None
+            for part in deliver_pdus(sender, text):
+                index = self.inject(part)
+            return index
+        pdu = pdu or deliver_pdu(sender, text)
+        self.stats['injected'] += 1
+        if self.cnmi_mt == 2:
+            self._write(f'\r\n+CMT: ,{self._tpdu_length(pdu)}\r\n{pdu}\r\n')
+            return None
+        with self._lock:
+            index = next((i for i in range(1, self.storage + 1) if i not in self.messages), None)
+            if index is None:
+                self.stats['rejected'] += 1
+                logger.warning("SIM storage is full, incoming message rejected")
+                return None
+            self.messages[index] = [REC_UNREAD, pdu]
+        if self.cnmi_mt == 1:
+            self._write(f'\r\n+CMTI: "SM",{index}\r\n')
+        return index
+
+    def _write(self, text):
+        data = text.encode()
+        if data and self.drop_rate and self._random.random() < self.drop_rate:
+            start = self._random.randrange(len(data))
+            end = start + self._random.randint(1, max(1, len(data) // 2))
+            data = data[:start] + data[end:]
+            self.stats['dropped_writes'] += 1
+        with self._lock:
+            if self._master is None:
+                return
+            try:
+                os.write(self._master, data)
+            except OSError:
+                pass
+
+    def _run(self):
+        while not self._stop.is_set():
+            master = self._master
+            if master is None:
+                self._stop.wait(0.1)
+                continue
+            try:
+                readable, _, _ = select.select([master], [], [], 0.2)
+                if not readable:
+                    continue
+                data = os.read(master, 4096)
+            except (OSError, ValueError):
+                # 串口被 vanish 关闭
+                continue
+            self._buffer += data
+            self._process()
+
+    def _process(self):
+        while True:
+            if self._pdu_length is not None:
+                # 等待 PDU 数据，以 Ctrl+Z 结束，ESC 取消
+                for terminator in (b'\x1a', b'\x1b'):
+                    if terminator in self._buffer:
+                        pdu, self._buffer = self._buffer.split(terminator, 1)
+                        self._pdu_length = None
+                        if terminator == b'\x1a':
+                            self._handle_pdu(pdu.decode(errors='replace').strip())
+                        break
+                else:
+                    return
+                continue
+            if b'\r' not in self._buffer:
+                return
+            line, self._buffer = self._buffer.split(b'\r', 1)
+            self._buffer = self._buffer.lstrip(b'\n')
+            command = line.decode(errors='replace').strip()
+            if command:
+                self._handle(command)
+
+    def _handle(self, command):
+        self.stats['commands'] += 1
+        if self.echo:
+            self._write(command + '\r')
+        match = _COMMAND_NAME.match(command)
+        name = match.group(1).upper() if match else ''
+        delay = self.command_latency.get(name or 'AT', self.latency)
+        if delay:
+            time.sleep(delay)
+        if not match:
+            self._write('\r\nERROR\r\n')
+            return
+        if self.error_rate and name not in ('', 'RESET') and self._random.random() < self.error_rate:
+            self.stats['errors'] += 1
+            self._write('\r\nERROR\r\n')
+            return
+        handler = getattr(self, f'_at_{name.lower()}', None) if name else self._at
+        if command.upper().startswith('ATE'):
+            handler = self._ate
+        argument = command[match.end():]
+        try:
+            response = handler(argument) if handler else 'ERROR'
+        except (ValueError, IndexError):
+            response = '+CME ERROR: 50'
+        if response is not None:
+            self._write(f'\r\n{response}\r\n')
+
+    def _handle_pdu(self, pdu):
+        if self.echo:
+            self._write(pdu + '\r\n')
+        self.sent.append(pdu)
+        self._message_reference = (self._message_reference + 1) % 256
+        self._write(f'\r\n+CMGS: {self._message_reference}\r\n\r\nOK\r\n')
+        self._schedule_status_report(pdu, self._message_reference)
+
+    def _schedule_status_report(self, pdu, message_ref):
+        # 跳过SMSC部分，首字节 TP-SRR(0x20) 表示请求状态报告
+        tpdu = pdu[2 + int(pdu[:2], 16) * 2:]
+        if not int(tpdu[:2], 16) & 0x20 or self.cnmi_ds != 1:
+            return
+        digits = int(tpdu[4:6], 16)
+        recipient = (digits, tpdu[6:8], tpdu[8:8 + (digits + 1) // 2 * 2])
+        submitted = datetime.now(timezone.utc)
+
+        def report():
+            if self._stop.is_set():
+                return
+            report_pdu = status_report_pdu(message_ref, recipient, submitted, datetime.now(timezone.utc),
+                                           self.delivery_status)
+            self._write(f'\r\n+CDS: {len(report_pdu) // 2 - 1}\r\n{report_pdu}\r\n')
+
+        timer = threading.Timer(self.delivery_delay, report)
+        timer.daemon = True
+        timer.start()
+
+    def _at(self, argument):
+        return 'OK'
+
+    def _ate(self, argument):
+        self.echo = argument.strip().upper() != 'E0'
+        return 'OK'
+
+    def _at_cpin(self, argument):
+        if not self.sim_ready:
+            return '+CME ERROR: 10'
+        return '+CPIN: READY\r\n\r\nOK'
+
+    def _at_cmgf(self, argument):
+        self.cmgf = int(argument.lstrip('=') or 0)
+        return 'OK'
+
+    def _at_cmms(self, argument):
+        if argument.startswith('?'):
+            return f'+CMMS: {self.cmms}\r\n\r\nOK'
+        self.cmms = int(argument.lstrip('=') or 0)
+        return 'OK'
+
+    def _at_cscs(self, argument):
+        return 'OK'
+
+    def _at_cnmi(self, argument):
+        params = argument.lstrip('=').split(',')
+        self.cnmi_mt = int(params[1]) if len(params) > 1 and params[1] else 0
+        self.cnmi_ds = int(params[3]) if len(params) > 3 and params[3] else 0
+        return 'OK'
+
+    def _at_cpms(self, argument):
+        used = len(self.messages)
+        if argument.startswith('?'):
+            return f'+CPMS: "SM",{used},{self.storage},"SM",{used},{self.storage},"SM",{used},{self.storage}\r\n\r\nOK'
+        return f'+CPMS: {used},{self.storage},{used},{self.storage},{used},{self.storage}\r\n\r\nOK'
+
+    def _at_cgatt(self, argument):
+        if argument.startswith('?'):
+            return f'+CGATT: {int(time.monotonic() >= self._attach_at)}\r\n\r\nOK'
+        return 'OK'
+
+    def _at_csq(self, argument):
+        return '+CSQ: 20,99\r\n\r\nOK'
+
+    def _registration(self, name):
+        stat = 1 if time.monotonic() >= self._attach_at else 2
+        return f'+{name}: 0,{stat}\r\n\r\nOK'
+
+    def _at_creg(self, argument):
+        return self._registration('CREG')
+
+    def _at_cereg(self, argument):
+        return self._registration('CEREG')
+
+    def _at_cops(self, argument):
+        if time.monotonic() < self._attach_at:
+            return '+COPS: 0\r\n\r\nOK'
+        return '+COPS: 0,0,"CHINA MOBILE",7\r\n\r\nOK'
+
+    def _at_ccid(self, argument):
+        return '89860012345678901234\r\n\r\nOK'
+
+    def _at_cimi(self, argument):
+        return '460001234567890\r\n\r\nOK'
+
+    @staticmethod
+    def _tpdu_length(pdu):
+        """
+        +CMGL/+CMGR 中的 <length>：不含SMSC部分的字节数
+        """
+        return len(pdu) // 2 - int(pdu[:2], 16) - 1
+
+    def _at_cmgl(self, argument):
+        stat = int(argument.lstrip('=') or 0)
+        lines = []
+        with self._lock:
+            for index, message in sorted(self.messages.items()):
+                if stat == ALL or message[0] == stat:
+                    lines.append(f'+CMGL: {index},{message[0]},,{self._tpdu_length(message[1])}\r\n{message[1]}')
+                    if message[0] == REC_UNREAD:
+                        message[0] = REC_READ
+        return '\r\n'.join(lines + ['', 'OK']) if lines else 'OK'
+
+    def _at_cmgr(self, argument):
+        index = int(argument.lstrip('='))
+        with self._lock:
+            message = self.messages.get(index)
+            if message is None:
+                return '+CMS ERROR: 321'
+            response = f'+CMGR: {message[0]},,{self._tpdu_length(message[1])}\r\n{message[1]}\r\n\r\nOK'
+            if message[0] == REC_UNREAD:
+                message[0] = REC_READ
+        return response
+
+    def _at_cmgd(self, argument):
+        params = argument.lstrip('=').split(',')
+        index = int(params[0])
+        flag = int(params[1]) if len(params) > 1 else 0
+        # <delflag>: 0 指定索引 1 已读 2 已读和已发送 3 已读、已发送和未发送 4 全部
+        stats = {1: (REC_READ,), 2: (REC_READ, STO_SENT), 3: (REC_READ, STO_SENT, STO_UNSENT),
+                 4: (REC_UNREAD, REC_READ, STO_SENT, STO_UNSENT)}.get(flag)
+        with self._lock:
+            if stats is None:
+                self.messages.pop(index, None)
+            else:
+                self.messages = {i: m for i, m in self.messages.items() if m[0] not in stats}
+        return 'OK'
+
+    def _at_cmgs(self, argument):
+        if self.cmgf != 0:
+            # 文本模式下 AT+CMGS 的参数应为号码
+            return '+CMS ERROR: 304'
+        self._pdu_length = int(argument.lstrip('='))
+        self._write('\r\n> ')
+        return None
+
+    def _at_reset(self, argument):
+        self._write('\r\nOK\r\n')
+        self._reset_state()
+        if self.reset_time:
+            threading.Thread(target=self._reboot, daemon=True).start()
+        else:
+            self._write('\r\nRDY\r\n')
+        return None
+
+    def _reboot(self):
+        self.vanish(self.reset_time)
+        self._write('\r\nRDY\r\n')
+
+
+def _tcp_option(value):
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def _latency_option(value):
+    if '=' in value:
+        name, seconds = value.split('=', 1)
+        return name.upper(), float(seconds)
+    return None, float(value)
+
+
+CONSOLE_HELP = """commands:
+  inject [count] [sender] [text]  simulate incoming SMS
+  vanish <seconds>                close the pty and recreate it later
+  drop <rate>                     probability of dropping bytes from each write
+  error <rate>                    probability of answering ERROR
+  latency [CMD] <seconds>         default or per-command latency
+  sim <ready|absent>              SIM card state for AT+CPIN?
+  status                          show storage and counters
+  quit"""
+
+
+def _console(simulator):
+    while True:
+        try:
+            line = input()
+        except EOFError:
+            return
+        args = line.split()
+        if not args:
+            continue
+        command, args = args[0].lower(), args[1:]
+        try:
+            if command == 'inject':
+                count = int(args[0]) if args else 1
+                for _ in range(count):
+                    simulator.inject(sender=args[1] if len(args) > 1 else '+8613800138000',
+                                     text=' '.join(args[2:]) or 'simulated message')
+            elif command == 'vanish':
+                threading.Thread(target=simulator.vanish, args=(float(args[0]),), daemon=True).start()
+            elif command == 'drop':
+                simulator.drop_rate = float(args[0])
+            elif command == 'error':
+                simulator.error_rate = float(args[0])
+            elif command == 'latency':
+                if len(args) > 1:
+                    simulator.command_latency[args[0].upper()] = float(args[1])
+                else:
+                    simulator.latency = float(args[0])
+            elif command == 'sim':
+                simulator.sim_ready = args[0] == 'ready'
+            elif command == 'status':
+                print(f'port: {simulator.port}, stored: {len(simulator.messages)}/{simulator.storage}, '
+                      f'sent: {len(simulator.sent)}, stats: {simulator.stats}')
+            elif command == 'quit':
+                return
+            else:
+                print(CONSOLE_HELP)
+        except (ValueError, IndexError):
+            print(CONSOLE_HELP)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pseudo-terminal Air780E simulator')
+    parser.add_argument('--link', help='stable symlink to the pty, point [SERIAL] PORT here')
+    parser.add_argument('--tcp', type=_tcp_option, help='[HOST:]PORT, also serve the modem over raw TCP like a DTU')
+    parser.add_argument('--latency', action='append', type=_latency_option, default=[],
+                        help='seconds, or CMD=seconds for a single command; repeatable')
+    parser.add_argument('--storage', type=int, default=50, help='SIM storage capacity')
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--attach-delay', type=float, default=0.0)
+    parser.add_argument('--reset-time', type=float, default=2.0)
+    parser.add_argument('--incoming-rate', type=float, default=0.0, help='incoming SMS per second')
+    parser.add_argument('--echo', action='store_true')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    latency = dict(args.latency)
+    simulator = ModemSimulator(latency=latency.pop(None, 0.0), command_latency=latency, storage=args.storage,
+                               drop_rate=args.drop_rate, error_rate=args.error_rate,
+                               attach_delay=args.attach_delay, reset_time=args.reset_time, echo=args.echo,
+                               link=args.link, seed=args.seed, tcp=args.tcp)
+    with simulator:
+        if args.incoming_rate:
+            def generate():
+                while not simulator._stop.wait(1 / args.incoming_rate):
+                    simulator.inject()
+            threading.Thread(target=generate, daemon=True).start()
+        print(f'[SERIAL] PORT = {simulator.port}')
+        _console(simulator)
+
+
+if __name__ == '__main__':
+    main()